@@ -0,0 +1,117 @@
+"""Extract the frozen encoder features of SoRA training data."""
+
+import torch
+import torch.distributed as dist
+import mindspeed.megatron_adaptor
+from megatron.training.initialize import initialize_megatron
+from megatron.training import get_args, print_rank_0
+
+from mindspeed_mm.configs.config import merge_mm_args, mm_extra_args_provider
+from mindspeed_mm.data import build_mm_dataset
+from mindspeed_mm.data.data_utils.transform_pipeline import DeferredResizeTransform, Uint8NormTransform
+from mindspeed_mm.data.data_utils.feature_store import (
+    FeatureStore,
+    LATENT_MOMENTS,
+    NULL_TEXT_KEY,
+    PROMPT_FEATURES,
+    PROMPT_FEATURES_2
+)
+from mindspeed_mm.models.ae import AEModel
+from mindspeed_mm.models.text_encoder import TextEncoder
+from mindspeed_mm.utils.utils import get_dtype, is_npu_available
+
+if is_npu_available():
+    import torch_npu
+    from torch_npu.contrib import transfer_to_npu
+
+
+def prepare_encoders(model_args, device):
+    weight_dtype = get_dtype(model_args.weight_dtype)
+    ae = AEModel(model_args.ae).to(device).eval()
+    text_encoder = TextEncoder(model_args.text_encoder).to(device, weight_dtype).eval()
+    text_encoder_2 = None
+    if model_args.get("text_encoder_2", None) is not None:
+        text_encoder_2 = TextEncoder(model_args.text_encoder_2).to(device, weight_dtype).eval()
+    return ae, text_encoder, text_encoder_2
+
+
+def encode_texts(texts, dataset, text_encoder, text_encoder_2, device):
+    prompt_ids, prompt_mask, prompt_ids_2, prompt_mask_2 = dataset.get_text_processer(texts)
+    prompt = text_encoder.encode(prompt_ids.to(device), prompt_mask.to(device))
+    # keep only the valid tokens, the dataset pads them back to model_max_length
+    features = {
+        PROMPT_FEATURES: [
+            prompt[i, :int(prompt_mask[i].sum())].cpu().clone() for i in range(len(texts))
+        ],
+        PROMPT_FEATURES_2: None,
+    }
+    if text_encoder_2 is not None and prompt_ids_2 is not None:
+        prompt_2 = text_encoder_2.encode(prompt_ids_2.to(device), prompt_mask_2.to(device))
+        features[PROMPT_FEATURES_2] = [prompt_2[i:i + 1].cpu().clone() for i in range(len(texts))]
+    return features
+
+
+def main():
+    initialize_megatron(extra_args_provider=mm_extra_args_provider, args_defaults={})
+    args = get_args()
+    merge_mm_args(args)
+    torch.set_grad_enabled(False)
+    device = torch.cuda.current_device()
+    rank = dist.get_rank() if dist.is_initialized() else 0
+    world_size = dist.get_world_size() if dist.is_initialized() else 1
+
+    dataset_param = args.mm.data.dataset_param.to_dict()
+    # captions are all encoded here, cfg drop is applied by the dataset when reading features
+    dataset_param["preprocess_parameters"]["cfg"] = 0.0
+    # the features are keyed by the frame window of the sample, a random temporal crop would be frozen into them
+    dataset_param["preprocess_parameters"]["temporal_crop"] = "center"
+    dataset_param["use_feature_data"] = False
+    dataset = build_mm_dataset(dataset_param)
+    feature_store_path = dataset_param.get("feature_store_path", None)
+    feature_store = FeatureStore(feature_store_path)
+
+    ae, text_encoder, text_encoder_2 = prepare_encoders(args.mm.model, device)
+    deferred_resize = DeferredResizeTransform(dataset.train_pipeline) if dataset.deferred_resize is not None else None
+    uint8_norm = Uint8NormTransform(dataset.train_pipeline) if dataset.train_pipeline.get("uint8_transport") else None
+
+    if rank == 0 and not feature_store.exists(NULL_TEXT_KEY):
+        feature_store.save(NULL_TEXT_KEY, encode_texts([""], dataset, text_encoder, text_encoder_2, device))
+
+    num_saved, num_skipped, num_failed = 0, 0, 0
+    for index in range(rank, len(dataset), world_size):
+        sample = dataset.data_samples[index]
+        key = dataset.get_feature_key(sample)
+        if feature_store.exists(key):
+            num_skipped += 1
+            continue
+        try:
+            video = dataset.get_visual_data(sample)
+            resize_info = dataset.get_resize_info(video)
+            video = video.unsqueeze(0).to(device)
+            if resize_info is not None:
+                # a single clip is not padded: num_frames and the padded size are its own
+                resize_info = torch.cat([resize_info, resize_info.new_tensor([video.shape[2], *resize_info[2:4]])])
+                video = deferred_resize(video, resize_info.unsqueeze(0))
+            elif uint8_norm is not None:
+                # a single clip is not padded, there is no padding to zero
+                video = uint8_norm(video)
+            video = video.to(ae.dtype)
+            features = encode_texts(dataset.get_text_candidates(sample), dataset, text_encoder, text_encoder_2, device)
+            features[LATENT_MOMENTS] = ae.encode_moments(video)[0].cpu().clone()
+        except Exception as e:
+            print(f"Error: {e} with {sample['path']}")
+            num_failed += 1
+            continue
+        feature_store.save(key, features)
+        num_saved += 1
+        if num_saved % 100 == 0:
+            print(f"rank {rank}: saved {num_saved}, skipped {num_skipped}, failed {num_failed}")
+
+    print(f"rank {rank}: saved {num_saved}, skipped {num_skipped}, failed {num_failed}")
+    if dist.is_initialized():
+        dist.barrier()
+    print_rank_0(f"Feature extraction finished, features are saved to {feature_store_path}")
+
+
+if __name__ == "__main__":
+    main()
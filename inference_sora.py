@@ -1,4 +1,6 @@
 import os
+import time
+from collections import defaultdict
 
 import torch
 import mindspeed.megatron_adaptor
@@ -8,7 +10,13 @@ from megatron.core import mpu
 
 from mindspeed_mm.configs.config import merge_mm_args, mm_extra_args_provider
 from mindspeed_mm.tasks.inference.pipeline import SoraPipeline_dict
-from mindspeed_mm.tasks.inference.pipeline.utils.sora_utils import save_videos, save_one_video, load_prompts, load_conditional_pixel_values_path
+from mindspeed_mm.tasks.inference.pipeline.utils.sora_utils import (
+    get_video_path,
+    load_conditional_pixel_values_path,
+    load_prompts,
+    save_one_video,
+    shard_prompts,
+)
 from mindspeed_mm.models.predictor import PredictModel
 from mindspeed_mm.models.diffusion import DiffusionModel
 from mindspeed_mm.models.ae import AEModel
@@ -47,45 +55,91 @@ def main():
     dtype = get_dtype(args.dtype)
     device = get_device(args.device)
 
+    # prepare pipeline
+    sora_pipeline = prepare_pipeline(args, device)
+
     prompts = load_prompts(args.prompt)
-    if "Inpaint" in args.pipeline_class:
+    # the prompts of a jsonl file may request their own input_size
+    default_input_size = (sora_pipeline.num_frames, sora_pipeline.height, sora_pipeline.width)
+    input_sizes = [
+        tuple(prompt.get("input_size", default_input_size)) if isinstance(prompt, dict) else default_input_size
+        for prompt in prompts
+    ]
+    prompts = [prompt["prompt"] if isinstance(prompt, dict) else prompt for prompt in prompts]
+    is_inpaint = "Inpaint" in args.pipeline_class
+    if is_inpaint:
         conditional_pixel_values_path = load_conditional_pixel_values_path(args.conditional_pixel_values_path)
-    start_idx = 0
     max_sequence_length = args.model_max_length
     save_fps = args.fps // args.frame_interval
     os.makedirs(args.save_path, exist_ok=True)
 
-    # prepare pipeline
-    sora_pipeline = prepare_pipeline(args, device)
-    torch.manual_seed(mpu.get_context_parallel_rank())
+    # == Shard the prompts over the data parallel groups, the ranks of a CP/TP group generate the same prompts ==
+    # the prompts whose video exists are skipped, so a restarted run only generates the missing videos
+    pending = [i for i in range(len(prompts)) if not os.path.exists(get_video_path(args.save_path, i))]
+    # every rank lists the existing videos before any new video is saved
+    torch.distributed.barrier()
+    dp_rank, dp_size = mpu.get_data_parallel_rank(), mpu.get_data_parallel_world_size()
+    costs = [input_sizes[i][0] * input_sizes[i][1] * input_sizes[i][2] for i in pending]
+    indices = [pending[i] for i in shard_prompts(costs, dp_size, dp_rank)]
+    is_saving_rank = mpu.get_context_parallel_rank() == 0 and mpu.get_tensor_model_parallel_rank() == 0
+    if is_saving_rank:
+        print(f"[dp rank {dp_rank}] {len(indices)} of {len(pending)} pending prompts, "
+              f"{len(prompts) - len(pending)} prompts already generated")
+
+    # == Batch the prompts of the same input_size, micro_batch_size prompts are generated together ==
+    batch_size = 1 if is_inpaint else args.get("micro_batch_size", 1)
+    size_groups = defaultdict(list)
+    for i in indices:
+        size_groups[input_sizes[i]].append(i)
+    batches = [group[j: j + batch_size] for group in size_groups.values() for j in range(0, len(group), batch_size)]
 
-    # == Iter over all samples ==
-    video_grids = []
-    if "Inpaint" in args.pipeline_class:
-        print("Inpainting mode")
-        for i in range(0, len(prompts)):
-            prompt = prompts[i]
-            condition = conditional_pixel_values_path[i]
-            videos = sora_pipeline(prompt=prompt, conditional_pixel_values_path=condition, fps=save_fps, device=device,
-                                   dtype=dtype, max_sequence_length=max_sequence_length)
-            save_one_video(videos[0], args.save_path, save_fps, start_idx)
-            video_grids.append(videos)
-            start_idx += 1
-    else:
-        print("T2V mode")
-        for i in range(0, len(prompts)):
-            # == prepare batch prompts ==
-            prompt = prompts[i]
-            videos = sora_pipeline(prompt=prompt, fps=save_fps, device=device, dtype=dtype,
-                                max_sequence_length=max_sequence_length)
-            save_one_video(videos[0], args.save_path, save_fps, start_idx)
-            video_grids.append(videos)
-            start_idx += 1
-    video_grids = torch.cat(video_grids, dim=0)
-    if mpu.get_context_parallel_rank() == 0 and mpu.get_tensor_model_parallel_rank() == 0:
-        save_videos(video_grids, args.save_path, save_fps, value_range=(-1, 1), normalize=True)
+    # == Iter over the batches of this data parallel rank ==
+    print("Inpainting mode" if is_inpaint else "T2V mode")
+    latencies = []
+    # batch size -> [batches, videos, seconds]
+    throughput = defaultdict(lambda: [0, 0, 0.0])
+    cp_rank, cp_size = mpu.get_context_parallel_rank(), mpu.get_context_parallel_world_size()
+    for batch in batches:
+        # one CPU generator per prompt, seeded by the prompt index: the video of a prompt does not change with the
+        # number of shards or the batch size, but differs from the former runs that only seeded the global RNG.
+        # The global seed is still set for the pipelines that do not take a generator
+        torch.manual_seed(batch[0] * cp_size + cp_rank)
+        generator = [torch.Generator().manual_seed(i * cp_size + cp_rank) for i in batch]
+        sora_pipeline.num_frames, sora_pipeline.height, sora_pipeline.width = input_sizes[batch[0]]
+        start_time = time.time()
+        if is_inpaint:
+            videos = sora_pipeline(prompt=prompts[batch[0]], generator=generator[0],
+                                   conditional_pixel_values_path=conditional_pixel_values_path[batch[0]],
+                                   fps=save_fps, device=device, dtype=dtype, max_sequence_length=max_sequence_length)
+        else:
+            videos = sora_pipeline(prompt=[prompts[i] for i in batch], generator=generator, fps=save_fps,
+                                   device=device, dtype=dtype, max_sequence_length=max_sequence_length)
+        if is_saving_rank:
+            for i, video in zip(batch, videos):
+                save_one_video(video, args.save_path, save_fps, i)
+        # the videos are on the host after the save, the latency includes the device work
+        latencies.append(time.time() - start_time)
+        stats = throughput[len(batch)]
+        stats[0], stats[1], stats[2] = stats[0] + 1, stats[1] + len(batch), stats[2] + latencies[-1]
+        if is_saving_rank:
+            # the model evaluations per video, e.g. to compare the solvers and the guidance intervals
+            nfe = getattr(sora_pipeline.scheduler, "nfe", None)
+            print(f"[dp rank {dp_rank}] prompts {batch}, input_size {input_sizes[batch[0]]}: {latencies[-1]:.2f}s, "
+                  f"{latencies[-1] / len(batch):.2f}s per video" + (f", NFE {nfe}" if nfe is not None else ""))
+    if is_saving_rank:
         print("Inference finished.")
-        print(f"Saved {start_idx} samples to {args.save_path}")
+        if latencies:
+            print(f"[dp rank {dp_rank}] saved {len(indices)} samples to {args.save_path}, "
+                  f"latency per batch mean {sum(latencies) / len(latencies):.2f}s / max {max(latencies):.2f}s, "
+                  f"total {sum(latencies):.2f}s")
+            print(f"[dp rank {dp_rank}] batch size | batches | videos | seconds | videos/hour")
+            for size, (num_batches, num_videos, seconds) in sorted(throughput.items()):
+                print(f"[dp rank {dp_rank}] {size:10d} | {num_batches:7d} | {num_videos:6d} | {seconds:7.1f} | "
+                      f"{3600 * num_videos / seconds:11.1f}")
+        if getattr(sora_pipeline, "prompt_embedding_cache", None) is not None:
+            print(f"[dp rank {dp_rank}] prompt embedding cache: {dict(sora_pipeline.prompt_embedding_cache.stats)}")
+        if getattr(sora_pipeline.predict_model, "feature_cache", None) is not None:
+            print(f"[dp rank {dp_rank}] denoising feature cache: {dict(sora_pipeline.predict_model.feature_cache.stats)}")
 
 
 if __name__ == "__main__":
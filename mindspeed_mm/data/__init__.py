@@ -1,3 +1,6 @@
+from megatron.core import mpu
+
+from mindspeed_mm.data.dataloader.collator import check_text_pad_multiple
 from mindspeed_mm.data.dataloader.dataloader import (
     prepare_base_dataloader,
     prepare_sampler_dataloader,
@@ -52,6 +55,15 @@ def build_mm_dataloader(dataset, dataloader_param, process_group=None, consumed_
     if "dataloader_mode" not in dataloader_param:
         raise AssertionError("Key parameter missing: dataloader_mode")
     dataloader_mode = dataloader_param.pop("dataloader_mode")
+    collate_param = dataloader_param.get("collate_param", None) or {}
+    if mpu.model_parallel_is_initialized():
+        check_text_pad_multiple(
+            collate_param.get("text_pad_multiple", None),
+            mpu.get_tensor_model_parallel_world_size(),
+            mpu.get_context_parallel_world_size(),
+        )
+    # consumed by build_iterations
+    dataloader_param.pop("device_prefetch", None)
     if dataloader_mode == "base":
         data_loader = prepare_base_dataloader(dataset, **dataloader_param)
         return data_loader
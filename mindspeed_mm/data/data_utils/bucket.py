@@ -5,6 +5,112 @@ import numpy as np
 
 from mindspeed_mm.data.data_utils.aspect_ratio import ASPECT_RATIOS, get_closest_ratio
 
+MASK32 = np.uint64(0xFFFFFFFF)
+INIT_A, MULT_A = 0x43b0d7e5, 0x931e8875
+INIT_B, MULT_B = 0x8b51f9dd, 0x58f38ded
+MIX_MULT_L, MIX_MULT_R = 0xca01f9dd, 0x4973f715
+PCG_MULT_HI, PCG_MULT_LO = 2549297995355413924, 4865540595714422341
+
+
+def _u32(x):
+    return x & MASK32
+
+
+def _hashmix(value, hash_const):
+    value = _u32(value ^ np.uint64(hash_const))
+    hash_const = (hash_const * MULT_A) & 0xFFFFFFFF
+    value = _u32(value * np.uint64(hash_const))
+    value ^= value >> np.uint64(16)
+    return value, hash_const
+
+
+def _mix(x, y):
+    result = _u32(np.uint64(MIX_MULT_L) * x - np.uint64(MIX_MULT_R) * y)
+    result ^= result >> np.uint64(16)
+    return result
+
+
+def _mul64(a, b):
+    """The full 128-bit product of two uint64 arrays, as (hi, lo)."""
+    a_lo, a_hi = a & MASK32, a >> np.uint64(32)
+    b_lo, b_hi = b & MASK32, b >> np.uint64(32)
+    lo_lo = a_lo * b_lo
+    hi_lo = a_hi * b_lo
+    lo_hi = a_lo * b_hi
+    hi_hi = a_hi * b_hi
+    cross = (lo_lo >> np.uint64(32)) + (hi_lo & MASK32) + lo_hi
+    hi = hi_hi + (hi_lo >> np.uint64(32)) + (cross >> np.uint64(32))
+    lo = (cross << np.uint64(32)) | (lo_lo & MASK32)
+    return hi, lo
+
+
+def _mul128(a_hi, a_lo, b_hi, b_lo):
+    hi, lo = _mul64(a_lo, b_lo)
+    hi = hi + a_hi * b_lo + a_lo * b_hi
+    return hi, lo
+
+
+def _add128(a_hi, a_lo, b_hi, b_lo):
+    lo = a_lo + b_lo
+    hi = a_hi + b_hi + (lo < a_lo).astype(np.uint64)
+    return hi, lo
+
+
+def default_rng_uniforms(seeds, num_draws):
+    """
+    Vectorised np.random.default_rng(seed).random(), the first num_draws draws of every seed.
+
+    The SeedSequence hashing and the PCG64 steps are computed on uint64 arrays (128-bit integers as
+    hi/lo pairs), so the draws are bit-identical to the numpy generator, and the seed acts as the
+    counter of a counter-based generator.
+
+    Returns:
+        float64 array of shape (len(seeds), num_draws)
+    """
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    entropy = [seeds & MASK32, seeds >> np.uint64(32)]
+    # SeedSequence.mix_entropy with a pool of 4 words, seeds < 2**64 take two 32-bit entropy words,
+    # a zero high word hashes the same way as the missing word of a seed < 2**32
+    hash_const = INIT_A
+    pool = []
+    for i in range(4):
+        value = entropy[i] if i < len(entropy) else np.zeros_like(seeds)
+        value, hash_const = _hashmix(value, hash_const)
+        pool.append(value)
+    for i_src in range(4):
+        for i_dst in range(4):
+            if i_src != i_dst:
+                value, hash_const = _hashmix(pool[i_src], hash_const)
+                pool[i_dst] = _mix(pool[i_dst], value)
+    # SeedSequence.generate_state(4, uint64)
+    hash_const = INIT_B
+    words = []
+    for i in range(8):
+        value = pool[i % 4] ^ np.uint64(hash_const)
+        hash_const = (hash_const * MULT_B) & 0xFFFFFFFF
+        value = _u32(value * np.uint64(hash_const))
+        value ^= value >> np.uint64(16)
+        words.append(value)
+    state = [words[2 * i] | (words[2 * i + 1] << np.uint64(32)) for i in range(4)]
+    # pcg64 srandom: state=0, inc=(initseq<<1)|1, step, state+=initstate, step
+    inc_hi = (state[2] << np.uint64(1)) | (state[3] >> np.uint64(63))
+    inc_lo = (state[3] << np.uint64(1)) | np.uint64(1)
+    mult_hi, mult_lo = np.uint64(PCG_MULT_HI), np.uint64(PCG_MULT_LO)
+    s_hi, s_lo = inc_hi, inc_lo
+    s_hi, s_lo = _add128(s_hi, s_lo, state[0], state[1])
+    s_hi, s_lo = _mul128(s_hi, s_lo, mult_hi, mult_lo)
+    s_hi, s_lo = _add128(s_hi, s_lo, inc_hi, inc_lo)
+    draws = []
+    for _ in range(num_draws):
+        s_hi, s_lo = _mul128(s_hi, s_lo, mult_hi, mult_lo)
+        s_hi, s_lo = _add128(s_hi, s_lo, inc_hi, inc_lo)
+        # xsl rr output
+        value = s_hi ^ s_lo
+        rot = s_hi >> np.uint64(58)
+        value = (value >> rot) | (value << ((np.uint64(64) - rot) & np.uint64(63)))
+        draws.append((value >> np.uint64(11)).astype(np.float64) * (1.0 / 9007199254740992.0))
+    return np.stack(draws, axis=1)
+
 
 class Bucket:
     def __init__(self, bucket_config):
@@ -98,6 +204,72 @@ class Bucket:
         ar_id = get_closest_ratio(H, W, ar_criteria)
         return hw_id, t_id, ar_id
 
+    def get_bucket_ids(self, T, H, W, sample_ids, frame_interval=1, seed=0):
+        """
+        Vectorised get_bucket_id over all the samples, sample i uses the seed seed + sample_ids[i] * num_bucket
+        as the sampler did per row, so the decisions are the same as get_bucket_id.
+
+        Returns:
+            bucket_keys(list): the (hw_id, t_id, ar_id) of every bucket
+            bucket_index(np.ndarray): the index into bucket_keys of every sample, -1 if the sample is dropped
+        """
+        T = np.asarray(T, dtype=np.int64)
+        H = np.asarray(H, dtype=np.int64)
+        W = np.asarray(W, dtype=np.int64)
+        sample_seeds = np.uint64(seed) + np.asarray(sample_ids, dtype=np.uint64) * np.uint64(self.num_bucket)
+        resolution = H * W
+        aspect_ratio = H / W
+        approx = 0.8
+
+        bucket_keys = []
+        bucket_offsets = {}
+        bucket_index = np.full(len(T), -1, dtype=np.int64)
+        pending = np.ones(len(T), dtype=bool)
+
+        def accept(indices, hw_id, t_id):
+            if len(indices) == 0:
+                return
+            ratios = list(self.ar_criteria[hw_id][t_id].keys())
+            if (hw_id, t_id) not in bucket_offsets:
+                bucket_offsets[(hw_id, t_id)] = len(bucket_keys)
+                bucket_keys.extend((hw_id, t_id, ratio) for ratio in ratios)
+            # get aspect ratio id, ties are broken by the first ratio as in get_closest_ratio
+            ratio_values = np.array([float(ratio) for ratio in ratios])
+            ar_index = np.argmin(np.abs(ratio_values[None, :] - aspect_ratio[indices, None]), axis=1)
+            bucket_index[indices] = bucket_offsets[(hw_id, t_id)] + ar_index
+            pending[indices] = False
+
+        for hw_id, t_criteria in self.bucket_probs.items():
+            active = pending & (resolution >= self.hw_criteria[hw_id] * approx)
+
+            # images, the ones that are not accepted go on with the next hw_id
+            if 1 in t_criteria:
+                indices = np.nonzero(active & (T == 1))[0]
+                draws = default_rng_uniforms(sample_seeds[indices] + np.uint64(self.bucket_id[hw_id][1]), 1)[:, 0]
+                accept(indices[draws < t_criteria[1]], hw_id, 1)
+
+            # videos, the first t_id that passes its prob_t and is shorter than the video is picked
+            indices = np.nonzero(active & (T != 1))[0]
+            for t_id, prob in t_criteria.items():
+                if len(indices) == 0:
+                    break
+                is_tuple = isinstance(prob, tuple) or isinstance(prob, list)
+                draws = default_rng_uniforms(sample_seeds[indices] + np.uint64(self.bucket_id[hw_id][t_id]), 2)
+                passed = np.ones(len(indices), dtype=bool)
+                if is_tuple:
+                    passed &= ~(draws[:, 0] > prob[1])
+                picked = passed & (T[indices] > t_id * frame_interval) & (t_id != 1)
+                # leave the loop if prob is high enough, the next draw of the same generator
+                prob = prob[0] if is_tuple else prob
+                if prob >= 1:
+                    accepted = picked
+                else:
+                    accepted = picked & (draws[:, 1 if is_tuple else 0] < prob)
+                accept(indices[accepted], hw_id, t_id)
+                # the samples that picked this t_id but were not accepted go on with the next hw_id
+                indices = indices[~picked]
+        return bucket_keys, bucket_index
+
     def get_thw(self, bucket_id):
         if len(bucket_id) != 3:
             raise AssertionError
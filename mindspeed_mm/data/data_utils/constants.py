@@ -6,6 +6,7 @@ PROMPT_IDS_2 = "prompt_ids_2"
 TEXT = "text"
 VIDEO = "video"
 VIDEO_MASK = "video_mask"
+VIDEO_RESIZE = "video_resize"
 FILE_INFO = "file"
 CAPTIONS = "captions"
 IMG_FPS = 120
@@ -383,10 +383,15 @@ class LongSideResizeVideo:
             size,
             skip_low_resolution=False, 
             interpolation_mode="bilinear",
+            deferred=False,
     ):
         self.size = size
         self.skip_low_resolution = skip_low_resolution
         self.interpolation_mode = interpolation_mode
+        self.deferred = deferred
+
+    def get_target_size(self, h, w):
+        return longsideresize(h, w, self.size, self.skip_low_resolution)
 
     def __call__(self, clip):
         """
@@ -396,8 +401,8 @@ class LongSideResizeVideo:
             torch.tensor: scale resized video clip.
         """
         _, _, h, w = clip.shape
-        tr_h, tr_w = longsideresize(h, w, self.size, self.skip_low_resolution)
-        if h == tr_h and w == tr_w:
+        tr_h, tr_w = self.get_target_size(h, w)
+        if (h == tr_h and w == tr_w) or self.deferred:
             return clip
         resize_clip = resize(clip, target_size=(tr_h, tr_w),
                                          interpolation_mode=self.interpolation_mode)
@@ -419,11 +424,16 @@ class MaxHWStrideResizeVideo:
             interpolation_mode="bilinear",
             force_5_ratio=True,
             hw_stride=16,
+            deferred=False,
     ):
         self.max_hxw = max_hxw
         self.interpolation_mode = interpolation_mode
         self.force_5_ratio = force_5_ratio
         self.hw_stride = hw_stride
+        self.deferred = deferred
+
+    def get_target_size(self, h, w):
+        return maxhwresize(h, w, self.max_hxw, force_5_ratio=self.force_5_ratio, hw_stride=self.hw_stride)
 
     def __call__(self, clip):
         """
@@ -433,8 +443,8 @@ class MaxHWStrideResizeVideo:
             torch.tensor: scale resized video clip.
         """
         _, _, h, w = clip.shape
-        tr_h, tr_w = maxhwresize(h, w, self.max_hxw, force_5_ratio=self.force_5_ratio, hw_stride=self.hw_stride)
-        if h == tr_h and w == tr_w:
+        tr_h, tr_w = self.get_target_size(h, w)
+        if (h == tr_h and w == tr_w) or self.deferred:
             return clip
         resize_clip = resize(clip, target_size=(tr_h, tr_w),
                                          interpolation_mode=self.interpolation_mode)
@@ -454,9 +464,14 @@ class MaxHWResizeVideo:
             self,
             max_hxw,
             interpolation_mode="bilinear",
+            deferred=False,
     ):
         self.max_hxw = max_hxw
         self.interpolation_mode = interpolation_mode
+        self.deferred = deferred
+
+    def get_target_size(self, h, w):
+        return maxhwresize(h, w, self.max_hxw)
 
     def __call__(self, clip):
         """
@@ -466,8 +481,8 @@ class MaxHWResizeVideo:
             torch.tensor: scale resized video clip.
         """
         _, _, h, w = clip.shape
-        tr_h, tr_w = maxhwresize(h, w, self.max_hxw)
-        if h == tr_h and w == tr_w:
+        tr_h, tr_w = self.get_target_size(h, w)
+        if (h == tr_h and w == tr_w) or self.deferred:
             return clip
         resize_clip = resize(clip, target_size=(tr_h, tr_w),
                                          interpolation_mode=self.interpolation_mode)
@@ -487,12 +502,17 @@ class CenterCropResizeVideo:
             size,
             top_crop=False, 
             interpolation_mode="bilinear",
+            deferred=False,
     ):
         if len(size) != 2:
             raise ValueError(f"size should be tuple (height, width), instead got {size}")
         self.size = size
         self.top_crop = top_crop
         self.interpolation_mode = interpolation_mode
+        self.deferred = deferred
+
+    def get_target_size(self, h, w):
+        return tuple(self.size)
 
     def __call__(self, clip):
         """
@@ -503,6 +523,8 @@ class CenterCropResizeVideo:
                 size is (T, C, crop_size, crop_size)
         """
         clip_center_crop = center_crop_th_tw(clip, self.size[0], self.size[1], top_crop=self.top_crop)
+        if self.deferred:
+            return clip_center_crop
         clip_center_crop_resize = resize(clip_center_crop, target_size=self.size,
                                          interpolation_mode=self.interpolation_mode)
         return clip_center_crop_resize
@@ -698,6 +720,19 @@ class TemporalRandomCrop(object):
         end_index = min(begin_index + self.size, total_frames)
         return begin_index, end_index
 
+
+class TemporalCenterCrop(TemporalRandomCrop):
+    """Temporally crop the given frame indices at the center, the same window every time.
+
+    Args:
+        size (int): Desired length of frames will be seen in the model.
+    """
+
+    def __call__(self, total_frames):
+        begin_index = max(0, total_frames - self.size - 1) // 2
+        end_index = min(begin_index + self.size, total_frames)
+        return begin_index, end_index
+
 class DynamicSampleDuration(object):
     """Temporally crop the given frame indices at a random location.
 
@@ -1027,6 +1062,16 @@ def add_aesthetic_notice_image(caption, aesthetic_score):
         return random.choice([caption + ' ' + notice, notice + ' ' + caption])
     return caption
 
+def get_aesthetic_notice_variants(caption, aesthetic_score, is_video=True):
+    """All the captions add_aesthetic_notice_video/image may return."""
+    if aesthetic_score <= 4.25:
+        notices = low_aesthetic_score_notices_video if is_video else low_aesthetic_score_notices_image
+    elif aesthetic_score >= 5.75:
+        notices = high_aesthetic_score_notices_video if is_video else high_aesthetic_score_notices_image
+    else:
+        return [caption]
+    return [variant for notice in notices for variant in (caption + ' ' + notice, notice + ' ' + caption)]
+
 def add_high_aesthetic_notice_image(caption):
     notice = random.choice(high_aesthetic_score_notices_image)
     return random.choice([caption + ' ' + notice, notice + ' ' + caption])
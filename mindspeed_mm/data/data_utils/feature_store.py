@@ -0,0 +1,67 @@
+# Copyright (c) 2024 Huawei Technologies Co., Ltd.
+
+
+import os
+import hashlib
+import tempfile
+
+import torch
+
+
+LATENT_MOMENTS = "latent_moments"
+PROMPT_FEATURES = "prompt"
+PROMPT_FEATURES_2 = "prompt_2"
+NULL_TEXT_KEY = "null_text"
+
+
+class FeatureStore:
+    """
+    A sharded on-disk store of pre-computed encoder features.
+
+    Every sample is saved as one torch file under root/<key[:2]>/<key>.pt, where the key
+    is derived from the sample path and its frame window, so extraction can be split
+    across ranks and resumed without any coordination.
+
+    The features are computed once, so training on them loses the random augmentations of the
+    raw data: the clips longer than num_frames are always center-cropped in time (temporal_crop
+    "center") and the random transforms of the train_pipeline are fixed at extraction.
+
+    Args:
+        root(str): the directory of the store
+    """
+
+    def __init__(self, root: str):
+        if not root:
+            raise AssertionError("feature_store_path must be set when use_feature_data is enabled.")
+        self.root = root
+
+    @staticmethod
+    def get_key(path, start_frame_idx=0, num_frames=1):
+        identity = f"{os.path.abspath(path)}:{int(start_frame_idx)}:{int(num_frames)}"
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.pt")
+
+    def exists(self, key):
+        return os.path.exists(self.get_path(key))
+
+    def save(self, key, features: dict):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a unique name in the target directory, the store may be shared by the nodes
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(features, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            raise AssertionError(f"feature {path} do not exist!")
+        return torch.load(path, map_location="cpu")
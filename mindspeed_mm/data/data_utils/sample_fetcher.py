@@ -0,0 +1,165 @@
+# Copyright (c) 2024 Huawei Technologies Co., Ltd.
+
+
+import os
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import av
+from PIL import UnidentifiedImageError
+
+from mindspeed_mm.data.data_utils.shared_stats import SharedStats
+
+
+# the errors of a broken file, a sample that raises them is blacklisted at the first failure. IndexError is
+# raised for a video with fewer frames than its annotation
+DECODE_ERRORS = (av.error.InvalidDataError, UnidentifiedImageError, IndexError)
+FETCH_STATS = ("fetched", "retries", "skipped", "timeouts", "errors", "blacklisted", "stalled_threads")
+
+
+class SampleFetcher:
+    """
+    Fetch samples with a timeout, bounded retries on replacement samples and a blacklist of bad samples.
+
+    A fetch runs on a small thread pool, so a stalled read (e.g. on NFS) only costs the timeout. Python
+    threads can not be killed, so a stalled thread is abandoned: once all the threads of the pool are
+    stalled, the pool is replaced so the next fetches are not queued behind them, and the fetcher raises
+    when more than max_stalled_threads threads are stuck, instead of leaking threads forever. The dataloader
+    workers are daemonic processes, which can not start worker processes of their own, the process level
+    isolation is given by the dataloader workers themselves.
+
+    A sample that fails or times out is replaced by fallback_fn(index), in a loop bounded by max_retries.
+    It is blacklisted when it raises one of decode_errors, or after max_failures failures in the process,
+    so a transient storage error does not drop a good sample. The keys of the bad samples are appended to
+    bad_sample_file, which is read by every new fetcher, so the bad samples are skipped in the next epochs
+    and the next runs. The stats are shared by the dataloader workers, and reported for the rank by
+    log_data_stats.
+
+    Args:
+        fetch_fn: index -> sample
+        fallback_fn: index -> the index of a replacement sample
+        key_fn: index -> the key of the sample saved in bad_sample_file
+        num_threads(int): the threads of the pool
+        timeout(float): the timeout of a fetch in seconds
+        max_retries(int): the replacement samples tried before raising
+        max_failures(int): the failures of a sample before it is blacklisted
+        decode_errors(tuple): the exception types that blacklist a sample at the first failure
+        max_stalled_threads(int): the stalled threads tolerated before raising, 4 * num_threads if None
+        bad_sample_file(str): the file of the bad sample keys, bad samples are only kept in memory if None
+    """
+
+    def __init__(
+        self,
+        fetch_fn,
+        fallback_fn,
+        key_fn=str,
+        num_threads=1,
+        timeout=60,
+        max_retries=10,
+        max_failures=3,
+        decode_errors=DECODE_ERRORS,
+        max_stalled_threads=None,
+        bad_sample_file=None,
+    ):
+        self.fetch_fn = fetch_fn
+        self.fallback_fn = fallback_fn
+        self.key_fn = key_fn
+        self.num_threads = num_threads
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_failures = max_failures
+        self.decode_errors = tuple(decode_errors)
+        self.max_stalled_threads = max_stalled_threads if max_stalled_threads is not None else 4 * num_threads
+        self.bad_sample_file = bad_sample_file
+        self.stats = SharedStats(FETCH_STATS)
+        self.failures = Counter()
+        self.executor = None
+        self.executor_pid = None
+        self.stalled_futures = []
+        self.bad_samples = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(executor=None, executor_pid=None, stalled_futures=[], lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        # the threads of a pool do not survive a fork, every dataloader worker starts its own pool
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.num_threads)
+            self.executor_pid = os.getpid()
+            self.stalled_futures = []
+            self.bad_samples = None
+        return self.executor
+
+    def load_bad_samples(self):
+        if self.bad_samples is None:
+            self.bad_samples = set()
+            if self.bad_sample_file is not None and os.path.exists(self.bad_sample_file):
+                with open(self.bad_sample_file, "r") as f:
+                    self.bad_samples = set(line.rstrip("\n") for line in f if line.strip())
+        return self.bad_samples
+
+    def add_bad_sample(self, key):
+        with self.lock:
+            if key in self.bad_samples:
+                return
+            self.bad_samples.add(key)
+            self.stats.add("blacklisted")
+            if self.bad_sample_file is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.bad_sample_file)), exist_ok=True)
+                # a short append is atomic, the file is shared by all the workers and ranks
+                with open(self.bad_sample_file, "a") as f:
+                    f.write(f"{key}\n")
+
+    def on_stalled(self, future):
+        self.stalled_futures = [f for f in self.stalled_futures if not f.done()]
+        self.stalled_futures.append(future)
+        self.stats.set("stalled_threads", len(self.stalled_futures))
+        if len(self.stalled_futures) > self.max_stalled_threads:
+            raise RuntimeError(f"{len(self.stalled_futures)} sample fetch threads are stalled, "
+                               f"more than max_stalled_threads={self.max_stalled_threads}.")
+        if len(self.stalled_futures) % self.num_threads == 0:
+            # every thread of the pool may be stalled, later fetches go to a new pool
+            self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=self.num_threads)
+
+    def __call__(self, index):
+        executor = self.get_executor()
+        bad_samples = self.load_bad_samples()
+        self.stats.add("fetched")
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.stats.add("retries")
+                index = self.fallback_fn(index)
+            key = self.key_fn(index)
+            if key in bad_samples:
+                self.stats.add("skipped")
+                continue
+            future = executor.submit(self.fetch_fn, index)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                self.stats.add("timeouts")
+                logging.warning("Sample fetch of %s timed out after %ss", key, self.timeout)
+                if not future.cancel():
+                    self.on_stalled(future)
+                    executor = self.executor
+                is_decode_error = False
+            except Exception as e:
+                self.stats.add("errors")
+                logging.warning("Sample fetch of %s failed: %r", key, e)
+                is_decode_error = isinstance(e, self.decode_errors)
+            self.failures[key] += 1
+            if is_decode_error or self.failures[key] >= self.max_failures:
+                self.add_bad_sample(key)
+        raise RuntimeError(f"Failed to fetch a sample after {self.max_retries} retries, "
+                           f"stats: {self.stats.as_dict()}")
@@ -0,0 +1,179 @@
+# Copyright (c) 2024 Huawei Technologies Co., Ltd.
+
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+class SampleSizes:
+    """
+    The "TxHxW" sample size of every sample, stored as an int32 code per sample into the vocabulary of the
+    distinct sizes, so the dataset, the samplers and the dataloader workers hold no per-sample python objects.
+    It behaves as a read-only sequence of strings.
+
+    Args:
+        codes(np.ndarray): the index into shapes of every sample
+        shapes(list): the distinct sample sizes, sorted
+    """
+
+    def __init__(self, codes, shapes):
+        self.codes = codes
+        self.shapes = shapes
+
+    @classmethod
+    def from_columns(cls, num_frames, height, width):
+        if len(num_frames) == 0:
+            return cls(np.zeros(0, dtype=np.int32), [])
+        unique_sizes, codes = np.unique(np.stack([num_frames, height, width], axis=1), axis=0, return_inverse=True)
+        shapes = [f"{t}x{h}x{w}" for t, h, w in unique_sizes.tolist()]
+        # the vocabulary is sorted as strings, the order of the shape groups of the samplers
+        order = sorted(range(len(shapes)), key=shapes.__getitem__)
+        remap = np.empty(len(shapes), dtype=np.int32)
+        remap[order] = np.arange(len(shapes), dtype=np.int32)
+        return cls(remap[codes.reshape(-1)], [shapes[i] for i in order])
+
+    def get_shape_idx_dict(self):
+        """The sample indices of every sample size, as int64 arrays."""
+        order = np.argsort(self.codes, kind="stable")
+        groups = np.split(order, np.cumsum(np.bincount(self.codes, minlength=len(self.shapes)))[:-1])
+        return {shape: indices for shape, indices in zip(self.shapes, groups) if len(indices) > 0}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.shapes[self.codes[index]]
+
+    def __iter__(self):
+        return (self.shapes[code] for code in self.codes.tolist())
+
+
+class SampleTable:
+    """
+    A columnar store of the filtered samples of the combine mode.
+
+    Every column is a numpy array (strings are saved as a flat utf-8 buffer with offsets), so the
+    dataloader workers read the samples without touching the refcount of per-sample python objects,
+    and the pages forked from the main process stay shared. The table can be saved to a directory
+    and memory-mapped, then all the processes of a rank share the same pages of the page cache. The
+    manifest.json of the directory lists the saved columns, load only reads those.
+
+    Args:
+        columns(dict): column name -> numpy array
+    """
+
+    STRING_COLUMNS = ("path", "cap")
+    INT_COLUMNS = ("start_frame_idx", "num_frames", "sample_num_frames", "sample_height", "sample_width")
+    FLOAT_COLUMNS = ("fps", "aesthetic", "aes")
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+        self.num_samples = len(columns["path_offsets"]) - 1
+        self.has_crop = "crop" in columns
+
+    @staticmethod
+    def encode_strings(values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    @classmethod
+    def from_dataframe(cls, samples: pd.DataFrame):
+        num_samples = len(samples)
+        columns = {}
+        for name in cls.STRING_COLUMNS:
+            values = samples[name].tolist() if name in samples.columns else [None] * num_samples
+            if name == "cap":
+                # captions may be a string or a list of strings
+                values = [json.dumps(value, ensure_ascii=False) for value in values]
+            columns[name], columns[f"{name}_offsets"] = cls.encode_strings(values)
+        for name in cls.INT_COLUMNS:
+            if name in samples.columns:
+                columns[name] = pd.to_numeric(samples[name], errors="coerce").fillna(0).to_numpy(dtype=np.int64)
+        for name in cls.FLOAT_COLUMNS:
+            if name in samples.columns:
+                columns[name] = pd.to_numeric(samples[name], errors="coerce").to_numpy(dtype=np.float64)
+        if "crop" in samples.columns:
+            # -1 marks a sample without crop
+            columns["crop"] = np.array(
+                [crop if isinstance(crop, (list, tuple)) and len(crop) == 4 else [-1] * 4 for crop in samples["crop"]],
+                dtype=np.int64,
+            ).reshape(num_samples, 4)
+        return cls(columns)
+
+    def save(self, table_dir):
+        os.makedirs(table_dir, exist_ok=True)
+        manifest_path = os.path.join(table_dir, "manifest.json")
+        # a table without manifest is never loaded, e.g. if the save is interrupted
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        for name, column in self.columns.items():
+            np.save(os.path.join(table_dir, f"{name}.npy"), column)
+        manifest = {name: {"dtype": column.dtype.str, "shape": list(column.shape)}
+                    for name, column in self.columns.items()}
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, table_dir, mmap_mode="r"):
+        with open(os.path.join(table_dir, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        columns = {}
+        for name, meta in manifest.items():
+            column = np.load(os.path.join(table_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+            if column.dtype.str != meta["dtype"] or list(column.shape) != meta["shape"]:
+                raise ValueError(f"The column {name} of the sample table {table_dir} is {column.dtype.str} "
+                                 f"{list(column.shape)}, the manifest expects {meta['dtype']} {meta['shape']}.")
+            columns[name] = column
+        return cls(columns)
+
+    def checksum(self, chunk_size=64 * 1024 * 1024):
+        """
+        The md5 of the names and the bytes of all the columns, equal on the ranks that share a table. The
+        columns are hashed in chunks of their buffers, a memory-mapped column is not copied.
+        """
+        md5 = hashlib.md5()
+        for name in sorted(self.columns):
+            md5.update(name.encode("utf-8"))
+            buffer = memoryview(np.ascontiguousarray(self.columns[name]).reshape(-1)).cast("B")
+            for start in range(0, len(buffer), chunk_size):
+                md5.update(buffer[start: start + chunk_size])
+        return md5.hexdigest()
+
+    def get_sample_sizes(self):
+        """The SampleSizes of the samples and the sample indices of every sample size."""
+        sample_size = SampleSizes.from_columns(
+            self.columns["sample_num_frames"], self.columns["sample_height"], self.columns["sample_width"]
+        )
+        return sample_size, sample_size.get_shape_idx_dict()
+
+    def get_string(self, name, index):
+        offsets = self.columns[f"{name}_offsets"]
+        return bytes(self.columns[name][offsets[index]: offsets[index + 1]]).decode("utf-8")
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.num_samples:
+            raise IndexError(f"index {index} out of range of {self.num_samples} samples")
+        sample = {
+            "path": self.get_string("path", index),
+            "cap": json.loads(self.get_string("cap", index)),
+        }
+        for name in self.INT_COLUMNS:
+            if name in self.columns:
+                sample[name] = int(self.columns[name][index])
+        for name in self.FLOAT_COLUMNS:
+            if name in self.columns:
+                value = float(self.columns[name][index])
+                sample[name] = None if np.isnan(value) else value
+        if self.has_crop:
+            crop = self.columns["crop"][index].tolist()
+            sample["crop"] = crop if crop[0] != -1 else [None, None, None, None]
+        return sample
@@ -0,0 +1,43 @@
+# Copyright (c) 2024 Huawei Technologies Co., Ltd.
+
+
+import torch
+
+
+class SharedStats:
+    """
+    Integer counters shared by the main process and the dataloader workers of a rank.
+
+    The counters are a tensor in shared memory, created in the main process before the workers are started,
+    and every process only writes its own row, so no lock is needed and the main process reads the sums of
+    all the workers. The rows are indexed by the worker id, a dataloader with more than max_workers workers
+    shares rows and may lose a few counts.
+
+    Args:
+        keys(list): the names of the counters
+        max_workers(int): the rows of the dataloader workers, the row 0 is the main process
+    """
+
+    def __init__(self, keys, max_workers=64):
+        self.keys = list(keys)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.counts = torch.zeros(max_workers + 1, len(self.keys), dtype=torch.int64).share_memory_()
+
+    def get_row(self):
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:
+            return 0
+        return worker_info.id % (self.counts.shape[0] - 1) + 1
+
+    def add(self, key, value=1):
+        self.counts[self.get_row(), self.key_index[key]] += value
+
+    def set(self, key, value):
+        """Set a gauge of the current process, e.g. its stalled threads, the sum is the gauge of the rank."""
+        self.counts[self.get_row(), self.key_index[key]] = value
+
+    def __getitem__(self, key):
+        return int(self.counts[:, self.key_index[key]].sum())
+
+    def as_dict(self):
+        return dict(zip(self.keys, self.counts.sum(dim=0).tolist()))
@@ -0,0 +1,181 @@
+# Copyright (c) 2024 Huawei Technologies Co., Ltd.
+
+
+import os
+import json
+import hashlib
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+
+
+TOKEN_STORE_VERSION = 1
+
+
+def get_text_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class TokenStore:
+    """
+    A pre-tokenised caption store.
+
+    Every caption, as it is passed to TextProcesser (i.e. with the aesthetic notice but before cleaning),
+    is cleaned and tokenised once offline, the tokens are saved without padding in a flat int32 buffer
+    with offsets and looked up by the 64-bit hash of the caption, so TextProcesser only slices and pads
+    the tokens at read time. The arrays are memory-mapped and shared by all the dataloader workers.
+
+    Args:
+        columns(dict): column name -> numpy array
+        meta(dict): the tokenizer settings the store is built with
+    """
+
+    def __init__(self, columns: dict, meta: dict):
+        self.columns = columns
+        self.meta = meta
+        self.has_tokens_2 = "input_ids_2" in columns
+
+    @staticmethod
+    def encode_tokens(token_lists):
+        offsets = np.zeros(len(token_lists) + 1, dtype=np.int64)
+        np.cumsum([len(tokens) for tokens in token_lists], out=offsets[1:])
+        input_ids = np.fromiter(
+            (token for tokens in token_lists for token in tokens), dtype=np.int32, count=int(offsets[-1])
+        )
+        return input_ids, offsets
+
+    @staticmethod
+    def tokenize(tokenizer, texts, max_length, batch_size):
+        token_lists = []
+        for i in range(0, len(texts), batch_size):
+            token_lists += tokenizer(
+                texts[i: i + batch_size],
+                max_length=max_length,
+                padding=False,
+                truncation=True,
+                add_special_tokens=True,
+            )["input_ids"]
+        return token_lists
+
+    @classmethod
+    def build(cls, texts, text_processer, batch_size=1024, num_workers=1):
+        """
+        Clean and tokenise the captions the same way as TextProcesser.__call__.
+
+        Args:
+            texts(list): the captions, the empty caption of the cfg drop is always added
+            text_processer(TextProcesser): provides the tokenizers and the cleaning settings
+            batch_size(int): the number of captions per tokenizer call
+            num_workers(int): the processes used by clean_caption
+        """
+        texts = sorted(set(texts) | {""}, key=get_text_hash)
+        keys = np.array([get_text_hash(text) for text in texts], dtype=np.uint64)
+        if len(np.unique(keys)) != len(keys):
+            raise ValueError("Hash collision between captions, can not build the token store.")
+
+        if text_processer.enable_text_preprocessing:
+            args = [(text, text_processer.use_clean_caption) for text in texts]
+            if num_workers > 1:
+                with Pool(num_workers) as pool:
+                    cleaned_texts = pool.starmap(
+                        text_processer.text_preprocessing, args, chunksize=max(1, len(args) // (num_workers * 16))
+                    )
+            else:
+                cleaned_texts = [text_processer.text_preprocessing(*arg) for arg in args]
+        else:
+            cleaned_texts = texts
+
+        tokenizer = text_processer.tokenizer
+        columns = {"keys": keys}
+        columns["input_ids"], columns["offsets"] = cls.encode_tokens(
+            cls.tokenize(tokenizer, cleaned_texts, text_processer.model_max_length, batch_size)
+        )
+        meta = {
+            "version": TOKEN_STORE_VERSION,
+            "model_max_length": text_processer.model_max_length,
+            "enable_text_preprocessing": text_processer.enable_text_preprocessing,
+            "use_clean_caption": text_processer.use_clean_caption,
+            "pad_token_id": tokenizer.pad_token_id,
+            "padding_side": tokenizer.padding_side,
+        }
+        tokenizer_2 = text_processer.tokenizer_2
+        if tokenizer_2 is not None:
+            columns["input_ids_2"], columns["offsets_2"] = cls.encode_tokens(
+                cls.tokenize(tokenizer_2, cleaned_texts, tokenizer_2.model_max_length, batch_size)
+            )
+            meta.update({
+                "model_max_length_2": tokenizer_2.model_max_length,
+                "pad_token_id_2": tokenizer_2.pad_token_id,
+                "padding_side_2": tokenizer_2.padding_side,
+            })
+        return cls(columns, meta)
+
+    def save(self, store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(store_dir, f"{name}.npy"), column)
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, store_dir, mmap_mode="r"):
+        meta_path = os.path.join(store_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            raise AssertionError(f"token store {store_dir} do not exist!")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("version", None) != TOKEN_STORE_VERSION:
+            raise ValueError(f"token store {store_dir} is built with version {meta.get('version', None)}, "
+                             f"but {TOKEN_STORE_VERSION} is required, please rebuild it.")
+        columns = {}
+        for file_name in os.listdir(store_dir):
+            if file_name.endswith(".npy"):
+                columns[file_name[:-4]] = np.load(os.path.join(store_dir, file_name), mmap_mode=mmap_mode)
+        return cls(columns, meta)
+
+    def check_compatible(self, text_processer):
+        expected = {
+            "model_max_length": text_processer.model_max_length,
+            "enable_text_preprocessing": text_processer.enable_text_preprocessing,
+            "use_clean_caption": text_processer.use_clean_caption,
+        }
+        for name, value in expected.items():
+            if self.meta[name] != value:
+                raise ValueError(f"token store is built with {name}={self.meta[name]}, but TextProcesser uses {value}.")
+        if text_processer.tokenizer_2 is not None and not self.has_tokens_2:
+            raise ValueError("token store is built without tokenizer_2, but TextProcesser uses tokenizer_2.")
+
+    def __len__(self):
+        return len(self.columns["keys"])
+
+    def find(self, text):
+        """Return the position of the caption in the store, or -1 if it is not in the store."""
+        keys = self.columns["keys"]
+        key = np.uint64(get_text_hash(text))
+        position = int(np.searchsorted(keys, key))
+        if position < len(keys) and keys[position] == key:
+            return position
+        return -1
+
+    def get_tokens(self, position, suffix=""):
+        offsets = self.columns[f"offsets{suffix}"]
+        return self.columns[f"input_ids{suffix}"][offsets[position]: offsets[position + 1]]
+
+    def pad_tokens(self, positions, max_length=None, suffix=""):
+        """
+        Pad the tokens of the captions to max_length, or to the longest one if max_length is None.
+        Return the input_ids and attention_mask with the layout of the tokenizer output.
+        """
+        token_lists = [self.get_tokens(position, suffix) for position in positions]
+        if max_length is None:
+            max_length = max(len(tokens) for tokens in token_lists)
+        input_ids = torch.full((len(token_lists), max_length), self.meta[f"pad_token_id{suffix}"], dtype=torch.long)
+        attention_mask = torch.zeros((len(token_lists), max_length), dtype=torch.long)
+        left = self.meta[f"padding_side{suffix}"] == "left"
+        for i, tokens in enumerate(token_lists):
+            length = len(tokens)
+            start = max_length - length if left else 0
+            input_ids[i, start: start + length] = torch.from_numpy(tokens.astype(np.int64))
+            attention_mask[i, start: start + length] = 1
+        return input_ids, attention_mask
@@ -1,4 +1,8 @@
 import copy
+import json
+from collections import defaultdict
+
+import torch
 import torchvision.transforms as transforms
 
 from mindspeed_mm.data.data_utils.data_transform import (
@@ -14,6 +18,7 @@ from mindspeed_mm.data.data_utils.data_transform import (
     MaxHWResizeVideo,
     MaxHWStrideResizeVideo,
     SpatialStrideCropVideo,
+    resize,
 )
 
 VIDEO_TRANSFORM_MAPPING = {
@@ -49,6 +54,15 @@ IMAGE_TRANSFORM_MAPPING = {
 }
 
 
+# the transforms that can follow a deferred resize, they are applied to the frames of the collated batch
+DEFERRED_POST_TRANSFORMS = ["ToTensorAfterResize", "norm_fun", "ae_norm"]
+
+
+# the pixel value transforms, with "uint8_transport": true in the train_pipeline they are applied to the frames
+# of the collated uint8 batch, the dataloader workers only run the transforms that keep uint8 clips
+UINT8_DEVICE_TRANSFORMS = ["ToTensorVideo", "ToTensorAfterResize", "norm_fun", "ae_norm"]
+
+
 INTERPOLATIONMODE_LIST = [
     "bicubic",
     "bilinear",
@@ -59,6 +73,8 @@ INTERPOLATIONMODE_LIST = [
     "lanczos",
 ]
 
+_TRANSFORMS_CACHE = {}
+_PIPELINE_ID_CACHE = {}
 
 
 def get_transforms(is_video=True, train_pipeline=None, image_size=None):
@@ -69,8 +85,11 @@ def get_transforms(is_video=True, train_pipeline=None, image_size=None):
         if is_video
         else copy.deepcopy(train_pipeline.get("image", list()))
     )
+    worker_pipeline_info, _ = split_deferred_pipeline(train_pipeline_info)
+    if train_pipeline.get("uint8_transport", False):
+        worker_pipeline_info, _ = split_uint8_pipeline(worker_pipeline_info)
     pipeline = []
-    for pp_in in train_pipeline_info:
+    for pp_in in worker_pipeline_info:
         param_info = pp_in.get("param", dict())
         trans_type = pp_in.get("trans_type", "")
         trans_info = TransformMaping(
@@ -80,6 +99,168 @@ def get_transforms(is_video=True, train_pipeline=None, image_size=None):
     output_transforms = transforms.Compose(pipeline)
     return output_transforms
 
+
+def split_deferred_pipeline(pipeline_info):
+    """
+    Split a pipeline at its resize transform with "deferred": true in param. The dataloader workers run the
+    transforms up to the deferred resize, which only crops and computes the target size, the resize and the
+    transforms after it run on the collated batch. Returns (worker pipeline, post resize pipeline).
+    """
+    for i, pp_in in enumerate(pipeline_info):
+        if pp_in.get("param", dict()).get("deferred", False):
+            post_pipeline_info = pipeline_info[i + 1:]
+            for post_pp_in in post_pipeline_info:
+                if post_pp_in.get("trans_type", "") not in DEFERRED_POST_TRANSFORMS:
+                    raise ValueError(f"Only {DEFERRED_POST_TRANSFORMS} can follow a deferred resize, "
+                                     f"got {post_pp_in.get('trans_type', '')}.")
+            return pipeline_info[:i + 1], post_pipeline_info
+    return pipeline_info, []
+
+
+def split_uint8_pipeline(pipeline_info):
+    """
+    Split the pixel value transforms out of a pipeline for the uint8 transport. The resizes are linear, so the
+    value transforms commute with them up to the rounding of the uint8 resize. Returns (worker pipeline,
+    device pipeline).
+    """
+    worker_pipeline_info = [pp_in for pp_in in pipeline_info
+                            if pp_in.get("trans_type", "") not in UINT8_DEVICE_TRANSFORMS]
+    device_pipeline_info = [pp_in for pp_in in pipeline_info
+                            if pp_in.get("trans_type", "") in UINT8_DEVICE_TRANSFORMS]
+    return worker_pipeline_info, device_pipeline_info
+
+
+def build_video_transforms(pipeline_info):
+    return [
+        TransformMaping(is_video=True, trans_type=pp_in.get("trans_type", ""),
+                        param=pp_in.get("param", dict())).get_trans_func()
+        for pp_in in pipeline_info
+    ]
+
+
+def get_deferred_resize(output_transforms):
+    """The deferred resize transform of the transforms built by get_transforms, None if there is none."""
+    if output_transforms is None or not output_transforms.transforms:
+        return None
+    last_transform = output_transforms.transforms[-1]
+    return last_transform if getattr(last_transform, "deferred", False) else None
+
+
+class DeferredResizeTransform:
+    """
+    Run the deferred resize of the video train_pipeline, which the video and image processers both use, and the
+    transforms after it on a collated batch, e.g. on the device, instead of one clip at a time in the dataloader
+    workers. The clips of the same crop and target size are resized in one interpolate call.
+
+    The batch holds the padded crops (b c t h w) and the resize info (b 7): crop_h, crop_w, target_h, target_w,
+    num_frames, padded_h, padded_w, the last three are written by the Collate, the output is padded to them like
+    the Collate pads resized clips. uint8 crops are resized in float and rounded back to uint8, as the CPU resize
+    of uint8 clips does.
+    """
+
+    def __init__(self, train_pipeline):
+        pipeline_info = train_pipeline.get("video", list())
+        worker_pipeline_info, post_pipeline_info = split_deferred_pipeline(pipeline_info)
+        if train_pipeline.get("uint8_transport", False):
+            # the value transforms of the workers run after the resize
+            _, device_pipeline_info = split_uint8_pipeline(worker_pipeline_info)
+            post_pipeline_info = device_pipeline_info + post_pipeline_info
+        self.resize_transform = get_deferred_resize(get_transforms(is_video=True, train_pipeline=train_pipeline))
+        if self.resize_transform is None:
+            raise ValueError("The video train_pipeline has no resize transform with \"deferred\": true.")
+        self.post_transforms = build_video_transforms(post_pipeline_info)
+
+    def __call__(self, video, resize_info):
+        groups = defaultdict(list)
+        for i, info in enumerate(resize_info.tolist()):
+            groups[tuple(info[:5])].append(i)
+        padded_h, padded_w = resize_info[0, 5:7].tolist()
+
+        output = None
+        for (crop_h, crop_w, target_h, target_w, t), indices in groups.items():
+            clips = video[indices, :, :t, :crop_h, :crop_w]
+            b, c = clips.shape[:2]
+            # the frames of all the clips as one batch of images
+            frames = clips.transpose(1, 2).reshape(b * t, c, crop_h, crop_w)
+            if (crop_h, crop_w) != (target_h, target_w):
+                dtype = frames.dtype
+                frames = resize(frames.float(), (target_h, target_w), self.resize_transform.interpolation_mode)
+                if dtype == torch.uint8:
+                    frames = frames.round_().clamp_(0, 255)
+                frames = frames.to(dtype)
+            for post_transform in self.post_transforms:
+                frames = post_transform(frames)
+            frames = frames.reshape(b, t, c, target_h, target_w).transpose(1, 2)
+            if output is None:
+                pad_value = 128 if frames.dtype == torch.uint8 else 0
+                output = frames.new_full((video.shape[0], c, video.shape[2], padded_h, padded_w), pad_value)
+            output[indices, :, :t, :target_h, :target_w] = frames
+        return output
+
+
+class Uint8NormTransform:
+    """
+    Run the pixel value transforms of a video train_pipeline with "uint8_transport": true on a collated uint8
+    batch, e.g. on the device, so the dataloader workers send uint8 instead of float32 videos. The transforms
+    are the ones of the pipeline, e.g. ToTensorVideo and ae_norm. The float pipeline pads the transformed clips
+    with zeros, so the padding of the batch is zeroed after the transforms, where the latent video mask is 0.
+    """
+
+    def __init__(self, train_pipeline):
+        if not train_pipeline.get("uint8_transport", False):
+            raise ValueError("The train_pipeline has no \"uint8_transport\": true.")
+        worker_pipeline_info, _ = split_deferred_pipeline(train_pipeline.get("video", list()))
+        _, device_pipeline_info = split_uint8_pipeline(worker_pipeline_info)
+        self.transforms = build_video_transforms(device_pipeline_info)
+
+    @staticmethod
+    def expand_video_mask(video_mask, thw):
+        """The b t h w latent mask of the Collate as a mask of the pixels, the first frame has its own latent."""
+        t, h, w = thw
+        latent_t, latent_h, latent_w = video_mask.shape[1:]
+        stride_t = (t - 1) // (latent_t - 1) if latent_t > 1 else 1
+        mask = video_mask.bool()
+        mask = torch.cat([mask[:, :1], mask[:, 1:].repeat_interleave(stride_t, dim=1)], dim=1)
+        mask = mask.repeat_interleave(h // latent_h, dim=2).repeat_interleave(w // latent_w, dim=3)
+        return mask[:, :t, :h, :w]
+
+    def __call__(self, video, video_mask=None):
+        b, c, t, h, w = video.shape
+        # the frames of all the clips as one batch of images
+        frames = video.transpose(1, 2).reshape(b * t, c, h, w)
+        for transform in self.transforms:
+            frames = transform(frames)
+        video = frames.reshape(b, t, c, h, w).transpose(1, 2)
+        if video_mask is not None:
+            mask = self.expand_video_mask(video_mask, (t, h, w))
+            video = video.masked_fill(~mask.unsqueeze(1), 0)
+        return video
+
+
+def get_cached_transforms(is_video=True, train_pipeline=None, image_size=None):
+    """
+    Same as get_transforms, but the transforms are built once per (pipeline config, image_size)
+    and shared by all the processers of the process, the transforms keep no state between calls.
+    """
+    if train_pipeline is None:
+        return None
+    image_size = tuple(image_size) if image_size is not None else None
+    # fast path for the pipeline dict a processer holds, keep it in the entry so its id can not be reused
+    fast_key = (is_video, id(train_pipeline), image_size)
+    entry = _PIPELINE_ID_CACHE.get(fast_key, None)
+    if entry is not None and entry[0] is train_pipeline:
+        return entry[1]
+
+    pipeline_info = train_pipeline.get("video" if is_video else "image", list())
+    cache_key = (is_video, json.dumps(pipeline_info, sort_keys=True, default=str),
+                 bool(train_pipeline.get("uint8_transport", False)), image_size)
+    if cache_key not in _TRANSFORMS_CACHE:
+        _TRANSFORMS_CACHE[cache_key] = get_transforms(
+            is_video=is_video, train_pipeline=train_pipeline, image_size=image_size
+        )
+    _PIPELINE_ID_CACHE[fast_key] = (train_pipeline, _TRANSFORMS_CACHE[cache_key])
+    return _TRANSFORMS_CACHE[cache_key]
+
 class TransformMaping:
     """used for transforms mapping"""
 
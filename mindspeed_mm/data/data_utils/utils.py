@@ -13,11 +13,16 @@ import sys
 import html
 import math
 import copy
+import json
 import random
+import hashlib
+import tempfile
+import threading
 import urllib.parse as ul
 from tqdm import tqdm
 from fractions import Fraction
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, Optional, Tuple, Union, Sequence
 
 try:
@@ -54,22 +59,44 @@ import tokenizers
 
 from mindspeed_mm.data.data_utils.data_transform import (
     TemporalRandomCrop, 
+    TemporalCenterCrop,
     Expand2Square,
     get_params,
     calculate_statistics,
     maxhwresize
 )
-from mindspeed_mm.data.data_utils.transform_pipeline import get_transforms
+from mindspeed_mm.data.data_utils.transform_pipeline import get_cached_transforms
+from mindspeed_mm.data.data_utils.sample_table import SampleSizes
+from mindspeed_mm.data.data_utils.shared_stats import SharedStats
 from mindspeed_mm.data.data_utils.constants import MODEL_CONSTANTS
 
 VID_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
 
+# bump it when the filter rules of VideoProcesser.build_frame_index change, to invalidate the cached indexes
+FRAME_INDEX_VERSION = 1
+FILE_TYPE_UNKNOWN, FILE_TYPE_VIDEO, FILE_TYPE_IMAGE = 0, 1, 2
+(
+    FILTER_KEEP,
+    FILTER_NO_CAP,
+    FILTER_NO_RESOLUTION,
+    FILTER_RES_MISMATCH_STRIDE,
+    FILTER_RES_TOO_SMALL,
+    FILTER_ASPECT_MISMATCH,
+    FILTER_TOO_LONG,
+    FILTER_TOO_SHORT,
+) = range(8)
+
+# the columns of the annotation files used by the combine mode, the other columns are not loaded
+ANNOTATION_COLUMNS = ("path", "cap", "fps", "num_frames", "resolution", "cut", "crop", "aes", "aesthetic")
+
 
 class DataFileReader:
-    """get the data from different types of files such as csv/json/parquat"""
+    """get the data from different types of files such as csv/json/parquet"""
 
-    def __init__(self, data_storage_mode="standard"):
+    def __init__(self, data_storage_mode="standard", num_workers=8, chunk_size=100000):
         self.data_storage_mode = data_storage_mode
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
 
     def __call__(self, data_path, return_type="list"):
         if self.data_storage_mode == "standard":
@@ -86,8 +113,8 @@ class DataFileReader:
             data_out = pd.read_pickle(data_path)
         elif data_path.endswith(".jsonl"):
             data_out = pd.read_json(data_path, lines=True)
-        elif data_path.endswith(".parquat"):
-            data_out = pd.read_parquat(data_path)
+        elif data_path.endswith(".parquet"):
+            data_out = pd.read_parquet(data_path)
         else:
             raise NotImplementedError(f"Unsupported file format: {data_path}")
 
@@ -99,19 +126,58 @@ class DataFileReader:
         else:
             raise NotImplementedError(f"Unsupported return_type: {return_type}")
 
+    def read_annotation(self, anno, columns=ANNOTATION_COLUMNS):
+        """Read an annotation file to a DataFrame of the given columns, the missing columns are skipped."""
+        if anno.endswith(".jsonl"):
+            # stream the lines by chunks, only the projected columns of every chunk are kept
+            chunks = [
+                chunk[[name for name in columns if name in chunk.columns]]
+                for chunk in pd.read_json(anno, lines=True, chunksize=self.chunk_size)
+            ]
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        if anno.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            names = pq.read_schema(anno).names
+            return pd.read_parquet(anno, columns=[name for name in columns if name in names])
+        if anno.endswith(".json"):
+            data_out = pd.read_json(anno)
+        elif anno.endswith(".pkl"):
+            data_out = pd.read_pickle(anno)
+            if isinstance(data_out, list):
+                data_out = pd.DataFrame(data_out)
+        else:
+            raise NotImplementedError(f"Unsupported file format: {anno}")
+        return data_out[[name for name in columns if name in data_out.columns]]
+
     def get_cap_list(self, data_path):
-        cap_lists = []
+        """
+        Read the annotation files listed in data_path, one "folder,anno" per line, to one DataFrame.
+        The files are read by a thread pool, the I/O and the parquet decoding run in parallel.
+        """
         with open(data_path, "r") as f:
             folder_anno = [
                 i.strip().split(",") for i in f.readlines() if len(i.strip()) > 0
             ]
-        for folder, anno in folder_anno:
-            sub_list = self.get_datasamples(anno)
-            print(f"Building {anno}...")
-            for sub in sub_list:
-                sub["path"] = os.path.join(folder, sub["path"])
-            cap_lists += sub_list
-        return cap_lists
+
+        def read_shard(folder, anno):
+            sub_df = self.read_annotation(anno)
+            if len(sub_df) == 0:
+                return sub_df
+            return sub_df.assign(path=[os.path.join(folder, path) for path in sub_df["path"]])
+
+        num_workers = max(1, min(self.num_workers, len(folder_anno)))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            sub_dfs = list(executor.map(lambda x: read_shard(*x), folder_anno))
+
+        # (folder, anno, start, end) of every annotation file, used to cache the frame index per file
+        self.anno_shards = []
+        start = 0
+        for (folder, anno), sub_df in zip(folder_anno, sub_dfs):
+            print(f"Building {anno}: {len(sub_df)} samples")
+            self.anno_shards.append((folder, anno, start, start + len(sub_df)))
+            start += len(sub_df)
+        return pd.concat(sub_dfs, ignore_index=True) if sub_dfs else pd.DataFrame()
 
 
 class DecordDecoder(object):
@@ -122,6 +188,7 @@ class DecordDecoder(object):
         self.reader = decord.VideoReader(url,
                                     ctx=self.ctx,
                                     num_threads=self.num_threads)
+        self.frame_shape = None
 
     def get_avg_fps(self):
         return self.reader.get_avg_fps() if self.reader.get_avg_fps() > 0 else 30.0
@@ -129,16 +196,21 @@ class DecordDecoder(object):
     def get_num_frames(self):
         return len(self.reader)
 
+    def get_frame_shape(self):
+        # decode frame 0 only once per handle
+        if self.frame_shape is None:
+            self.frame_shape = self.reader[0].shape if self.get_num_frames() > 0 else (0, 0, 0)
+        return self.frame_shape
+
     def get_height(self):
-        return self.reader[0].shape[0] if self.get_num_frames() > 0 else 0
+        return self.get_frame_shape()[0]
 
     def get_width(self):
-        return self.reader[0].shape[1] if self.get_num_frames() > 0 else 0
+        return self.get_frame_shape()[1]
 
     # output shape [T, H, W, C]
     def get_batch(self, frame_indices):
         try:
-            #frame_indices[0] = 1000
             video_data = self.reader.get_batch(frame_indices).asnumpy()
             video_data = torch.from_numpy(video_data)
             return video_data
@@ -147,27 +219,169 @@ class DecordDecoder(object):
             return None
 
 
-class VideoReader:
-    """support some methods to read video"""
+class TorchvisionDecoder(object):
+    """
+    Frame range reader on the pyav backend of torchvision.
 
-    def __init__(self, video_reader_type=None):
-        self.video_reader_type = video_reader_type
-    
-    def __call__(self, video_path):
-        is_decord_read = False
-        info = None
+    Unlike torchvision.io.read_video, which decodes the whole file, get_batch seeks to the keyframe
+    before the first selected frame and stops decoding after the last one, only the selected frames
+    are converted to rgb.
+
+    Args:
+        url(str): the video path
+        num_threads(int): the decoding threads of the codec
+        seek_to_keyframe(bool): seek to the keyframe before the first selected frame, otherwise
+            decode from the beginning of the file, for files with a broken index
+    """
+
+    def __init__(self, url, num_threads=1, seek_to_keyframe=True):
+        self.container = av.open(url)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_count = num_threads
+        self.seek_to_keyframe = seek_to_keyframe
+        self.time_base = self.stream.time_base
+        self.start_pts = self.stream.start_time or 0
+        self.fps = float(self.stream.average_rate) if self.stream.average_rate else 30.0
+
+    def get_avg_fps(self):
+        return self.fps
+
+    def get_num_frames(self):
+        if self.stream.frames > 0:
+            return self.stream.frames
+        if self.stream.duration is not None:
+            return int(self.stream.duration * self.time_base * self.fps)
+        return int(self.container.duration / av.time_base * self.fps) if self.container.duration else 0
+
+    def get_height(self):
+        return self.stream.codec_context.height
 
+    def get_width(self):
+        return self.stream.codec_context.width
+
+    def get_frame_index(self, frame):
+        return int(round(float((frame.pts - self.start_pts) * self.time_base) * self.fps))
+
+    def decode_from(self, start_frame_idx, selected):
+        seek = self.seek_to_keyframe and start_frame_idx > 0
+        offset = self.start_pts + int(start_frame_idx / self.fps / self.time_base) if seek else self.start_pts
+        self.container.seek(offset, stream=self.stream, backward=True, any_frame=False)
+        last_frame_idx = max(selected)
+        frames = {}
+        for frame in self.container.decode(self.stream):
+            if frame.pts is None:
+                continue
+            frame_idx = self.get_frame_index(frame)
+            if seek and not frames and frame_idx > start_frame_idx:
+                # the seek passed the first selected frame
+                return None
+            if frame_idx in selected:
+                frames[frame_idx] = frame.to_ndarray(format="rgb24")
+            if frame_idx >= last_frame_idx:
+                break
+        return frames
+
+    # output shape [T, H, W, C]
+    def get_batch(self, frame_indices):
+        try:
+            selected = set(int(idx) for idx in frame_indices)
+            start_frame_idx = min(selected)
+            frames = self.decode_from(start_frame_idx, selected)
+            if frames is None:
+                frames = self.decode_from(0, selected)
+            missing = selected.difference(frames)
+            if missing:
+                raise IndexError(f"frames {sorted(missing)} out of {self.get_num_frames()} frames")
+            video_data = np.stack([frames[int(idx)] for idx in frame_indices])
+            return torch.from_numpy(video_data)
+        except Exception as e:
+            print(f"Get_batch execption: {e}")
+            return None
+
+    def close(self):
+        self.container.close()
+
+
+class VideoReader:
+    """
+    support some methods to read video
+
+    Args:
+        video_reader_type(str): "decoder" for decord or "torchvision" for the pyav backend of torchvision
+        decoder_cache_size(int): the number of open decoder handles kept per process, the handles are
+            reused by the clips cut from the same source file, 0 to disable
+        num_threads(int): the decoding threads of every handle
+        seek_to_keyframe(bool): only used by the torchvision reader, see TorchvisionDecoder
+    """
+
+    def __init__(self, video_reader_type=None, decoder_cache_size=0, num_threads=1, seek_to_keyframe=True):
+        self.video_reader_type = video_reader_type
+        self.decoder_cache_size = decoder_cache_size
+        self.num_threads = num_threads
+        self.seek_to_keyframe = seek_to_keyframe
+        self.decoder_cache = OrderedDict()
+        self.decoder_cache_lock = threading.Lock()
+        self.cache_pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["decoder_cache"] = OrderedDict()
+        state["decoder_cache_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.decoder_cache_lock = threading.Lock()
+        self.cache_pid = os.getpid()
+
+    def open_decoder(self, video_path):
         if self.video_reader_type == "decoder":
-            vframes = DecordDecoder(video_path)
-            is_decord_read = True
+            return DecordDecoder(video_path, num_threads=self.num_threads)
         elif self.video_reader_type == "torchvision":
-            vframes, aframes, info = torchvision.io.read_video(
-                filename=video_path, pts_unit="sec", output_format="TCHW"
-            )  # [T: temporal, C: channel, H: height, W: width]
+            return TorchvisionDecoder(video_path, num_threads=self.num_threads,
+                                      seek_to_keyframe=self.seek_to_keyframe)
         else:
             raise NotImplementedError(
                 f"Unsupported video reader type: {self.video_reader_type}"
             )
+
+    def acquire(self, video_path):
+        """Take an open handle out of the cache, so a handle is never shared by two threads."""
+        with self.decoder_cache_lock:
+            if self.cache_pid != os.getpid():
+                # handles opened before a fork belong to the parent process
+                self.decoder_cache = OrderedDict()
+                self.cache_pid = os.getpid()
+            decoder = self.decoder_cache.pop(video_path, None)
+        return decoder if decoder is not None else self.open_decoder(video_path)
+
+    def release(self, video_path, vframes):
+        """
+        Give the handle back to the cache, the least recently used handles are closed, and so is the handle
+        itself when the cache is disabled. Call it once the frames are read, also when reading failed.
+        """
+        evicted = []
+        if self.decoder_cache_size <= 0:
+            evicted.append(vframes)
+        else:
+            with self.decoder_cache_lock:
+                if self.cache_pid != os.getpid():
+                    evicted.append(vframes)
+                else:
+                    old = self.decoder_cache.pop(video_path, None)
+                    if old is not None:
+                        evicted.append(old)
+                    self.decoder_cache[video_path] = vframes
+                    while len(self.decoder_cache) > self.decoder_cache_size:
+                        evicted.append(self.decoder_cache.popitem(last=False)[1])
+        for decoder in evicted:
+            if hasattr(decoder, "close"):
+                decoder.close()
+
+    def __call__(self, video_path):
+        vframes = self.acquire(video_path)
+        is_decord_read = self.video_reader_type == "decoder"
+        info = {"video_fps": vframes.get_avg_fps()}
         return vframes, info, is_decord_read
 
 
@@ -200,12 +414,16 @@ class VideoProcesser:
             gradient_accumulation_size=1,
             batch_size=1,
             min_num_frames=29,
+            temporal_crop="random",
             **kwargs,
     ):
         self.num_frames = num_frames
         self.train_pipeline = train_pipeline
         self.video_transforms = None
-        self.temporal_sample = TemporalRandomCrop(num_frames * frame_interval)
+        if temporal_crop not in ("random", "center"):
+            raise ValueError(f"Unsupported temporal_crop {temporal_crop}, it must be random or center.")
+        temporal_crop_cls = TemporalRandomCrop if temporal_crop == "random" else TemporalCenterCrop
+        self.temporal_sample = temporal_crop_cls(num_frames * frame_interval)
         self.data_storage_mode = data_storage_mode
 
         self.max_height = max_height
@@ -238,17 +456,17 @@ class VideoProcesser:
         vframes, 
         start_frame_idx,
         clip_total_frames,
-        predefine_frame_indice=None,
+        predefine_num_frames=None,
         fps=16,
         image_size=None, 
         is_decord_read=False, 
         crop=[None, None, None, None]
     ):
         if image_size:
-            self.video_transforms = get_transforms(is_video=True, train_pipeline=self.train_pipeline,
-                                                   image_size=image_size)
+            self.video_transforms = get_cached_transforms(is_video=True, train_pipeline=self.train_pipeline,
+                                                          image_size=image_size)
         else:
-            self.video_transforms = get_transforms(is_video=True, train_pipeline=self.train_pipeline)
+            self.video_transforms = get_cached_transforms(is_video=True, train_pipeline=self.train_pipeline)
         
         if self.data_storage_mode == "combine":
             video = self.combine_data_video_process(
@@ -256,7 +474,7 @@ class VideoProcesser:
                 start_frame_idx,
                 clip_total_frames,
                 is_decord_read=is_decord_read,
-                predefine_frame_indice=predefine_frame_indice,
+                predefine_num_frames=predefine_num_frames,
                 fps=fps,
                 crop=crop,
             )
@@ -277,9 +495,8 @@ class VideoProcesser:
         return video_data
 
     def combine_data_video_process(
-        self, vframes, start_frame_idx, clip_total_frames, is_decord_read=True, predefine_frame_indice=None, fps=16, crop=[None, None, None, None]
+        self, vframes, start_frame_idx, clip_total_frames, is_decord_read=True, predefine_num_frames=None, fps=16, crop=[None, None, None, None]
     ):
-        predefine_num_frames = len(predefine_frame_indice)
 
         # resample in case high fps, such as 50/60/90/144 -> train_fps(e.g, 24)
         frame_interval = 1.0 if abs(fps - self.train_fps) < 0.1 else fps / self.train_fps
@@ -308,7 +525,7 @@ class VideoProcesser:
             raise IndexError(f'video has {clip_total_frames} frames, but need to sample {len(frame_indices)} frames ({frame_indices})')
         frame_indices = frame_indices[:end_frame_idx]
         if predefine_num_frames != len(frame_indices):
-            raise ValueError(f'video predefine_num_frames ({predefine_num_frames}) ({predefine_frame_indice}) is not equal with frame_indices ({len(frame_indices)}) ({frame_indices})')
+            raise ValueError(f'video predefine_num_frames ({predefine_num_frames}) is not equal with frame_indices ({len(frame_indices)}) ({frame_indices})')
         if len(frame_indices) < self.num_frames and self.drop_short_ratio >= 1:
             raise IndexError(f'video has {clip_total_frames} frames, but need to sample {len(frame_indices)} frames ({frame_indices})')
         video = self.get_batched_data(vframes, frame_indices, crop)
@@ -318,27 +535,197 @@ class VideoProcesser:
         video = video.permute(1, 0, 2, 3)
         return video
 
-    def define_frame_index(self, cap_list):
-        shape_idx_dict = {}
-        new_cap_list = []
-        sample_size = []
-        aesthetic_score = []
-        cnt_vid = 0
-        cnt_img = 0
-        cnt_too_long = 0
-        cnt_too_short = 0
-        cnt_no_cap = 0
-        cnt_no_resolution = 0
-        cnt_no_aesthetic = 0
-        cnt_img_res_mismatch_stride = 0
-        cnt_vid_res_mismatch_stride = 0
-        cnt_img_aspect_mismatch = 0
-        cnt_vid_aspect_mismatch = 0
-        cnt_img_res_too_small = 0
-        cnt_vid_res_too_small = 0
-        cnt_vid_after_filter = 0
-        cnt_img_after_filter = 0
-        cnt = len(cap_list)
+    def get_frame_index_cache_key(self, folder, anno):
+        """Hash of the filter parameters and the annotation file, samples are re-filtered when any of them changes."""
+        filter_params = dict(
+            num_frames=self.num_frames,
+            temporal_sample_size=self.temporal_sample.size,
+            train_fps=self.train_fps,
+            too_long_factor=self.too_long_factor,
+            speed_factor=self.speed_factor,
+            max_height=self.max_height,
+            max_width=self.max_width,
+            max_hxw=self.max_hxw,
+            min_hxw=self.min_hxw,
+            force_resolution=self.force_resolution,
+            force_5_ratio=self.force_5_ratio,
+            hw_stride=self.hw_stride,
+            max_h_div_w_ratio=self.max_h_div_w_ratio,
+            min_h_div_w_ratio=self.min_h_div_w_ratio,
+            ae_stride_t=self.ae_stride_t,
+            sp_size=self.sp_size,
+            min_num_frames=self.min_num_frames,
+        )
+        anno_stat = os.stat(anno)
+        identity = json.dumps(
+            [FRAME_INDEX_VERSION, filter_params, folder, os.path.abspath(anno), anno_stat.st_size, anno_stat.st_mtime_ns],
+            sort_keys=True,
+        )
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def build_frame_index(self, samples):
+        """
+        Filter the samples of one annotation file, vectorised over columns.
+        The result only depends on the filter parameters, the random drop of short videos and
+        the filter of minority shapes are applied later in define_frame_index.
+        """
+        num_samples = len(samples)
+        reason = np.full(num_samples, FILTER_KEEP, dtype=np.int8)
+
+        def reject(mask, code):
+            reason[mask & (reason == FILTER_KEEP)] = code
+
+        def get_column(name, default=None):
+            if name in samples.columns:
+                return samples[name]
+            return pd.Series([default] * num_samples, index=samples.index, dtype=object)
+
+        paths = samples["path"].to_numpy()
+        file_type = np.array(
+            [FILE_TYPE_VIDEO if path.endswith(".mp4") else FILE_TYPE_IMAGE if path.endswith(".jpg") else FILE_TYPE_UNKNOWN
+             for path in paths],
+            dtype=np.int8,
+        )
+        is_video = file_type == FILE_TYPE_VIDEO
+
+        # ======no caption=====
+        reject(get_column("cap").isna().to_numpy(), FILTER_NO_CAP)
+
+        # ======resolution mismatch=====
+        resolution = [res if isinstance(res, dict) else {} for res in get_column("resolution").to_numpy()]
+        height = np.array([res.get("height", None) for res in resolution], dtype=np.float64)
+        width = np.array([res.get("width", None) for res in resolution], dtype=np.float64)
+        reject(np.isnan(height) | np.isnan(width), FILTER_NO_RESOLUTION)
+
+        sample_h = np.zeros(num_samples, dtype=np.int64)
+        sample_w = np.zeros(num_samples, dtype=np.int64)
+        if not self.force_resolution:
+            reject((height <= 0) | (width <= 0), FILTER_NO_RESOLUTION)
+            valid = reason == FILTER_KEEP
+            # the resize rule only depends on (height, width), so run it once per distinct resolution
+            hw = np.stack([height[valid], width[valid]], axis=1).astype(np.int64)
+            unique_hw, inverse = np.unique(hw, axis=0, return_inverse=True)
+            unique_sample_hw = np.zeros_like(unique_hw)
+            for idx, (ori_h, ori_w) in enumerate(unique_hw):
+                tr_h, tr_w = maxhwresize(int(ori_h), int(ori_w), self.max_hxw, force_5_ratio=self.force_5_ratio)
+                _, _, unique_sample_hw[idx, 0], unique_sample_hw[idx, 1] = get_params(
+                    tr_h, tr_w, self.hw_stride, force_5_ratio=self.force_5_ratio
+                )
+            sample_h[valid] = unique_sample_hw[inverse.reshape(-1), 0]
+            sample_w[valid] = unique_sample_hw[inverse.reshape(-1), 1]
+
+            reject((sample_h <= 0) | (sample_w <= 0), FILTER_RES_MISMATCH_STRIDE)
+            reject(sample_h * sample_w < self.min_hxw, FILTER_RES_TOO_SMALL)
+            h_div_w = sample_h / np.maximum(sample_w, 1)
+        else:
+            sample_h[:] = self.max_height
+            sample_w[:] = self.max_width
+            with np.errstate(divide="ignore", invalid="ignore"):
+                h_div_w = height / width
+        # filter aspect
+        reject(~((h_div_w <= self.max_h_div_w_ratio) & (h_div_w >= self.min_h_div_w_ratio)), FILTER_ASPECT_MISMATCH)
+
+        if np.any((reason == FILTER_KEEP) & (file_type == FILE_TYPE_UNKNOWN)):
+            unknown_path = paths[(reason == FILTER_KEEP) & (file_type == FILE_TYPE_UNKNOWN)][0]
+            raise NameError(
+                f"Unknown file extention {unknown_path.split('.')[-1]}, only support .mp4 for video and .jpg for image"
+            )
+
+        # ======video frames=====
+        fps = pd.to_numeric(get_column("fps", 24), errors="coerce").fillna(24).to_numpy(dtype=np.float64)
+        total_frames = pd.to_numeric(get_column("num_frames", 0), errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+        # too long video is not suitable for this training stage (self.num_frames)
+        max_frames = self.too_long_factor * (self.num_frames * fps / self.train_fps * self.speed_factor)
+        reject(is_video & (total_frames > max_frames), FILTER_TOO_LONG)
+
+        start_frame_idx = np.array(
+            [cut[0] if isinstance(cut, (list, tuple)) and len(cut) > 0 else 0 for cut in get_column("cut").to_numpy()],
+            dtype=np.int64,
+        )
+        # resample in case high fps, such as 50/60/90/144 -> train_fps(e.g, 24), same length as np.arange
+        frame_interval = np.where(np.abs(fps - self.train_fps) < 0.1, 1.0, fps / self.train_fps)
+        num_resampled = np.ceil(total_frames / frame_interval).astype(np.int64)
+        is_short = is_video & (num_resampled < self.num_frames)
+        # too long video will be temporal-crop to the size of self.temporal_sample
+        num_cropped = np.where(
+            num_resampled > self.num_frames, np.minimum(num_resampled, self.temporal_sample.size), num_resampled
+        )
+        # to find a suitable end_frame_idx, to ensure we do not need pad video
+        closest_table = np.array(
+            [self.find_closest_y(x, vae_stride_t=self.ae_stride_t, model_ds_t=self.sp_size)
+             for x in range(int(num_cropped[is_video].max(initial=0)) + 1)],
+            dtype=np.int64,
+        )
+        sample_num_frames = np.ones(num_samples, dtype=np.int64)
+        sample_num_frames[is_video] = closest_table[num_cropped[is_video]]
+        reject(is_video & (sample_num_frames == -1), FILTER_TOO_SHORT)
+        start_frame_idx[~is_video] = 0
+
+        return {
+            "reason": reason,
+            "file_type": file_type,
+            "is_short": is_short,
+            "start_frame_idx": start_frame_idx,
+            "sample_num_frames": sample_num_frames,
+            "sample_height": sample_h,
+            "sample_width": sample_w,
+        }
+
+    def get_frame_index(self, samples, folder=None, anno=None, index_cache_dir=None):
+        if index_cache_dir is None or anno is None:
+            return self.build_frame_index(samples)
+
+        cache_path = os.path.join(index_cache_dir, f"{self.get_frame_index_cache_key(folder, anno)}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                frame_index = {key: cached[key] for key in cached.files}
+            if len(frame_index["reason"]) == len(samples):
+                print(f"Load frame index of {anno} from {cache_path}")
+                return frame_index
+
+        frame_index = self.build_frame_index(samples)
+        os.makedirs(index_cache_dir, exist_ok=True)
+        # a unique name in the cache directory, the ranks of all the nodes may write the same index
+        fd, tmp_path = tempfile.mkstemp(dir=index_cache_dir, suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **frame_index)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return frame_index
+
+    def define_frame_index(self, cap_list, anno_shards=None, index_cache_dir=None):
+        """
+        Filter the samples of the cap list and define their frame window and sample size.
+
+        Args:
+            cap_list: the samples read by DataFileReader
+            anno_shards: (folder, anno, start, end) of every annotation file in the cap list,
+                the filtered index of each file is cached separately in index_cache_dir, so
+                appending a new annotation file to data.txt only filters the new samples
+            index_cache_dir: the directory of the cached indexes, None to disable the cache
+        """
+        samples = cap_list if isinstance(cap_list, pd.DataFrame) else pd.DataFrame(cap_list)
+        cnt = len(samples)
+        if anno_shards is None:
+            anno_shards = [(None, None, 0, cnt)]
+        frame_indexes = [
+            self.get_frame_index(samples.iloc[start:end], folder, anno, index_cache_dir)
+            for folder, anno, start, end in anno_shards
+        ]
+        frame_index = {key: np.concatenate([index[key] for index in frame_indexes]) for key in frame_indexes[0]}
+        reason = frame_index["reason"].copy()
+        file_type = frame_index["file_type"]
+
+        # comment out it to enable dynamic frames training
+        # the videos also too short for the vae draw too, as in the per-sample filter, so the other videos get the same draws
+        drop_short = np.flatnonzero(np.isin(reason, (FILTER_KEEP, FILTER_TOO_SHORT)) & frame_index["is_short"])
+        if len(drop_short) > 0:
+            drop_rand = torch.rand(len(drop_short), generator=self.generator).numpy()
+            reason[drop_short[drop_rand < self.drop_short_ratio]] = FILTER_TOO_SHORT
 
         if torch.distributed.is_initialized():
             world_size = torch.distributed.get_world_size()
@@ -349,190 +736,78 @@ class VideoProcesser:
         # discard samples with shape which num is less than 4 * total_batch_size
         filter_major_num = 4 * total_batch_size
 
-        for i in tqdm(cap_list, desc=f"flitering samples"):
-            path = i["path"]
-
-            if path.endswith('.mp4'):
-                cnt_vid += 1
-            elif path.endswith('.jpg'):
-                cnt_img += 1
-
-            # ======no aesthetic=====
-            if i.get("aesthetic", None) is None or i.get("aes", None) is None:
-                cnt_no_aesthetic += 1
-            else:
-                aesthetic_score.append(i.get("aesthetic", None) or i.get("aes", None))
-
-            cap = i.get("cap", None)
-            # ======no caption=====
-            if cap is None:
-                cnt_no_cap += 1
-                continue
-
-            # ======resolution mismatch=====
-            if i.get("resolution", None) is None:
-                cnt_no_resolution += 1
-                continue
-            else:
-                if i["resolution"].get("height", None) is None or i["resolution"].get("width", None) is None:
-                    cnt_no_resolution += 1
-                    continue
-                else:
-                    height, width = i["resolution"]["height"], i["resolution"]["width"]
-                    if not self.force_resolution:
-                        if height <= 0 or width <= 0:
-                            cnt_no_resolution += 1
-                            continue
-                        
-                        tr_h, tr_w = maxhwresize(height, width, self.max_hxw, force_5_ratio=self.force_5_ratio)
-                        _, _, sample_h, sample_w = get_params(tr_h, tr_w, self.hw_stride, force_5_ratio=self.force_5_ratio)
-
-                        if sample_h <= 0 or sample_w <= 0:
-                            if path.endswith('.mp4'):
-                                cnt_vid_res_mismatch_stride += 1
-                            elif path.endswith('.jpg'):
-                                cnt_img_res_mismatch_stride += 1
-                            continue
-                        
-                        # filter min_hxw
-                        if sample_h * sample_w < self.min_hxw:
-                            if path.endswith('.mp4'):
-                                cnt_vid_res_too_small += 1
-                            elif path.endswith('.jpg'):
-                                cnt_img_res_too_small += 1
-                            continue
-
-                        # filter aspect
-                        is_pick = filter_resolution(
-                            sample_h, 
-                            sample_w, 
-                            max_h_div_w_ratio=self.max_h_div_w_ratio, 
-                            min_h_div_w_ratio=self.min_h_div_w_ratio
-                        )
-
-                        if not is_pick:
-                            if path.endswith('.mp4'):
-                                cnt_vid_aspect_mismatch += 1
-                            elif path.endswith('.jpg'):
-                                cnt_img_aspect_mismatch += 1
-                            continue
-
-                        i["resolution"].update(dict(sample_height=sample_h, sample_width=sample_w))
-
-                    else:
-                        is_pick = filter_resolution(
-                            height, 
-                            width, 
-                            max_h_div_w_ratio=self.max_h_div_w_ratio, 
-                            min_h_div_w_ratio=self.min_h_div_w_ratio
-                        )
-
-                        if not is_pick:
-                            if path.endswith('.mp4'):
-                                cnt_vid_aspect_mismatch += 1
-                            elif path.endswith('.jpg'):
-                                cnt_img_aspect_mismatch += 1
-                            continue
-                            
-                        sample_h, sample_w = self.max_height, self.max_width
-
-                        i["resolution"].update(dict(sample_height=sample_h, sample_width=sample_w))
-
-
-
-            if path.endswith(".mp4"):
-                fps = i.get('fps', 24)
-                # max 5.0 and min 1.0 are just thresholds to filter some videos which have suitable duration. 
-                if i['num_frames'] > self.too_long_factor * (self.num_frames * fps / self.train_fps * self.speed_factor):  # too long video is not suitable for this training stage (self.num_frames)
-                    cnt_too_long += 1
-                    continue
-
-                # resample in case high fps, such as 50/60/90/144 -> train_fps(e.g, 24)
-                frame_interval = 1.0 if abs(fps - self.train_fps) < 0.1 else fps / self.train_fps
-                start_frame_idx = i.get("cut", [0])[0]
-                i["start_frame_idx"] = start_frame_idx
-                frame_indices = np.arange(
-                    start_frame_idx, start_frame_idx + i["num_frames"], frame_interval
-                ).astype(int)
-                frame_indices = frame_indices[frame_indices < start_frame_idx + i["num_frames"]]
-
-                # comment out it to enable dynamic frames training
-                if (
-                    len(frame_indices) < self.num_frames
-                    and torch.rand(1, generator=self.generator).item() < self.drop_short_ratio
-                ):
-                    cnt_too_short += 1
-                    continue
-
-                #  too long video will be temporal-crop randomly
-                if len(frame_indices) > self.num_frames:
-                    begin_index, end_index = self.temporal_sample(len(frame_indices))
-                    frame_indices = frame_indices[begin_index:end_index]
-                # to find a suitable end_frame_idx, to ensure we do not need pad video
-                end_frame_idx = self.find_closest_y(
-                    len(frame_indices), vae_stride_t=self.ae_stride_t, model_ds_t=self.sp_size
-                )
-                if (
-                    end_frame_idx == -1
-                ):  # too short that can not be encoded exactly by videovae
-                    cnt_too_short += 1
-                    continue
-                frame_indices = frame_indices[:end_frame_idx]
-
-                i["sample_frame_index"] = frame_indices.tolist()
-                i["sample_num_frames"] = len(i["sample_frame_index"])
-
-                new_cap_list.append(i)
-                cnt_vid_after_filter += 1
-
-            elif path.endswith(".jpg"):  # image
-                cnt_img_after_filter += 1
-
-                i["sample_frame_index"] = [0]
-                i["sample_num_frames"] = 1
-                new_cap_list.append(i)
-            else:
-                raise NameError(
-                    f"Unknown file extention {path.split('.')[-1]}, only support .mp4 for video and .jpg for image"
-                )
-            
-            sample_size.append(f"{len(i['sample_frame_index'])}x{sample_h}x{sample_w}")
-
-        counter = Counter(sample_size)
-        counter_cp = counter
+        keep = np.flatnonzero(reason == FILTER_KEEP)
         if not self.force_resolution and self.max_hxw is not None and self.min_hxw is not None:
-            assert all([np.prod(np.array(k.split('x')[1:]).astype(np.int32)) <= self.max_hxw for k in counter_cp.keys()])
-            assert all([np.prod(np.array(k.split('x')[1:]).astype(np.int32)) >= self.min_hxw for k in counter_cp.keys()])
-
-        len_before_filter_major = len(new_cap_list)
-        new_cap_list, sample_size = zip(*[[i, j] for i, j in zip(new_cap_list, sample_size) if counter[j] >= filter_major_num])
-        for idx, shape in enumerate(sample_size):
-            if shape_idx_dict.get(shape, None) is None:
-                shape_idx_dict[shape] = [idx]
-            else:
-                shape_idx_dict[shape].append(idx)
-        cnt_filter_minority = len_before_filter_major - len(new_cap_list)
-        counter = Counter(sample_size)
-        print(f'no_cap: {cnt_no_cap}, no_resolution: {cnt_no_resolution}\n'
-            f'too_long: {cnt_too_long}, too_short: {cnt_too_short}\n'
-            f'cnt_img_res_mismatch_stride: {cnt_img_res_mismatch_stride}, cnt_vid_res_mismatch_stride: {cnt_vid_res_mismatch_stride}\n'
-            f'cnt_img_res_too_small: {cnt_img_res_too_small}, cnt_vid_res_too_small: {cnt_vid_res_too_small}\n'
-            f'cnt_img_aspect_mismatch: {cnt_img_aspect_mismatch}, cnt_vid_aspect_mismatch: {cnt_vid_aspect_mismatch}\n'
+            hxw = frame_index["sample_height"][keep] * frame_index["sample_width"][keep]
+            assert np.all(hxw <= self.max_hxw)
+            assert np.all(hxw >= self.min_hxw)
+
+        def get_sample_sizes(indices):
+            return SampleSizes.from_columns(frame_index["sample_num_frames"][indices],
+                                            frame_index["sample_height"][indices],
+                                            frame_index["sample_width"][indices])
+
+        sample_size = get_sample_sizes(keep)
+        counter = np.bincount(sample_size.codes, minlength=len(sample_size.shapes))
+        is_major = counter[sample_size.codes] >= filter_major_num
+        cnt_filter_minority = int(len(keep) - is_major.sum())
+        keep = keep[is_major]
+        sample_size = get_sample_sizes(keep)
+        shape_idx_dict = sample_size.get_shape_idx_dict()
+
+        new_cap_list = samples.iloc[keep].reset_index(drop=True)
+        for key in ["start_frame_idx", "sample_num_frames", "sample_height", "sample_width"]:
+            new_cap_list[key] = frame_index[key][keep]
+
+        def count(code, type_code=None):
+            mask = reason == code
+            if type_code is not None:
+                mask = mask & (file_type == type_code)
+            return int(mask.sum())
+
+        # the counts of the filtered samples, kept for the logs and the checks of the filter
+        self.filter_counts = {
+            "no_cap": count(FILTER_NO_CAP),
+            "no_resolution": count(FILTER_NO_RESOLUTION),
+            "too_long": count(FILTER_TOO_LONG),
+            "too_short": count(FILTER_TOO_SHORT),
+            "cnt_img_res_mismatch_stride": count(FILTER_RES_MISMATCH_STRIDE, FILE_TYPE_IMAGE),
+            "cnt_vid_res_mismatch_stride": count(FILTER_RES_MISMATCH_STRIDE, FILE_TYPE_VIDEO),
+            "cnt_img_res_too_small": count(FILTER_RES_TOO_SMALL, FILE_TYPE_IMAGE),
+            "cnt_vid_res_too_small": count(FILTER_RES_TOO_SMALL, FILE_TYPE_VIDEO),
+            "cnt_img_aspect_mismatch": count(FILTER_ASPECT_MISMATCH, FILE_TYPE_IMAGE),
+            "cnt_vid_aspect_mismatch": count(FILTER_ASPECT_MISMATCH, FILE_TYPE_VIDEO),
+            "cnt_filter_minority": cnt_filter_minority,
+            "cnt_vid": int((file_type == FILE_TYPE_VIDEO).sum()),
+            "cnt_vid_after_filter": count(FILTER_KEEP, FILE_TYPE_VIDEO),
+            "cnt_img": int((file_type == FILE_TYPE_IMAGE).sum()),
+            "cnt_img_after_filter": count(FILTER_KEEP, FILE_TYPE_IMAGE),
+        }
+        counts = self.filter_counts
+        print(f'no_cap: {counts["no_cap"]}, no_resolution: {counts["no_resolution"]}\n'
+            f'too_long: {counts["too_long"]}, too_short: {counts["too_short"]}\n'
+            f'cnt_img_res_mismatch_stride: {counts["cnt_img_res_mismatch_stride"]}, cnt_vid_res_mismatch_stride: {counts["cnt_vid_res_mismatch_stride"]}\n'
+            f'cnt_img_res_too_small: {counts["cnt_img_res_too_small"]}, cnt_vid_res_too_small: {counts["cnt_vid_res_too_small"]}\n'
+            f'cnt_img_aspect_mismatch: {counts["cnt_img_aspect_mismatch"]}, cnt_vid_aspect_mismatch: {counts["cnt_vid_aspect_mismatch"]}\n'
             f'cnt_filter_minority: {cnt_filter_minority}\n'
-            f'Counter(sample_size): {counter}\n'
-            f'cnt_vid: {cnt_vid}, cnt_vid_after_filter: {cnt_vid_after_filter}, use_ratio: {round(cnt_vid_after_filter/(cnt_vid+1e-6), 5)*100}%\n'
-            f'cnt_img: {cnt_img}, cnt_img_after_filter: {cnt_img_after_filter}, use_ratio: {round(cnt_img_after_filter/(cnt_img+1e-6), 5)*100}%\n'
+            f'Counter(sample_size): {Counter({shape: len(indices) for shape, indices in shape_idx_dict.items()})}\n'
+            f'cnt_vid: {counts["cnt_vid"]}, cnt_vid_after_filter: {counts["cnt_vid_after_filter"]}, use_ratio: {round(counts["cnt_vid_after_filter"]/(counts["cnt_vid"]+1e-6), 5)*100}%\n'
+            f'cnt_img: {counts["cnt_img"]}, cnt_img_after_filter: {counts["cnt_img_after_filter"]}, use_ratio: {round(counts["cnt_img_after_filter"]/(counts["cnt_img"]+1e-6), 5)*100}%\n'
             f'before filter: {cnt}, after filter: {len(new_cap_list)}, use_ratio: {round(len(new_cap_list)/cnt, 5)*100}%')
 
-        if len(aesthetic_score) > 0:
-            stats_aesthetic = calculate_statistics(aesthetic_score)
-            print(f"before filter: {cnt}, after filter: {len(new_cap_list)}\n"
-                f"aesthetic_score: {len(aesthetic_score)}, cnt_no_aesthetic: {cnt_no_aesthetic}\n"
-                f"{len([i for i in aesthetic_score if i>=5.75])} > 5.75, 4.5 > {len([i for i in aesthetic_score if i<=4.5])}\n"
-                f"Mean: {stats_aesthetic['mean']}, Var: {stats_aesthetic['variance']}, Std: {stats_aesthetic['std_dev']}\n"
-                f"Min: {stats_aesthetic['min']}, Max: {stats_aesthetic['max']}")
-            
-        return pd.DataFrame(new_cap_list), sample_size, shape_idx_dict
+        if "aesthetic" in samples.columns and "aes" in samples.columns:
+            has_aesthetic = (samples["aesthetic"].notna() & samples["aes"].notna()).to_numpy()
+            aesthetic_score = samples["aesthetic"].where(samples["aesthetic"].astype(bool), samples["aes"])
+            aesthetic_score = aesthetic_score[has_aesthetic].tolist()
+            if len(aesthetic_score) > 0:
+                stats_aesthetic = calculate_statistics(aesthetic_score)
+                print(f"before filter: {cnt}, after filter: {len(new_cap_list)}\n"
+                    f"aesthetic_score: {len(aesthetic_score)}, cnt_no_aesthetic: {cnt - len(aesthetic_score)}\n"
+                    f"{len([i for i in aesthetic_score if i>=5.75])} > 5.75, 4.5 > {len([i for i in aesthetic_score if i<=4.5])}\n"
+                    f"Mean: {stats_aesthetic['mean']}, Var: {stats_aesthetic['variance']}, Std: {stats_aesthetic['std_dev']}\n"
+                    f"Min: {stats_aesthetic['min']}, Max: {stats_aesthetic['max']}")
+
+        return new_cap_list, sample_size, shape_idx_dict
 
     def find_closest_y(self, x, vae_stride_t=4, model_ds_t=1):
         if x < self.min_num_frames:
@@ -742,7 +1017,7 @@ class ImageProcesser:
             **kwargs,
     ):
         self.num_frames = num_frames
-        self.video_transforms = get_transforms(
+        self.video_transforms = get_cached_transforms(
             is_video=True, train_pipeline=train_pipeline
         )
         self.train_pipeline = train_pipeline
@@ -808,6 +1083,7 @@ class TextProcesser:
             padding_type="max_length",
             support_chinese=False,
             cfg=0.1,
+            token_store=None,
     ):
         self.model_max_length = model_max_length
         self.padding = padding_type
@@ -817,8 +1093,19 @@ class TextProcesser:
         self.support_chinese = support_chinese
         self.cfg = cfg
         self.enable_text_preprocessing = enable_text_preprocessing
+        self.token_store = token_store
+        if self.token_store is not None:
+            self.token_store.check_compatible(self)
 
     def __call__(self, texts):
+        if self.token_store is not None:
+            positions = [self.token_store.find(text) for text in texts]
+            # captions missing in the store fall back to the tokenizers
+            if min(positions) >= 0:
+                if self.enable_text_preprocessing and random.random() <= self.cfg:
+                    positions = [self.token_store.find("")]
+                return self.get_stored_tokens(positions)
+
         if self.enable_text_preprocessing:
             texts_info = [
                 TextProcesser.text_preprocessing(text, self.use_clean_caption)
@@ -854,6 +1141,16 @@ class TextProcesser:
             prompt_mask_2 = text_tokens_and_mask_2['attention_mask']  # 1, l
         return (prompt_ids, prompt_mask, prompt_ids_2, prompt_mask_2)
 
+    def get_stored_tokens(self, positions):
+        max_length = self.model_max_length if self.padding == "max_length" else None
+        prompt_ids, prompt_mask = self.token_store.pad_tokens(positions, max_length)
+        prompt_ids_2, prompt_mask_2 = None, None
+        if self.tokenizer_2 is not None:
+            prompt_ids_2, prompt_mask_2 = self.token_store.pad_tokens(
+                positions, self.tokenizer_2.model_max_length, suffix="_2"
+            )
+        return (prompt_ids, prompt_mask, prompt_ids_2, prompt_mask_2)
+
     @staticmethod
     def text_preprocessing(text, use_clean_caption=True, support_chinese=False):
         if use_clean_caption:
@@ -1110,7 +1407,136 @@ def collate_fn_default(batch):
     return ret
 
 
-def build_iterations(train_dl=None, val_dl=None, test_dl=None, iterator_type="cyclic"):
+class DevicePrefetcher:
+    """
+    Wrap a data iterator and copy the tensors of the next batches to the device ahead of time.
+
+    The copies are issued with non_blocking on a side stream from pinned memory, so the host to device
+    copy of batch i+1 overlaps the compute of batch i. Without a cuda/npu device, or for the cpu device,
+    the batches are moved synchronously, which keeps the same iteration order.
+
+    Args:
+        data_iterator: the iterator to wrap
+        device: the target device, the current cuda/npu device if None
+        num_prefetch(int): the number of batches kept in flight
+        pin_memory(bool): pin the tensors that are not pinned by the dataloader before copying
+    """
+
+    def __init__(self, data_iterator, device=None, num_prefetch=1, pin_memory=True):
+        self.data_iterator = data_iterator
+        self.num_prefetch = max(1, num_prefetch)
+        if device is None:
+            device = torch.cuda.current_device() if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device) if not isinstance(device, int) else device
+        self.use_stream = torch.cuda.is_available() and getattr(self.device, "type", "cuda") != "cpu"
+        self.pin_memory = pin_memory and self.use_stream
+        self.stream = torch.cuda.Stream(device=self.device) if self.use_stream else None
+        self.batches = []
+        self.exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def copy_to_device(self, data):
+        if isinstance(data, torch.Tensor):
+            if self.pin_memory and not data.is_pinned():
+                data = data.pin_memory()
+            return data.to(self.device, non_blocking=self.use_stream)
+        if isinstance(data, dict):
+            return {k: self.copy_to_device(v) for k, v in data.items()}
+        if isinstance(data, (list, tuple)):
+            return type(data)(self.copy_to_device(v) for v in data)
+        return data
+
+    @staticmethod
+    def record_stream(data, stream):
+        # the tensors are allocated on the side stream, keep them alive until the compute stream is done
+        if isinstance(data, torch.Tensor):
+            data.record_stream(stream)
+        elif isinstance(data, dict):
+            for v in data.values():
+                DevicePrefetcher.record_stream(v, stream)
+        elif isinstance(data, (list, tuple)):
+            for v in data:
+                DevicePrefetcher.record_stream(v, stream)
+
+    def preload(self):
+        while not self.exhausted and len(self.batches) < self.num_prefetch:
+            try:
+                batch = next(self.data_iterator)
+            except StopIteration:
+                self.exhausted = True
+                break
+            event = None
+            if self.use_stream:
+                with torch.cuda.stream(self.stream):
+                    batch = self.copy_to_device(batch)
+                    event = torch.cuda.Event()
+                    event.record(self.stream)
+            else:
+                batch = self.copy_to_device(batch)
+            self.batches.append((batch, event))
+
+    def __next__(self):
+        self.preload()
+        if not self.batches:
+            raise StopIteration
+        batch, event = self.batches.pop(0)
+        if event is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_event(event)
+            self.record_stream(batch, current_stream)
+        # issue the copy of the next batch before the caller starts to compute on this one
+        self.preload()
+        return batch
+
+
+def get_data_stats(dataloader, process_group=None):
+    """
+    The stats of the sampler, the sample fetcher of the dataset and the collator of a dataloader. The stats of
+    the fetcher and the collator are summed over the dataloader workers and the ranks of process_group, e.g.
+    the data parallel group, it is a collective call on the ranks of process_group. The sampler plans the
+    batches of all the ranks, its stats are not summed.
+    """
+    summed_stats = {}
+    sample_fetcher = getattr(getattr(dataloader, "dataset", None), "sample_fetcher", None)
+    if sample_fetcher is not None:
+        summed_stats.update({f"fetch/{key}": value for key, value in sample_fetcher.stats.as_dict().items()})
+    collate_stats = getattr(getattr(dataloader, "collate_fn", None), "stats", None)
+    if isinstance(collate_stats, SharedStats):
+        summed_stats.update({f"collate/{key}": value for key, value in collate_stats.as_dict().items()})
+    if summed_stats and torch.distributed.is_initialized():
+        backend = torch.distributed.get_backend(process_group)
+        device = "cpu" if backend == "gloo" else torch.cuda.current_device()
+        values = torch.tensor(list(summed_stats.values()), dtype=torch.int64, device=device)
+        torch.distributed.all_reduce(values, group=process_group)
+        summed_stats = dict(zip(summed_stats.keys(), values.tolist()))
+
+    sampler_stats = getattr(getattr(dataloader, "sampler", None), "stats", None) or {}
+    stats = {f"sampler/{key}": value for key, value in dict(sampler_stats).items()}
+    stats.update(summed_stats)
+    return stats
+
+
+def log_data_stats(dataloader, process_group=None):
+    """Print the stats of a dataloader summed over process_group on the global rank 0."""
+    stats = get_data_stats(dataloader, process_group)
+    if stats and (not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0):
+        print(f"Data stats: {', '.join(f'{key} {value}' for key, value in stats.items())}")
+
+
+def build_iterations(
+    train_dl=None,
+    val_dl=None,
+    test_dl=None,
+    iterator_type="cyclic",
+    device_prefetch=0,
+):
+    """
+    Args:
+        device_prefetch(int): if > 0, the train iterator is wrapped by a DevicePrefetcher that keeps
+            device_prefetch batches in flight to the current device
+    """
 
     def _cyclic_iter(dl):
         while True:
@@ -1128,6 +1554,8 @@ def build_iterations(train_dl=None, val_dl=None, test_dl=None, iterator_type="cy
     
     if train_dl is not None:
         train_data_iterator = _get_iterator(train_dl)
+        if device_prefetch > 0:
+            train_data_iterator = DevicePrefetcher(train_data_iterator, num_prefetch=device_prefetch)
     else:
         train_data_iterator = None
 
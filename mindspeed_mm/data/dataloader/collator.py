@@ -13,9 +13,11 @@ from mindspeed_mm.data.data_utils.constants import (
     PROMPT_MASK, 
     VIDEO, 
     VIDEO_MASK,
+    VIDEO_RESIZE,
     PROMPT_IDS_2,
     PROMPT_MASK_2
 )
+from mindspeed_mm.data.data_utils.shared_stats import SharedStats
 
 
 
@@ -28,9 +30,81 @@ def pad_to_multiple(number, ds_stride):
         return number + padding
 
 
+def pad_text_to_batch_max(input_ids, cond_mask, multiple):
+    """
+    Pad or trim the text tokens (or text features) of a batch to the longest valid length in the batch,
+    rounded up to a multiple, instead of model_max_length.
+
+    input_ids: b [1 l] token ids or b [1 l d] text features
+    cond_mask: b [1 l]
+    """
+    # the last valid position, so that left padded tokens are never trimmed
+    valid_lengths = [int(torch.nonzero(mask[0]).max()) + 1 if mask.any() else 1 for mask in cond_mask]
+    text_length = pad_to_multiple(max(valid_lengths), multiple)
+
+    def pad_or_trim(x):
+        if x.shape[1] >= text_length:
+            return x[:, :text_length]
+        pad = [0, 0] * (x.ndim - 2) + [0, text_length - x.shape[1]]
+        return F.pad(x, pad, value=0)
+
+    return [pad_or_trim(x) for x in input_ids], [pad_or_trim(mask) for mask in cond_mask]
+
+
+def check_text_pad_multiple(text_pad_multiple, tensor_parallel_size=1, context_parallel_size=1):
+    """The text tokens are split across the tensor (sequence parallel) and context parallel ranks."""
+    if text_pad_multiple is None:
+        return
+    divisor = tensor_parallel_size * context_parallel_size
+    if not isinstance(text_pad_multiple, int) or text_pad_multiple <= 0 or text_pad_multiple % divisor != 0:
+        raise ValueError(f"text_pad_multiple must be a positive multiple of the tensor parallel size "
+                         f"({tensor_parallel_size}) times the context parallel size ({context_parallel_size}), "
+                         f"got {text_pad_multiple}.")
+
+
+def pad_and_stack(tensors, thw, pin_memory=False, pad_value=0):
+    """
+    Pad b [c t h w] tensors to [c *thw] and stack them, with a single copy into a preallocated batch.
+
+    In a dataloader worker the batch is allocated in shared memory, as torch's default_collate does, so it
+    is not copied again when it is sent to the main process. Otherwise it can be allocated in pinned memory.
+    """
+    elem = tensors[0]
+    if any(x.dtype != elem.dtype for x in tensors):
+        raise AssertionError(f"The tensors of a batch must have the same dtype, got {set(x.dtype for x in tensors)}, "
+                             f"the video and image train_pipeline must both be uint8 or both be float.")
+    shape = (len(tensors), elem.shape[0], *thw)
+    if torch.utils.data.get_worker_info() is not None:
+        numel = math.prod(shape)
+        storage = elem._typed_storage()._new_shared(numel, device=elem.device)
+        out = elem.new(storage).resize_(shape)
+    else:
+        out = torch.empty(shape, dtype=elem.dtype, device=elem.device,
+                          pin_memory=pin_memory and elem.device.type == "cpu")
+    for x, y in zip(out, tensors):
+        t, h, w = y.shape[1:]
+        if t > thw[0] or h > thw[1] or w > thw[2]:
+            raise AssertionError(f"The tensor of shape {tuple(y.shape)} is larger than the padded shape {thw}.")
+        x[:, :t, :h, :w].copy_(y)
+        # only the padding is filled
+        x[:, t:].fill_(pad_value)
+        x[:, :t, h:].fill_(pad_value)
+        x[:, :t, :h, w:].fill_(pad_value)
+    return out
+
+
 class Collate:
     """
     Provide the parameter (collate_fn) to the dataloader
+
+    Args:
+        text_pad_multiple(int): pad the text tokens to the longest caption in the batch, rounded up to this
+            multiple, instead of model_max_length. It must be a multiple of the tensor and context parallel
+            sizes when sequence or context parallel is used, build_mm_dataloader checks it against the parallel
+            state. None keeps model_max_length.
+        nan_check_interval(int): check the video batch for NaN every nan_check_interval batches, 0 to disable
+        pin_memory(bool): allocate the video batch in pinned memory, only used when collating in the main
+            process, the batches of the dataloader workers are allocated in shared memory
     """
 
     def __init__(
@@ -44,8 +118,19 @@ class Collate:
         patch_size: int = 2,
         patch_size_t: int = 1,
         num_frames: int = 13,
+        load_video_features: bool = False,
+        text_pad_multiple: int = None,
+        nan_check_interval: int = 1,
+        pin_memory: bool = False,
     ):
+        check_text_pad_multiple(text_pad_multiple)
         self.batch_size = batch_size
+        self.text_pad_multiple = text_pad_multiple
+        self.nan_check_interval = nan_check_interval
+        self.pin_memory = pin_memory
+        self.num_batches = 0
+        # shared with the dataloader workers, logged for the data parallel group by log_data_stats
+        self.stats = SharedStats(("duplicated_samples",))
         self.group_data = group_data
 
         self.max_height = max_height
@@ -61,6 +146,16 @@ class Collate:
         self.num_frames = num_frames
         self.max_thw = (self.num_frames, self.max_height, self.max_width)
 
+        # the tubes are already ae latents, so pad and build the mask in latent units
+        if load_video_features:
+            self.max_thw = (
+                (self.num_frames - 1) // self.ae_stride_t + 1,
+                self.max_height // self.ae_stride,
+                self.max_width // self.ae_stride,
+            )
+            self.ae_stride = self.ae_stride_t = 1
+            self.ae_stride_thw = (1, 1, 1)
+
     def package(self, batch):
         batch_tubes = [i[VIDEO] for i in batch]  # b [c t h w]
         input_ids = [i[PROMPT_IDS] for i in batch]  # b [1 l]
@@ -75,11 +170,14 @@ class Collate:
 
     def __call__(self, batch):
         batch_tubes, input_ids, cond_mask, input_ids_2, cond_mask_2 = self.package(batch)
+        # the crop and target sizes of the clips of a deferred resize, the tubes are the crops
+        resize_info = [i.get(VIDEO_RESIZE, None) for i in batch]
+        resize_info = torch.stack(resize_info) if resize_info[0] is not None else None
 
         ds_stride = self.ae_stride * self.patch_size
         t_ds_stride = self.ae_stride_t * self.patch_size_t
 
-        pad_batch_tubes, attention_mask, input_ids, cond_mask, input_ids_2, cond_mask_2 = self.process(
+        pad_batch_tubes, attention_mask, input_ids, cond_mask, input_ids_2, cond_mask_2, resize_info = self.process(
             batch_tubes,
             input_ids,
             cond_mask,
@@ -89,10 +187,16 @@ class Collate:
             ds_stride,
             self.max_thw,
             self.ae_stride_thw,
+            resize_info=resize_info,
         )
-        if torch.any(torch.isnan(pad_batch_tubes)):
-            raise AssertionError("after pad_batch_tubes.")
-        return {
+        self.num_batches += 1
+        if (pad_batch_tubes.is_floating_point() and self.nan_check_interval > 0
+                and self.num_batches % self.nan_check_interval == 0):
+            # a reduction to one value is much cheaper than a bool tensor of the batch, NaN always propagates,
+            # the exact check only runs if the sum is NaN, e.g. from +inf and -inf
+            if torch.isnan(pad_batch_tubes.sum()) and torch.any(torch.isnan(pad_batch_tubes)):
+                raise AssertionError("after pad_batch_tubes.")
+        outputs = {
             VIDEO: pad_batch_tubes,
             VIDEO_MASK: attention_mask,
             PROMPT_IDS: input_ids,
@@ -100,6 +204,9 @@ class Collate:
             PROMPT_IDS_2: input_ids_2,
             PROMPT_MASK_2: cond_mask_2,
         }
+        if resize_info is not None:
+            outputs[VIDEO_RESIZE] = resize_info
+        return outputs
 
     def process(
         self,
@@ -112,16 +219,25 @@ class Collate:
         ds_stride,
         max_thw,
         ae_stride_thw,
+        resize_info=None,
     ):
         # pad to max multiple of ds_stride
         batch_input_size = [i.shape for i in batch_tubes]  # [(c t h w), (c t h w)]
-        if len(batch_input_size) != self.batch_size:
+        if resize_info is not None:
+            # the clips are padded and masked by the size they have after the deferred resize
+            batch_input_size = [
+                torch.Size((size[0], size[1], target_h, target_w))
+                for size, (target_h, target_w) in zip(batch_input_size, resize_info[:, 2:4].tolist())
+            ]
+        # batch_size is None for the variable sized micro-batches of TokenBudgetBatchSampler
+        if self.batch_size is not None and len(batch_input_size) != self.batch_size:
             raise AssertionError("batch_input_size and batch_size are not equal.")
-        
-        is_grouped = self.group_data or self.batch_size == 1
+        batch_size = len(batch_input_size)
+
+        is_grouped = self.group_data or batch_size == 1
         if is_grouped:  #
             len_each_batch = batch_input_size
-            idx_length_dict = dict([*zip(list(range(self.batch_size)), len_each_batch)])
+            idx_length_dict = dict([*zip(list(range(batch_size)), len_each_batch)])
             count_dict = Counter(len_each_batch)
             if len(count_dict) != 1:
                 sorted_by_value = sorted(count_dict.items(), key=lambda item: item[1])
@@ -135,21 +251,15 @@ class Collate:
                     random.choice(candidate_batch)
                     for _ in range(len(len_each_batch) - len(candidate_batch))
                 ]
-                print(
-                    batch_input_size,
-                    idx_length_dict,
-                    count_dict,
-                    sorted_by_value,
-                    pick_length,
-                    candidate_batch,
-                    random_select_batch,
-                )
+                # the samplers give single shape batches, a mixed batch comes from a sample whose decoded
+                # shape differs from its planned shape
+                self.stats.add("duplicated_samples", len(random_select_batch))
                 pick_idx = candidate_batch + random_select_batch
 
                 batch_tubes = [batch_tubes[i] for i in pick_idx]
-                batch_input_size = [
-                    i.shape for i in batch_tubes
-                ]  # [(c t h w), (c t h w)]
+                batch_input_size = [batch_input_size[i] for i in pick_idx]  # [(c t h w), (c t h w)]
+                if resize_info is not None:
+                    resize_info = resize_info[pick_idx]
                 input_ids = [input_ids[i] for i in pick_idx]  # b [1, l]
                 cond_mask = [cond_mask[i] for i in pick_idx]  # b [1, l]
                 if input_ids_2 is not None:
@@ -157,7 +267,7 @@ class Collate:
                 if cond_mask_2 is not None:
                     cond_mask_2 = [cond_mask_2[i] for i in pick_idx]  # b [1, l]
 
-            for i in range(1, self.batch_size):
+            for i in range(1, batch_size):
                 if batch_input_size[0] != batch_input_size[i]:
                     raise AssertionError(
                         f"batch_input_size{0} and batch_input_size{i} are not equal."
@@ -173,15 +283,18 @@ class Collate:
             pad_to_multiple(max_w, ds_stride),
         )
         pad_max_t = pad_max_t + 1 - self.ae_stride_t
-        each_pad_t_h_w = [
-            [pad_max_t - i.shape[1], pad_max_h - i.shape[2], pad_max_w - i.shape[3]]
-            for i in batch_tubes
-        ]
-        pad_batch_tubes = [
-            F.pad(im, (0, pad_w, 0, pad_h, 0, pad_t), value=0)
-            for (pad_t, pad_h, pad_w), im in zip(each_pad_t_h_w, batch_tubes)
-        ]
-        pad_batch_tubes = torch.stack(pad_batch_tubes, dim=0)
+        # uint8 videos are normalised on the device by the Uint8NormTransform, which zeroes the padding of the
+        # mask, 128 keeps the pixels of a partially padded latent close to a zero normalised value
+        is_uint8 = batch_tubes[0].dtype == torch.uint8
+        if resize_info is not None:
+            # the crops are resized to (pad_max_h, pad_max_w) by the DeferredResizeTransform
+            crop_thw = (pad_max_t, max(i.shape[2] for i in batch_tubes), max(i.shape[3] for i in batch_tubes))
+            pad_batch_tubes = pad_and_stack(batch_tubes, crop_thw, pin_memory=self.pin_memory)
+            resize_info = torch.cat([resize_info, resize_info.new_tensor(
+                [[i.shape[1], pad_max_h, pad_max_w] for i in batch_tubes])], dim=1)
+        else:
+            pad_batch_tubes = pad_and_stack(batch_tubes, (pad_max_t, pad_max_h, pad_max_w),
+                                            pin_memory=self.pin_memory, pad_value=128 if is_uint8 else 0)
 
         max_tube_size = [pad_max_t, pad_max_h, pad_max_w]
         max_latent_size = [
@@ -197,32 +310,22 @@ class Collate:
             ]
             for i in batch_input_size
         ]
-        attention_mask = [
-            F.pad(
-                torch.ones(i, dtype=pad_batch_tubes.dtype),
-                (
-                    0,
-                    max_latent_size[2] - i[2],
-                    0,
-                    max_latent_size[1] - i[1],
-                    0,
-                    max_latent_size[0] - i[0],
-                ),
-                value=0,
-            )
-            for i in valid_latent_size
-        ]
-        attention_mask = torch.stack(attention_mask)  # b t h w
         if is_grouped:
-            if not torch.all(attention_mask.bool()):
+            if any(size != max_latent_size for size in valid_latent_size):
                 raise AssertionError("All elements of attention_mask are zero")
+        mask_dtype = torch.float32 if is_uint8 else pad_batch_tubes.dtype
+        attention_mask = torch.zeros([len(valid_latent_size)] + max_latent_size, dtype=mask_dtype)  # b t h w
+        for mask, (t, h, w) in zip(attention_mask, valid_latent_size):
+            mask[:t, :h, :w] = 1
 
+        if self.text_pad_multiple is not None:
+            input_ids, cond_mask = pad_text_to_batch_max(input_ids, cond_mask, self.text_pad_multiple)
         input_ids = torch.stack(input_ids)  # b 1 l
         cond_mask = torch.stack(cond_mask)  # b 1 l
         input_ids_2 = torch.stack(input_ids_2) if input_ids_2 is not None else input_ids_2  # b 1 l
         cond_mask_2 = torch.stack(cond_mask_2) if cond_mask_2 is not None else cond_mask_2  # b 1 l
 
-        return (pad_batch_tubes, attention_mask, input_ids, cond_mask, input_ids_2, cond_mask_2)
+        return (pad_batch_tubes, attention_mask, input_ids, cond_mask, input_ids_2, cond_mask_2, resize_info)
 
 DATA_COLLATOR = {
     "Default": Collate,
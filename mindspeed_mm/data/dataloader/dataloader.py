@@ -28,6 +28,7 @@ from mindspeed_mm.data.dataloader.sampler import (
     StatefulDistributedSampler,
     VariableVideoBatchSampler,
     BaseRandomBatchSampler,
+    TokenBudgetBatchSampler,
 )
 from mindspeed_mm.data.dataloader.collator import DATA_COLLATOR
 
@@ -97,6 +98,8 @@ def prepare_sampler_dataloader(
     gradient_accumulation_size=1,
     initial_global_step_for_sampler=0,
     collate_param=None,
+    token_budget=None,
+    max_batch_size=None,
     **kwargs,
 ):
     """
@@ -106,13 +109,16 @@ def prepare_sampler_dataloader(
     Args:
         dataset (`torch.utils.data.Dataset`): The dataset to be loaded.
         shuffle (bool, optional): Whether to shuffle the dataset. Defaults to False.
-        seed (int, optional): Random worker seed for sampling, defaults to 1024.
+        seed (int, optional): Random worker seed for sampling, defaults to 1024. It also seeds the order of the
+            LengthGroupedSampler, which used a fixed seed 42 before.
         add_sampler: Whether to add ``DistributedDataParallelSampler`` to the dataset. Defaults to True.
         drop_last (bool, optional): Set to True to drop the last incomplete batch, if the dataset size
             is not divisible by the batch size. If False and the size of dataset is not divisible by
             the batch size, then the last batch will be smaller, defaults to False.
         pin_memory (bool, optional): Whether to pin memory address in CPU memory. Defaults to False.
         num_workers (int, optional): Number of worker threads for this dataloader. Defaults to 0.
+        token_budget (int, optional): The latent tokens per micro-batch of the TokenBudgetBatchSampler.
+        max_batch_size (int, optional): The maximum samples per micro-batch of the TokenBudgetBatchSampler.
         kwargs (dict): optional parameters for ``torch.utils.data.DataLoader``
 
     Returns:
@@ -130,6 +136,8 @@ def prepare_sampler_dataloader(
                 initial_global_step=initial_global_step_for_sampler,
                 lengths=dataset.lengths,
                 group_data=group_data,
+                seed=seed,
+                shape_idx_dict=getattr(dataset, "shape_idx_dict", None),
             )
         else:
             sampler = StatefulDistributedSampler(
@@ -177,6 +185,43 @@ def prepare_sampler_dataloader(
         else:
             collate_fn = DATA_COLLATOR[data_collate_type](**collate_param)
 
+        return DataLoader(
+            dataset,
+            pin_memory=pin_memory,
+            collate_fn=collate_fn,
+            worker_init_fn=get_seed_worker(seed),
+            num_workers=num_workers,
+            batch_sampler=batch_sampler,
+        )
+    elif sampler_type == "TokenBudgetBatchSampler":
+        if token_budget is None:
+            raise ValueError("token_budget must be provided for the TokenBudgetBatchSampler.")
+        if collate_param is None:
+            raise ValueError("collate_param must be provided.")
+        batch_sampler = TokenBudgetBatchSampler(
+            lengths=dataset.lengths,
+            token_budget=token_budget,
+            num_replicas=process_group.size(),
+            rank=process_group.rank(),
+            ae_stride_t=collate_param.get("ae_stride_t", 4),
+            ae_stride=collate_param.get("ae_stride", 8),
+            patch_size_t=collate_param.get("patch_size_t", 1),
+            patch_size=collate_param.get("patch_size", 2),
+            max_batch_size=max_batch_size,
+            seed=seed,
+            drop_last=drop_last,
+            gradient_accumulation_size=gradient_accumulation_size,
+            initial_global_step=initial_global_step_for_sampler,
+        )
+
+        # the micro-batches have a single shape and a variable size
+        collate_param.update(batch_size=None, group_data=True)
+        data_collate_type = collate_param.pop("model_name", None)
+        if data_collate_type is None:
+            collate_fn = DATA_COLLATOR['Default'](**collate_param)
+        else:
+            collate_fn = DATA_COLLATOR[data_collate_type](**collate_param)
+
         return DataLoader(
             dataset,
             pin_memory=pin_memory,
@@ -302,7 +347,7 @@ def prepare_variable_dataloader(
         num_workers=0,
         process_group: Optional[ProcessGroup] = None,
         bucket_config=None,
-        num_bucket_build_workers=1,
+        num_bucket_build_workers=None,
         sampler_type="variable_video_batch_sampler",
         **kwargs,
     ):
@@ -1,11 +1,11 @@
 from typing import Iterator, List, Optional
 import math
 import logging
-import random
+import warnings
 from collections import Counter, OrderedDict, defaultdict
 from pprint import pformat
-from pandarallel import pandarallel
 
+import numpy as np
 import torch
 import torch.distributed as dist
 from torch.nn import functional as F
@@ -20,123 +20,78 @@ from mindspeed_mm.data.data_utils.utils import format_numel_str
 
 
 
-def split_to_even_chunks(megabatch, lengths, world_size, batch_size):
-    """
-    Split a list of indices into `chunks` chunks of roughly equal lengths.
-    """
-    # batch_size=2, world_size=2
-    # [1, 2, 3, 4] -> [[1, 2], [3, 4]]
-    # [1, 2, 3] -> [[1, 2], [3]]
-    # [1, 2] -> [[1], [2]]
-    # [1] -> [[1], []]
-    chunks = [megabatch[i::world_size] for i in range(world_size)]
-
-    pad_chunks = []
-    for idx, chunk in enumerate(chunks):
-        if batch_size != len(chunk):  
-            if batch_size <= len(chunk):
-                raise AssertionError("batch_size must greater than len_chunk !")
-            if len(chunk) != 0:  # [[1, 2], [3]] -> [[1, 2], [3, 3]]
-                chunk = chunk + [random.choice(chunk) for _ in range(batch_size - len(chunk))]
-            else:
-                chunk = random.choice(pad_chunks)  # [[1], []] -> [[1], [1]]
-                print(chunks[idx], '->', chunk)
-        pad_chunks.append(chunk)
-    return pad_chunks
-
-
-def last_group_frame_fun(shuffled_megabatches, lengths):
-    re_shuffled_megabatches = []
-    for i_megabatch, megabatch in enumerate(shuffled_megabatches):
-        re_megabatch = []
-        for i_batch, batch in enumerate(megabatch):
-            if len(batch) == 0:
-                raise AssertionError("The length of batch is zero")
-            len_each_batch = [lengths[i] for i in batch]
-            idx_length_dict = dict([*zip(batch, len_each_batch)])
-            count_dict = Counter(len_each_batch)
-            if len(count_dict) != 1:
-                sorted_by_value = sorted(count_dict.items(), key=lambda item: item[1])
-                pick_length = sorted_by_value[-1][0]  # the highest frequency
-                candidate_batch = [
-                    idx
-                    for idx, length in idx_length_dict.items()
-                    if length == pick_length
-                ]
-                random_select_batch = [
-                    random.choice(candidate_batch)
-                    for i in range(len(len_each_batch) - len(candidate_batch))
-                ]
-                batch = candidate_batch + random_select_batch
-            re_megabatch.append(batch)
-        re_shuffled_megabatches.append(re_megabatch)
-    return re_shuffled_megabatches
-
-
-def group_data_fun(lengths, generator=None):
-    # counter is decrease order
-    counter = Counter(lengths)  # counter {'1x256x256': 3, ''}   lengths ['1x256x256', '1x256x256', '1x256x256', ...]
-    grouped_indices = defaultdict(list)
-    for idx, item in enumerate(lengths):  # group idx to a list
-        grouped_indices[item].append(idx)
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
 
-    grouped_indices = dict(grouped_indices)  # {'1x256x256': [0, 1, 2], ...}
-    sorted_indices = [grouped_indices[item] for (item, _) in sorted(counter.items(), key=lambda x: x[1], reverse=True)]
-    
-    # shuffle in each group
-    shuffle_sorted_indices = []
-    for indice in sorted_indices:
-        shuffle_idx = torch.randperm(len(indice), generator=generator).tolist()
-        shuffle_sorted_indices.extend([indice[idx] for idx in shuffle_idx])
-    return shuffle_sorted_indices
-
-
-def get_length_grouped_data_indices(
-        lengths, 
-        batch_size, 
-        world_size, 
-        gradient_accumulation_size, 
-        initial_global_step, 
-        generator=None, 
-        group_data=False, 
-        seed=42
-    ):
-    # We need to use torch for the random part as a distributed sampler will set the random seed for torch.
-    if generator is None:
-        generator = torch.Generator().manual_seed(seed)
 
-    if group_data:
-        indices = group_data_fun(lengths, generator)
-    else:
-        indices = torch.randperm(len(lengths), generator=generator).tolist()
-    
-    megabatch_size = world_size * batch_size
-    megabatches = [indices[i: i + megabatch_size] for i in range(0, len(lengths), megabatch_size)]
+def hash_seed(*keys):
+    """Combine integer keys, e.g. (seed, epoch, stream), into one 64 bits seed."""
+    value = 0
+    for key in keys:
+        value = splitmix64(value ^ (key & MASK64))
+    return value
 
-    megabatches = [split_to_even_chunks(megabatch, lengths, world_size, batch_size) for megabatch in megabatches]
 
-    indices_mega = torch.randperm(len(megabatches), generator=generator).tolist()
+class FeistelPermutation:
+    """
+    A seed-deterministic permutation of range(n) evaluated one position at a time, in O(1) memory.
+
+    A balanced Feistel network is a bijection of [0, 2**bits), positions are mapped into range(n) by cycle
+    walking, which takes less than 4 rounds of the network on average.
+    """
+
+    def __init__(self, n, seed, num_rounds=4):
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.round_keys = [hash_seed(seed, i) for i in range(num_rounds)]
 
-    shuffled_megabatches = [megabatches[i] for i in indices_mega]
+    def __len__(self):
+        return self.n
 
-    if group_data:
-        shuffled_megabatches = last_group_frame_fun(shuffled_megabatches, lengths)
-    
-    initial_global_step = initial_global_step * gradient_accumulation_size
-    shuffled_megabatches = shuffled_megabatches[initial_global_step:]
+    def encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.round_keys:
+            left, right = right, left ^ (splitmix64(right ^ key) & self.half_mask)
+        return (left << self.half_bits) | right
 
-    out_list = []
-    for megabatch in shuffled_megabatches:
-        for batch in megabatch:
-            for i in batch:
-                out_list.append(i)
-    return out_list
+    def __getitem__(self, position):
+        if not 0 <= position < self.n:
+            raise IndexError(f"position {position} is out of range({self.n}).")
+        value = self.encrypt(position)
+        while value >= self.n:
+            value = self.encrypt(value)
+        return value
 
 
 class LengthGroupedSampler(DistributedSampler):
     r"""
     Sampler that samples indices in a way that groups together features of the dataset of roughly the same length while
     keeping a bit of randomness.
+
+    The global order is a lazy permutation of the samples (of the samples of every shape, the shapes being
+    laid out by decreasing frequency, if group_data), cut into megabatches of world_size * batch_size
+    positions that are visited in a permuted order. Rank r takes the positions [r * batch_size, (r + 1) *
+    batch_size) of every megabatch. Every rank only evaluates its own positions, and resuming from any
+    global step costs O(1), no index list is materialised. The order only depends on the seed, the epoch
+    and world_size * batch_size, so the union of the ranks' batches of a step is the same for any split
+    of the global batch. The last megabatch is completed with the first positions of the epoch.
+
+    With group_data, every shape group is padded to a multiple of batch_size with samples of the same
+    shape, so every batch of a rank has a single shape and the collator never has to re-pick samples.
+    The padded and repeated samples of an epoch are counted in self.stats, which are logged by log_data_stats
+    with the training log.
+
+    The epoch advances when an iteration over the sampler completes, so every epoch is drawn in a new order
+    without calling set_epoch. The order is seeded by the seed of the dataloader_param (1024 by default),
+    it was a fixed 42 before, set "seed": 42 to keep the former order.
     """
 
     def __init__(
@@ -150,8 +105,10 @@ class LengthGroupedSampler(DistributedSampler):
         lengths: Optional[List[int]] = None,
         group_data=False,
         generator=None,
+        seed: int = 42,
+        shape_idx_dict: Optional[dict] = None,
     ):
-        super().__init__(dataset=lengths, num_replicas=num_replicas, rank=rank)
+        super().__init__(dataset=lengths, num_replicas=num_replicas, rank=rank, seed=seed)
 
         if lengths is None:
             raise ValueError("Lengths must be provided.")
@@ -163,28 +120,240 @@ class LengthGroupedSampler(DistributedSampler):
         self.gradient_accumulation_size = gradient_accumulation_size
         self.lengths = lengths
         self.group_data = group_data
-        self.generator = generator
+        if generator is not None:
+            # the order is drawn from the generator seed, it is not advanced
+            self.seed = generator.initial_seed()
+        self.megabatch_size = world_size * batch_size
+
+        if group_data:
+            # the samples sorted by shape, the shapes by decreasing frequency, as int32/int64 instead of lists
+            if shape_idx_dict is None:
+                shape_idx_dict = defaultdict(list)
+                for idx, item in enumerate(lengths):
+                    shape_idx_dict[item].append(idx)
+            groups = sorted(shape_idx_dict.values(), key=len, reverse=True)
+            dtype = np.int32 if len(lengths) < 2 ** 31 else np.int64
+            self.grouped_indices = np.concatenate([np.asarray(group, dtype=dtype) for group in groups])
+            self.group_sizes = np.array([len(group) for group in groups], dtype=np.int64)
+            self.group_offsets = np.concatenate([[0], np.cumsum(self.group_sizes)])
+            # every group is padded to whole batches
+            padded_sizes = (self.group_sizes + batch_size - 1) // batch_size * batch_size
+            self.padded_offsets = np.concatenate([[0], np.cumsum(padded_sizes)])
+            self.num_positions = int(self.padded_offsets[-1])
+        else:
+            self.num_positions = len(lengths)
+        self.num_megabatches = math.ceil(self.num_positions / self.megabatch_size)
+        # the same batches are planned in every epoch, the counts are for all the ranks
+        self.stats = Counter(
+            padded_samples=self.num_positions - len(lengths),
+            repeated_samples=self.num_megabatches * self.megabatch_size - self.num_positions,
+        )
 
-        print('self.lengths, self.initial_global_step, self.batch_size, self.world_size, self.gradient_accumulation_size', 
-            len(self.lengths), self.initial_global_step, self.batch_size, self.world_size, self.gradient_accumulation_size)
+        logging.info(
+            "LengthGroupedSampler: %d samples, initial_global_step %d, batch_size %d, world_size %d, "
+            "gradient_accumulation_size %d", len(self.lengths), self.initial_global_step, self.batch_size,
+            self.world_size, self.gradient_accumulation_size,
+        )
 
     def __len__(self):
+        initial_micro_batch = self.initial_global_step * self.gradient_accumulation_size
+        return max(self.num_megabatches - initial_micro_batch, 0) * self.batch_size
+
+    def get_permutations(self):
+        megabatch_perm = FeistelPermutation(self.num_megabatches, hash_seed(self.seed, self.epoch, 0))
         if self.group_data:
-            return len(self.lengths) - self.initial_global_step * self.batch_size * self.world_size * self.gradient_accumulation_size
-        return len(self.lengths)
+            sample_perms = [
+                FeistelPermutation(int(size), hash_seed(self.seed, self.epoch, g + 1))
+                for g, size in enumerate(self.group_sizes)
+            ]
+        else:
+            sample_perms = [FeistelPermutation(len(self.lengths), hash_seed(self.seed, self.epoch, 1))]
+        return megabatch_perm, sample_perms
+
+    def get_index(self, position, sample_perms):
+        position = position % self.num_positions
+        if not self.group_data:
+            return sample_perms[0][position]
+        group = int(np.searchsorted(self.padded_offsets, position, side="right")) - 1
+        # the padding positions of a group repeat its first samples
+        local = (position - int(self.padded_offsets[group])) % int(self.group_sizes[group])
+        return int(self.grouped_indices[int(self.group_offsets[group]) + sample_perms[group][local]])
+
+    def get_batch(self, step, rank=None, permutations=None):
+        """The indices of the micro-batch of a rank at a global micro-batch step of the epoch."""
+        rank = self.rank if rank is None else rank
+        megabatch_perm, sample_perms = self.get_permutations() if permutations is None else permutations
+        start = megabatch_perm[step] * self.megabatch_size + rank * self.batch_size
+        return [self.get_index(position, sample_perms) for position in range(start, start + self.batch_size)]
 
     def __iter__(self):
-        indices = get_length_grouped_data_indices(
+        permutations = self.get_permutations()
+        initial_micro_batch = self.initial_global_step * self.gradient_accumulation_size
+        # only the first epoch is resumed
+        self.initial_global_step = 0
+        for step in range(initial_micro_batch, self.num_megabatches):
+            yield from self.get_batch(step, permutations=permutations)
+        self.epoch += 1
+
+
+def get_latent_tokens(shape, ae_stride_t=4, ae_stride=8, patch_size_t=1, patch_size=2):
+    """The number of latent patches of a "TxHxW" sample, as the Collate pads and the predictor patchifies it."""
+    t, h, w = (int(x) for x in shape.split("x"))
+    latent_t = (t - 1) // ae_stride_t + 1
+    return (
+        math.ceil(latent_t / patch_size_t)
+        * math.ceil(h / (ae_stride * patch_size))
+        * math.ceil(w / (ae_stride * patch_size))
+    )
+
+
+def pack_token_budget_batches(
+        lengths,
+        token_budget,
+        world_size,
+        token_fn,
+        max_batch_size=None,
+        generator=None,
+        drop_last=False,
+    ):
+    """
+    Pack the samples of every shape into micro-batches of at most token_budget latent tokens, and group the
+    micro-batches into steps of world_size micro-batches with near-equal token counts.
+
+    Returns:
+        steps(list): every step is a list of world_size micro-batches, one per data parallel rank
+        step_tokens(list): the token count of every micro-batch of every step
+    """
+    grouped_indices = defaultdict(list)
+    for idx, item in enumerate(lengths):
+        grouped_indices[item].append(idx)
+
+    micro_batches, micro_batch_tokens = [], []
+    for shape in sorted(grouped_indices.keys()):
+        indices = grouped_indices[shape]
+        indices = [indices[i] for i in torch.randperm(len(indices), generator=generator).tolist()]
+        tokens = token_fn(shape)
+        num_samples = max(1, token_budget // tokens)
+        if max_batch_size is not None:
+            num_samples = min(num_samples, max_batch_size)
+        for i in range(0, len(indices), num_samples):
+            micro_batches.append(indices[i: i + num_samples])
+            micro_batch_tokens.append(len(micro_batches[-1]) * tokens)
+
+    # neighbours in the token order go to the ranks of the same step, so every rank does similar work
+    order = sorted(range(len(micro_batches)), key=lambda i: micro_batch_tokens[i], reverse=True)
+    remainder = len(order) % world_size
+    if remainder > 0:
+        if drop_last:
+            order = order[:len(order) - remainder]
+        else:
+            # repeat the smallest micro-batches, cyclically if there are fewer than world_size of them
+            order += [order[-1 - i % len(order)] for i in range(world_size - remainder)]
+    steps, step_tokens = [], []
+    for i in range(0, len(order), world_size):
+        steps.append([micro_batches[j] for j in order[i: i + world_size]])
+        step_tokens.append([micro_batch_tokens[j] for j in order[i: i + world_size]])
+
+    step_order = torch.randperm(len(steps), generator=generator).tolist()
+    return [steps[i] for i in step_order], [step_tokens[i] for i in step_order]
+
+
+class TokenBudgetBatchSampler(Sampler):
+    r"""
+    Batch sampler that fills every micro-batch with samples of one shape up to a latent token budget, instead of
+    a fixed batch size, so an image micro-batch and a long video micro-batch cost about the same time and memory.
+    The micro-batches of a step are balanced across the data parallel ranks. It is used as the batch_sampler of
+    the dataloader, the Collate must be built with batch_size=None.
+
+    A sample whose shape alone exceeds token_budget still forms a one-sample micro-batch over the budget, these
+    shapes are logged when the sampler is built. Megatron assumes a fixed micro batch size: consumed_samples is
+    advanced by micro_batch_size per micro-batch and is only an estimate of the samples actually seen, e.g. when
+    resuming, and the loss is averaged per micro-batch before the micro-batches are averaged, so a sample of a
+    small micro-batch weighs more in the gradient than a sample of a large one.
+
+    Args:
+        lengths(list): the "TxHxW" shape of every sample
+        token_budget(int): the latent tokens per micro-batch, computed with the ae strides and patch sizes
+        max_batch_size(int): the maximum samples per micro-batch, e.g. for the images, None for no limit
+    """
+
+    def __init__(
+        self,
+        lengths: List[str],
+        token_budget: int,
+        num_replicas: int = 1,
+        rank: int = 0,
+        ae_stride_t: int = 4,
+        ae_stride: int = 8,
+        patch_size_t: int = 1,
+        patch_size: int = 2,
+        max_batch_size: Optional[int] = None,
+        seed: int = 42,
+        drop_last: bool = False,
+        gradient_accumulation_size: int = 1,
+        initial_global_step: int = 0,
+    ):
+        if lengths is None:
+            raise ValueError("Lengths must be provided.")
+        self.lengths = lengths
+        self.token_budget = token_budget
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.max_batch_size = max_batch_size
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.initial_micro_batch = initial_global_step * gradient_accumulation_size
+        shape_tokens = {
+            shape: get_latent_tokens(shape, ae_stride_t, ae_stride, patch_size_t, patch_size)
+            for shape in set(lengths)
+        }
+        self.token_fn = shape_tokens.__getitem__
+        over_budget = {shape: tokens for shape, tokens in shape_tokens.items() if tokens > token_budget}
+        if over_budget and rank == 0:
+            logging.warning(
+                "TokenBudgetBatchSampler: %d shapes exceed the token budget %d and form one-sample micro-batches "
+                "over it, raise token_budget or filter these samples: %s",
+                len(over_budget), token_budget,
+                ", ".join(f"{shape} ({tokens} tokens)" for shape, tokens in sorted(over_budget.items())),
+            )
+        num_micro_batches = 0
+        for shape, count in Counter(lengths).items():
+            num_samples = max(1, token_budget // shape_tokens[shape])
+            if max_batch_size is not None:
+                num_samples = min(num_samples, max_batch_size)
+            num_micro_batches += math.ceil(count / num_samples)
+        if drop_last:
+            self.num_steps = num_micro_batches // num_replicas
+        else:
+            self.num_steps = math.ceil(num_micro_batches / num_replicas)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def get_steps(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        return pack_token_budget_batches(
             self.lengths,
-            self.batch_size,
-            self.world_size,
-            self.gradient_accumulation_size,
-            self.initial_global_step,
-            group_data=self.group_data,
-            generator=self.generator,
+            self.token_budget,
+            self.num_replicas,
+            self.token_fn,
+            max_batch_size=self.max_batch_size,
+            generator=generator,
+            drop_last=self.drop_last,
         )
-        indices = indices[self.rank:self.total_size:self.num_replicas]
-        return iter(indices)
+
+    def __len__(self):
+        return self.num_steps - self.initial_micro_batch
+
+    def __iter__(self):
+        steps, _ = self.get_steps()
+        start, self.initial_micro_batch = self.initial_micro_batch, 0
+        for step in steps[start:]:
+            yield step[self.rank]
+        # a new order in every epoch, as in the LengthGroupedSampler
+        self.epoch += 1
+
 
 class StatefulDistributedSampler(DistributedSampler):
     def __init__(
@@ -305,18 +474,6 @@ class BaseRandomBatchSampler(DistributedSampler):
                 batch = []
 
 
-# use pandarallel to accelerate bucket processing
-# NOTE: pandarallel should only access local variables
-def apply(data, method=None, frame_interval=None, seed=None, num_bucket=None):
-    return method(
-        data["num_frames"],
-        data["height"],
-        data["width"],
-        frame_interval,
-        seed + data["id"] * num_bucket,
-    )
-
-
 class VariableVideoBatchSampler(DistributedSampler):
     def __init__(
         self,
@@ -328,7 +485,7 @@ class VariableVideoBatchSampler(DistributedSampler):
         seed: int = 0,
         drop_last: bool = False,
         verbose: bool = False,
-        num_bucket_build_workers: int = 1,
+        num_bucket_build_workers: Optional[int] = None,
     ) -> None:
         super().__init__(
             dataset=dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed, drop_last=drop_last
@@ -342,7 +499,12 @@ class VariableVideoBatchSampler(DistributedSampler):
         self.approximate_num_batch = None
 
         self._get_num_batch_cached_bucket_sample_dict = None
-        self.num_bucket_build_workers = num_bucket_build_workers
+        if num_bucket_build_workers is not None:
+            warnings.warn(
+                "num_bucket_build_workers is deprecated and ignored, the buckets are assigned by "
+                "Bucket.get_bucket_ids in a single vectorised pass.",
+                FutureWarning,
+            )
 
     def __iter__(self) -> Iterator[List[int]]:
         if self._get_num_batch_cached_bucket_sample_dict is not None:
@@ -454,26 +616,28 @@ class VariableVideoBatchSampler(DistributedSampler):
     def group_by_bucket(self) -> dict:
         bucket_sample_dict = OrderedDict()
 
-        pandarallel.initialize(nb_workers=self.num_bucket_build_workers, progress_bar=False)
         logging.info("Building buckets...")
-        bucket_ids = self.dataset.data_samples.parallel_apply(
-            apply,
-            axis=1,
-            method=self.bucket.get_bucket_id,
+        data_samples = self.dataset.data_samples
+        bucket_keys, bucket_index = self.bucket.get_bucket_ids(
+            data_samples["num_frames"].to_numpy(),
+            data_samples["height"].to_numpy(),
+            data_samples["width"].to_numpy(),
+            data_samples["id"].to_numpy(),
             frame_interval=self.dataset.frame_interval,
             seed=self.seed + self.epoch,
-            num_bucket=self.bucket.num_bucket,
         )
 
         # group by bucket
         # each data sample is put into a bucket with a similar image/video size
-        for i in range(len(self.dataset)):
-            bucket_id = bucket_ids[i]
-            if bucket_id is None:
-                continue
-            if bucket_id not in bucket_sample_dict:
-                bucket_sample_dict[bucket_id] = []
-            bucket_sample_dict[bucket_id].append(i)
+        # buckets are ordered by their first sample, samples by their index
+        indices = np.nonzero(bucket_index >= 0)[0]
+        order = np.argsort(bucket_index[indices], kind="stable")
+        sorted_index = bucket_index[indices][order]
+        split_points = np.nonzero(np.diff(sorted_index))[0] + 1
+        groups = [group for group in np.split(indices[order], split_points) if len(group) > 0]
+        groups.sort(key=lambda group: group[0])
+        for group in groups:
+            bucket_sample_dict[bucket_keys[bucket_index[group[0]]]] = group.tolist()
         return bucket_sample_dict
 
     def get_num_batch(self) -> int:
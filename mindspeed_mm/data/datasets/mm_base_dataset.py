@@ -14,8 +14,10 @@ class MMBaseDataset(Dataset):
     A base mutilmodal dataset,  it's to privide basic parameters and method
 
     Args: some basic parameters from dataset_param_dict in config.
-        data_path(str):  csv/json/parquat file path
+        data_path(str):  csv/json/parquet file path
         data_folder(str): the root path of multimodal data
+        anno_num_workers(int): the threads reading the annotation files of the combine mode
+        read_data_samples(bool): read the data files, False if the samples are built by another rank
     """
 
     def __init__(
@@ -24,13 +26,15 @@ class MMBaseDataset(Dataset):
         data_folder: str = "",
         return_type: str = "list",
         data_storage_mode: str = "standard",
+        anno_num_workers: int = 8,
+        read_data_samples: bool = True,
         **kwargs,
     ):
         self.data_path = data_path
         self.data_folder = data_folder
         self.data_storage_mode = data_storage_mode
-        self.get_data = DataFileReader(data_storage_mode=data_storage_mode)
-        self.data_samples = self.get_data(self.data_path, return_type=return_type)
+        self.get_data = DataFileReader(data_storage_mode=data_storage_mode, num_workers=anno_num_workers)
+        self.data_samples = self.get_data(self.data_path, return_type=return_type) if read_data_samples else None
 
     def __len__(self):
         return len(self.data_samples)
@@ -4,7 +4,6 @@
 import os
 import random
 from typing import Union
-from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import numpy as np
@@ -18,6 +17,7 @@ from mindspeed_mm.data.data_utils.constants import (
     PROMPT_IDS_2,
     TEXT,
     VIDEO,
+    VIDEO_RESIZE,
     IMG_FPS
 )
 from mindspeed_mm.data.data_utils.utils import (
@@ -27,12 +27,24 @@ from mindspeed_mm.data.data_utils.utils import (
     VideoProcesser,
     VideoReader
 )
+from mindspeed_mm.data.data_utils.feature_store import (
+    FeatureStore,
+    LATENT_MOMENTS,
+    NULL_TEXT_KEY,
+    PROMPT_FEATURES,
+    PROMPT_FEATURES_2
+)
+from mindspeed_mm.data.data_utils.sample_table import SampleTable
+from mindspeed_mm.data.data_utils.sample_fetcher import SampleFetcher
+from mindspeed_mm.data.data_utils.token_store import TokenStore
+from mindspeed_mm.data.data_utils.transform_pipeline import get_cached_transforms, get_deferred_resize
 from mindspeed_mm.data.datasets.mm_base_dataset import MMBaseDataset
 from mindspeed_mm.models import Tokenizer
 from mindspeed_mm.data.data_utils.data_transform import (
     MaskGenerator,
     add_aesthetic_notice_image,
-    add_aesthetic_notice_video
+    add_aesthetic_notice_video,
+    get_aesthetic_notice_variants
 )
 
 
@@ -42,6 +54,7 @@ T2VOutputData = {
     PROMPT_MASK: [],
     PROMPT_IDS_2: [],
     PROMPT_MASK_2: [],
+    VIDEO_RESIZE: None,
 }
 
 
@@ -55,6 +68,16 @@ class T2VDataset(MMBaseDataset):
         use_text_processer(bool): whether text preprocessing
         tokenizer_config(dict): the config of tokenizer
         use_feature_data(bool): use vae feature instead of raw video data or use text feature instead of raw text.
+        feature_store_path(str): the directory written by extract_features_sora.py, used with use_feature_data, the
+            stored clips are center-cropped in time and lose the random augmentations of the raw data
+        token_store_path(str): the directory written by tokenize_captions_sora.py, the captions are not cleaned
+            and tokenised per sample if it is set
+        vid_img_process.sample_table_dir(str): the directory the filtered samples of the combine mode are saved to
+            and memory-mapped from
+        vid_img_process.sample_table_scope(str): "rank" builds the samples on every rank, "node" on the local rank 0
+            of every node and "global" on rank 0 only, the other ranks load the table built for them
+        vid_img_process.temporal_crop(str): where the clips longer than num_frames are cropped, "random" (default)
+            or "center", the features of extract_features_sora.py use the center crop
         vid_img_fusion_by_splicing(bool):  videos and images are fused by splicing
         use_img_num(int): the number of fused images
         use_img_from_vid(bool): sampling some images from video
@@ -72,13 +95,25 @@ class T2VDataset(MMBaseDataset):
         tokenizer_config: Union[dict, None] = None,
         tokenizer_config_2: Union[dict, None] = None,
         use_feature_data: bool = False,
+        feature_store_path: Union[str, None] = None,
+        token_store_path: Union[str, None] = None,
         use_img_from_vid: bool = True,
         **kwargs,
     ):
-        super().__init__(**basic_param)
+        self.sample_table_dir, self.is_sample_table_builder = None, True
+        if basic_param.get("data_storage_mode", "standard") == "combine":
+            self.sample_table_dir, self.is_sample_table_builder = self.get_sample_table_dir(
+                vid_img_process.get("sample_table_dir", None), vid_img_process.get("sample_table_scope", "rank")
+            )
+        # only the builder of the sample table reads the annotation files
+        super().__init__(**basic_param, read_data_samples=self.is_sample_table_builder)
         self.use_text_processer = use_text_processer
         self.enable_text_preprocessing = enable_text_preprocessing
         self.use_feature_data = use_feature_data
+        self.model_max_length = model_max_length
+        if self.use_feature_data:
+            self.feature_store = FeatureStore(feature_store_path)
+            self.null_text_features = None
         self.use_img_from_vid = use_img_from_vid
 
         self.num_frames = vid_img_process.get("num_frames", 16)
@@ -109,17 +144,37 @@ class T2VDataset(MMBaseDataset):
         self.min_h_div_w_ratio = vid_img_process.get("min_h_div_w_ratio", None)
         self.min_num_frames = vid_img_process.get("min_num_frames", 29)
         self.use_aesthetic = vid_img_process.get("use_aesthetic", False) 
-
-        max_workers = vid_img_process.get("max_workers", 1)
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.timeout = vid_img_process.get("timeout", 60) 
+        self.temporal_crop = vid_img_process.get("temporal_crop", "random")
+
+        self.timeout = vid_img_process.get("timeout", 60)
+        self.sample_fetcher = SampleFetcher(
+            fetch_fn=self.getitem,
+            fallback_fn=self.get_fallback_index,
+            key_fn=self.get_sample_key,
+            num_threads=vid_img_process.get("max_workers", 1),
+            timeout=self.timeout,
+            max_retries=vid_img_process.get("max_retries", 10),
+            max_failures=vid_img_process.get("max_fetch_failures", 3),
+            max_stalled_threads=vid_img_process.get("max_stalled_threads", None),
+            bad_sample_file=vid_img_process.get("bad_sample_file", None),
+        )
         
         if self.max_hxw is not None and self.min_hxw is None:
             self.min_hxw = self.max_hxw // 4
         self.train_pipeline = vid_img_process.get("train_pipeline", None)
+        # a resize with "deferred": true in the train_pipeline runs on the collated batch, the workers only crop,
+        # the image processer uses the video pipeline too
+        self.deferred_resize = get_deferred_resize(
+            get_cached_transforms(is_video=True, train_pipeline=self.train_pipeline)
+        )
         self.video_reader_type = vid_img_process.get("video_reader_type", "torchvision")
         self.image_reader_type = vid_img_process.get("image_reader_type", "torchvision")
-        self.video_reader = VideoReader(video_reader_type=self.video_reader_type)
+        self.video_reader = VideoReader(
+            video_reader_type=self.video_reader_type,
+            decoder_cache_size=vid_img_process.get("decoder_cache_size", 0),
+            num_threads=vid_img_process.get("decoder_num_threads", 1),
+            seek_to_keyframe=vid_img_process.get("seek_to_keyframe", True),
+        )
         self.video_processer = VideoProcesser(
             num_frames=self.num_frames,
             frame_interval=self.frame_interval,
@@ -144,7 +199,8 @@ class T2VDataset(MMBaseDataset):
             train_sp_batch_size=self.train_sp_batch_size,
             gradient_accumulation_size=self.gradient_accumulation_size,
             batch_size=self.batch_size,
-            min_num_frames=self.min_num_frames
+            min_num_frames=self.min_num_frames,
+            temporal_crop=self.temporal_crop
         )
         self.image_processer = ImageProcesser(
             num_frames=self.num_frames,
@@ -165,33 +221,46 @@ class T2VDataset(MMBaseDataset):
                 use_clean_caption=use_clean_caption,
                 support_chinese=support_chinese,
                 cfg=self.cfg,
+                token_store=TokenStore.load(token_store_path) if token_store_path else None,
             )
 
         if self.data_storage_mode == "combine":
-            self.data_samples, self.sample_size, self.shape_idx_dict = (
-                self.video_processer.define_frame_index(self.data_samples)
-            )
+            self.index_cache_dir = vid_img_process.get("index_cache_dir", None)
+            if self.is_sample_table_builder:
+                self.data_samples, self.sample_size, self.shape_idx_dict = (
+                    self.video_processer.define_frame_index(
+                        self.data_samples,
+                        anno_shards=getattr(self.get_data, "anno_shards", None),
+                        index_cache_dir=self.index_cache_dir,
+                    )
+                )
+            self.data_samples = self.build_sample_table(self.data_samples, self.sample_table_dir,
+                                                        self.is_sample_table_builder)
+            if not self.is_sample_table_builder:
+                self.sample_size, self.shape_idx_dict = self.data_samples.get_sample_sizes()
             self.lengths = self.sample_size
 
     def __getitem__(self, index):
-        try:
-            future = self.executor.submit(self.getitem, index)
-            data = future.result(timeout=self.timeout) 
-            return data
-        except Exception as e:
-            if len(str(e)) < 2:
-                e = f"TimeoutError, {self.timeout}s timeout occur with {self.data_samples.iloc[index]['path']}"
-            print(f"Error: {e}")
-            index_cand = self.shape_idx_dict[self.sample_size[index]]  # pick same shape
-            return self.__getitem__(random.choice(index_cand))
+        return self.sample_fetcher(index)
+
+    def get_fallback_index(self, index):
+        index_cand = self.shape_idx_dict[self.sample_size[index]]  # pick same shape
+        return int(random.choice(index_cand))
+
+    def get_sample_key(self, index):
+        if self.data_storage_mode == "combine":
+            return f"{self.data_samples.get_string('path', index)}:{self.data_samples.columns['start_frame_idx'][index]}"
+        return str(index)
 
     def __len__(self):
         return len(self.data_samples)
 
     def getitem(self, index):
-        # init output data
-        examples = T2VOutputData
-        if self.data_storage_mode == "combine":
+        # init output data, a copy so that an abandoned fetch never writes into a returned sample
+        examples = dict(T2VOutputData)
+        if self.use_feature_data:
+            examples = self.get_data_from_feature_data(examples, index)
+        elif self.data_storage_mode == "combine":
             examples = self.get_merge_data(examples, index)
         else:
             raise NotImplementedError(
@@ -199,47 +268,164 @@ class T2VDataset(MMBaseDataset):
             )
         return examples
 
-    def get_data_from_feature_data(self, sample):
-        raise NotImplementedError("Not implemented.")
+    @staticmethod
+    def get_sample_table_dir(sample_table_dir, scope="rank"):
+        """The table directory of this rank and whether this rank builds it, only rank scoped tables are built
+        by every rank."""
+        if sample_table_dir is None:
+            if scope != "rank":
+                raise ValueError(f"sample_table_scope={scope} needs a sample_table_dir.")
+            return None, True
+        if not torch.distributed.is_initialized():
+            return os.path.join(sample_table_dir, "rank_0"), True
+        rank = torch.distributed.get_rank()
+        if scope == "rank":
+            return os.path.join(sample_table_dir, f"rank_{rank}"), True
+        if scope == "node":
+            # set by torchrun, the ranks of a node are consecutive
+            local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", torch.distributed.get_world_size()))
+            return os.path.join(sample_table_dir, f"node_{rank // local_world_size}"), rank % local_world_size == 0
+        if scope == "global":
+            return os.path.join(sample_table_dir, "global"), rank == 0
+        raise ValueError(f"Unsupported sample_table_scope: {scope}, expected one of rank, node and global.")
+
+    @staticmethod
+    def build_sample_table(samples, table_dir=None, is_builder=True):
+        """
+        Convert the filtered samples to a SampleTable, memory-mapped from table_dir if it is set. A table shared by
+        several ranks is saved by its builder, the other ranks wait at a barrier and load it. The builder checks
+        the checksum of the saved table against the one of the samples, the other ranks check the dtypes and
+        shapes of the columns against the manifest of the builder and print the checksum it saved.
+        """
+        if is_builder:
+            sample_table = SampleTable.from_dataframe(samples)
+            if table_dir is None:
+                return sample_table
+            expected_checksum = sample_table.checksum()
+            sample_table.save(table_dir)
+            with open(os.path.join(table_dir, "checksum.txt"), "w") as f:
+                f.write(expected_checksum)
+        if torch.distributed.is_initialized():
+            # every rank waits so the builders of all the scopes are done, a slow build needs a long enough
+            # distributed timeout
+            torch.distributed.barrier()
+        sample_table = SampleTable.load(table_dir)
+        with open(os.path.join(table_dir, "checksum.txt"), "r") as f:
+            checksum = f.read().strip()
+        if is_builder and sample_table.checksum() != expected_checksum:
+            raise AssertionError(f"The checksum of the saved sample table {table_dir} is not the checksum "
+                                 f"{expected_checksum} of its samples.")
+        rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+        print(f"[rank {rank}] sample table {table_dir}: {len(sample_table)} samples, checksum {checksum}")
+        return sample_table
+
+    def get_feature_key(self, sample):
+        if self.get_type(sample["path"]) == "video":
+            return FeatureStore.get_key(sample["path"], sample["start_frame_idx"], sample["sample_num_frames"])
+        return FeatureStore.get_key(sample["path"])
+
+    def get_data_from_feature_data(self, examples, index):
+        sample = self.data_samples[index]
+        features = self.feature_store.load(self.get_feature_key(sample))
+        examples[VIDEO] = features[LATENT_MOMENTS]
+
+        if random.random() < self.cfg:
+            if self.null_text_features is None:
+                self.null_text_features = self.feature_store.load(NULL_TEXT_KEY)
+            features = self.null_text_features
+        choice = random.randrange(len(features[PROMPT_FEATURES]))
+        examples[PROMPT_IDS], examples[PROMPT_MASK] = self.pad_text_features(features[PROMPT_FEATURES][choice])
+        examples[PROMPT_IDS_2], examples[PROMPT_MASK_2] = None, None
+        if features.get(PROMPT_FEATURES_2, None) is not None:
+            examples[PROMPT_IDS_2] = features[PROMPT_FEATURES_2][choice]
+        return examples
 
-    def get_merge_data(self, examples, index):
-        sample = self.data_samples.iloc[index]
+    def pad_text_features(self, hidden_states):
+        # hidden states are saved without padding, restore the [1, model_max_length, D] layout of text encoder
+        valid_length = hidden_states.shape[0]
+        prompt = hidden_states.new_zeros((1, self.model_max_length, hidden_states.shape[-1]))
+        prompt[0, :valid_length] = hidden_states
+        prompt_mask = torch.zeros((1, self.model_max_length), dtype=torch.long)
+        prompt_mask[0, :valid_length] = 1
+        return prompt, prompt_mask
+
+    def get_visual_data(self, sample):
         file_path = sample["path"]
         if not os.path.exists(file_path):
             raise AssertionError(f"file {file_path} do not exist!")
         file_type = self.get_type(file_path)
         if file_type == "video":
-            predefine_frame_indice = sample["sample_frame_index"]
+            predefine_num_frames = sample["sample_num_frames"]
             start_frame_idx = sample["start_frame_idx"]
             clip_total_frames = sample["num_frames"]
             fps = sample["fps"]
             crop = sample.get("crop", [None, None, None, None])
             vframes, _, is_decord_read = self.video_reader(file_path)
-            video = self.video_processer(
-                vframes,
-                is_decord_read=is_decord_read,
-                start_frame_idx=start_frame_idx,
-                clip_total_frames=clip_total_frames,
-                predefine_frame_indice=predefine_frame_indice,
-                fps=fps,
-                crop=crop,
-            )
-            examples[VIDEO] = video
-        elif file_type == "image":
-            image = self.image_processer(file_path)
-            examples[VIDEO] = image
-
-        text = sample["cap"]
-        if not isinstance(text, list):
-            text = [text]
-        text = [random.choice(text)]
+            try:
+                video = self.video_processer(
+                    vframes,
+                    is_decord_read=is_decord_read,
+                    start_frame_idx=start_frame_idx,
+                    clip_total_frames=clip_total_frames,
+                    predefine_num_frames=predefine_num_frames,
+                    fps=fps,
+                    crop=crop,
+                )
+            finally:
+                self.video_reader.release(file_path, vframes)
+            return video
+        return self.image_processer(file_path)
+
+    def get_resize_info(self, video):
+        """The crop size and the target size of a clip for the DeferredResizeTransform, None if unused."""
+        if self.deferred_resize is None:
+            return None
+        h, w = video.shape[-2:]
+        target_h, target_w = self.deferred_resize.get_target_size(h, w)
+        return torch.tensor([h, w, target_h, target_w], dtype=torch.long)
+
+    def get_text_candidates(self, sample):
+        """Return all captions of the sample, each one with the aesthetic notice if enabled."""
+        texts = sample["cap"]
+        if not isinstance(texts, list):
+            texts = [texts]
+        return self.add_aesthetic_notice(texts, sample)
+
+    def get_text_variants(self, sample):
+        """Return every caption add_aesthetic_notice may produce for the sample, used to pre-tokenise captions."""
+        texts = sample["cap"]
+        if not isinstance(texts, list):
+            texts = [texts]
+        if self.use_aesthetic:
+            aes = sample.get('aesthetic', None) or sample.get('aes', None)
+            file_type = self.get_type(sample["path"])
+            if aes is not None and file_type in ("video", "image"):
+                return [
+                    variant for text in texts
+                    for variant in get_aesthetic_notice_variants(text, aes, is_video=file_type == "video")
+                ]
+        return texts
+
+    def add_aesthetic_notice(self, texts, sample):
         if self.use_aesthetic:
             if sample.get('aesthetic', None) is not None or sample.get('aes', None) is not None:
                 aes = sample.get('aesthetic', None) or sample.get('aes', None)
+                file_type = self.get_type(sample["path"])
                 if file_type == "video":
-                    text = [add_aesthetic_notice_video(text[0], aes)]
+                    texts = [add_aesthetic_notice_video(text, aes) for text in texts]
                 elif file_type == "image":
-                    text = [add_aesthetic_notice_image(text[0], aes)]
+                    texts = [add_aesthetic_notice_image(text, aes) for text in texts]
+        return texts
+
+    def get_merge_data(self, examples, index):
+        sample = self.data_samples[index]
+        examples[VIDEO] = self.get_visual_data(sample)
+        examples[VIDEO_RESIZE] = self.get_resize_info(examples[VIDEO])
+
+        text = sample["cap"]
+        if not isinstance(text, list):
+            text = [text]
+        text = self.add_aesthetic_notice([random.choice(text)], sample)
         prompt_ids, prompt_mask, prompt_ids_2, prompt_mask_2 = self.get_text_processer(text)# tokenizer, tokenizer_2
         examples[PROMPT_IDS], examples[PROMPT_MASK], examples[PROMPT_IDS_2], examples[PROMPT_MASK_2] = prompt_ids, prompt_mask, prompt_ids_2, prompt_mask_2
         return examples
@@ -341,8 +527,11 @@ class DynamicVideoTextDataset(MMBaseDataset):
 
             video_fps = video_fps // self.frame_interval
 
-            video = self.video_processer(vframes, num_frames=num_frames, frame_interval=self.frame_interval,
-                                         image_size=image_size)  # T C H W
+            try:
+                video = self.video_processer(vframes, num_frames=num_frames, frame_interval=self.frame_interval,
+                                             image_size=image_size)  # T C H W
+            finally:
+                self.video_reader.release(video_or_image_path, vframes)
         else:
             # loading
             image = pil_loader(video_or_image_path)
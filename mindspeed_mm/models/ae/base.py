@@ -48,6 +48,18 @@ class AEModel(nn.Module):
         x = (self.model.encode(x).sample() - self.shift.to(x.device, dtype=x.dtype)) * self.scale.to(x.device, dtype=x.dtype)
         return x
 
+    def encode_moments(self, x):
+        """
+        Return the posterior moments with shift and scale already folded in, so that
+        DiagonalGaussianDistribution(moments).sample() matches the output of encode.
+        """
+        posterior = self.model.encode(x)
+        shift = self.shift.to(x.device, dtype=posterior.mean.dtype)
+        scale = self.scale.to(x.device, dtype=posterior.mean.dtype)
+        mean = (posterior.mean - shift) * scale
+        logvar = posterior.logvar + 2 * torch.log(scale.abs())
+        return torch.cat([mean, logvar], dim=1)
+
     def decode(self, x):
         x = x / self.scale.to(x.device, dtype=x.dtype) + self.shift.to(x.device, dtype=x.dtype)
         x = self.model.decode(x)
@@ -18,6 +18,7 @@ from mindspeed_mm.models.common.communications import (
     gather_forward_split_backward
 )
 from mindspeed_mm.models.common.conv import Conv2d, CausalConv3d, WfCausalConv3d
+from mindspeed_mm.models.common.feature_cache import DenoisingFeatureCache
 from mindspeed_mm.models.common.module import MultiModalModule
 from mindspeed_mm.models.common.resnet_block import ResnetBlock2D, ResnetBlock3D
 from mindspeed_mm.models.common.updownsample import (
@@ -39,8 +40,9 @@ __all__ = [
     "MultiHeadCrossAttention", "SeqParallelMultiHeadCrossAttention", "Conv2dAttnBlock", "CausalConv3dAttnBlock",
     "WfCausalConv3dAttnBlock", "FinalLayer", "T2IFinalLayer", "set_grad_checkpoint", "auto_grad_checkpoint",
     "load_checkpoint", "all_to_all", "all_to_all_SBH", "split_forward_gather_backward", "gather_forward_split_backward",
-    "Conv2d", "CausalConv3d", "WfCausalConv3d", "MultiModalModule", "ResnetBlock2D", "ResnetBlock3D", "Upsample",
-    "Downsample", "SpatialDownsample2x", "SpatialUpsample2x", "TimeDownsample2x", "TimeUpsample2x",
+    "Conv2d", "CausalConv3d", "WfCausalConv3d", "DenoisingFeatureCache", "MultiModalModule", "ResnetBlock2D",
+    "ResnetBlock3D", "Upsample", "Downsample", "SpatialDownsample2x", "SpatialUpsample2x", "TimeDownsample2x",
+    "TimeUpsample2x",
     "TimeDownsampleRes2x", "TimeUpsampleRes2x", "Spatial2xTime2x3DDownsample", "Spatial2xTime2x3DUpsample",
     "CachedCausal3DUpsample"
 ]
\ No newline at end of file
@@ -5,6 +5,7 @@ import torch
 import torch.nn.functional as F
 import torch.nn as nn
 import torch_npu
+from torch.utils.weak import WeakTensorKeyDictionary
 from einops import rearrange, repeat
 from megatron import core
 from megatron.core import mpu, tensor_parallel
@@ -25,6 +26,31 @@ from .communications import (
     split_forward_gather_backward,
 )
 
+
+# the dense masks built while grad is enabled, by key padding mask and query length
+_dense_masks = WeakTensorKeyDictionary()
+
+
+def expand_key_padding_mask(mask, query_length):
+    """
+    Expand a key padding mask of shape (..., 1, kv_len) to the dense (..., q_len, kv_len) layout required by
+    npu_fusion_attention, masks which are already dense are returned unchanged.
+
+    The models pass the key padding masks to their attention layers, which call it right before the kernel.
+    Without grad the dense mask is freed after the call. With grad the kernel saves it for the backward, so it
+    is built once per key padding mask and shared by all the layers given the same mask tensor, it is freed
+    with the key padding mask.
+    """
+    if mask is None or mask.shape[-2] == query_length:
+        return mask
+    if not torch.is_grad_enabled():
+        return mask.expand(*mask.shape[:-2], query_length, mask.shape[-1]).contiguous()
+    dense_masks = _dense_masks.setdefault(mask, {})
+    if query_length not in dense_masks:
+        dense_masks[query_length] = mask.expand(*mask.shape[:-2], query_length, mask.shape[-1]).contiguous()
+    return dense_masks[query_length]
+
+
 class MultiHeadSparseMMAttentionSBH(nn.Module):
     """
     A multi-head attention layer for both self-atten and cross-atten, layout "SBH".
@@ -245,7 +271,7 @@ class MultiHeadSparseMMAttentionSBH(nn.Module):
             frames: The frame number of video
             height: The height of the video
             width: The width of the video
-            attention_mask: The attention mask to use.
+            attention_mask: The key padding mask of shape ((k b), 1, 1, kv_len) or the dense mask to use.
             video_rotary_emb: The rotary embeddings for the video
         """
         visual_sequence_length, batch_size, _ = hidden_states.shape
@@ -328,7 +354,7 @@ class MultiHeadSparseMMAttentionSBH(nn.Module):
             k,
             v,
             head_num=self.num_attention_heads_per_partition_per_cp,
-            atten_mask=attention_mask,
+            atten_mask=expand_key_padding_mask(attention_mask, q.shape[0]),
             input_layout="SBH",
             scale=1 / math.sqrt(self.head_dim)
         )[0]
@@ -423,7 +449,7 @@ class MultiHeadAttentionBSH(nn.Module):
         Args:
             query: The hidden states of the query.
             key: The hidden states of the key.
-            mask: The attention mask to use.
+            mask: The attention mask to use, or the key padding mask of shape (b, 1, 1, kv_len).
             **kwargs: Additional keyword arguments to pass along
         """
         input_ndim = query.ndim
@@ -434,7 +460,7 @@ class MultiHeadAttentionBSH(nn.Module):
         key = query if key is None else key
         b, _, _ = query.shape
 
-        if mask is not None:
+        if mask is not None and mask.ndim != 4:
             mask = mask.view(b, 1, -1, mask.shape[-1])
 
         q = self.proj_q(query)
@@ -462,7 +488,7 @@ class MultiHeadAttentionBSH(nn.Module):
             k,
             v,
             head_num=self.num_heads,
-            atten_mask=mask,
+            atten_mask=expand_key_padding_mask(mask, q.shape[1]),
             input_layout="BSH",
             scale=1 / math.sqrt(self.head_dim)
         )[0]
@@ -534,7 +560,7 @@ class ParallelMultiHeadAttentionSBH(nn.Module):
         Args:
             query: The hidden states of the query.
             key: The hidden states of the key.
-            mask: The attention mask to use.
+            mask: The attention mask to use, or the key padding mask of shape (b, 1, 1, kv_len).
             frames: The frame number of latents
             height: The height of the frame
             width: The width of the frame
@@ -547,7 +573,7 @@ class ParallelMultiHeadAttentionSBH(nn.Module):
         key = query if key is None else key
         s, b, _ = query.shape
 
-        if mask is not None:
+        if mask is not None and mask.ndim != 4:
             mask = mask.view(b, 1, -1, mask.shape[-1])
 
         q = self.proj_q(query)
@@ -590,7 +616,7 @@ class ParallelMultiHeadAttentionSBH(nn.Module):
             k,
             v,
             head_num=self.num_heads // sp_size,
-            atten_mask=mask,
+            atten_mask=expand_key_padding_mask(mask, q.shape[0]),
             input_layout="SBH",
             scale=1 / math.sqrt(self.head_dim)
         )[0]
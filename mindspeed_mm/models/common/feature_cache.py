@@ -0,0 +1,84 @@
+from collections import Counter
+
+
+class DenoisingFeatureCache:
+    """
+    Reuse the outputs of the stages of a diffusion model across the denoising steps of a sampling run, for inference.
+
+    The change of the timestep embedding between two model calls, the mean absolute difference relative to the mean
+    absolute value of the previous embedding, is accumulated for every stage since the stage was last computed. A stage
+    is skipped while its accumulated change is under its threshold: its outputs are its inputs plus the residuals
+    (outputs - inputs) of the last step where it was computed. The decision only depends on the timestep embedding,
+    so all the ranks of a model parallel group make the same decision.
+
+    Args:
+        thresholds(dict): stage name -> the accumulated change under which the stage is skipped, the stages that
+            are not in thresholds are always computed
+        warmup_steps(int): the first model calls of a sampling run, always computed
+        max_reuse_steps(int): the consecutive steps a stage can be skipped, unlimited if None
+    """
+
+    def __init__(self, thresholds, warmup_steps=1, max_reuse_steps=None):
+        self.thresholds = dict(thresholds)
+        self.warmup_steps = warmup_steps
+        self.max_reuse_steps = max_reuse_steps
+        self.stats = Counter()
+        self.reset()
+
+    def reset(self):
+        """Start a sampling run, the residuals of the previous run are dropped."""
+        self.residuals = {}
+        self.accumulated_change = {}
+        self.reuse_steps = {}
+        self.prev_embedding = None
+        self.shape = None
+        self.num_steps = 0
+
+    def step(self, embedded_timestep, shape=None):
+        """Called once per model call with the timestep embedding, and the shape of the inputs to reset on a new one."""
+        if shape is not None and shape != self.shape:
+            self.reset()
+            self.shape = shape
+        if self.prev_embedding is not None:
+            prev_embedding = self.prev_embedding.float()
+            change = ((embedded_timestep.float() - prev_embedding).abs().mean() /
+                      prev_embedding.abs().mean().clamp(min=1e-8)).item()
+            for stage in self.accumulated_change:
+                self.accumulated_change[stage] += change
+        self.prev_embedding = embedded_timestep.detach()
+        self.num_steps += 1
+
+    def should_reuse(self, stage):
+        return (
+            stage in self.thresholds
+            and stage in self.residuals
+            and self.num_steps > self.warmup_steps
+            and self.accumulated_change[stage] < self.thresholds[stage]
+            and (self.max_reuse_steps is None or self.reuse_steps[stage] < self.max_reuse_steps)
+        )
+
+    def run(self, stage, stage_fn, *inputs):
+        """
+        The outputs of stage_fn(*inputs), a list of tensors (or None), or their approximation when the stage is
+        skipped: the j-th output is reused as inputs[j % len(inputs)] plus its residual.
+        """
+        if self.should_reuse(stage):
+            self.reuse_steps[stage] += 1
+            self.stats[f"{stage}_reused"] += 1
+            return [
+                residual if residual is None or inputs[j % len(inputs)] is None
+                else inputs[j % len(inputs)] + residual
+                for j, residual in enumerate(self.residuals[stage])
+            ]
+
+        outputs = stage_fn(*inputs)
+        self.stats[f"{stage}_computed"] += 1
+        if stage in self.thresholds:
+            self.residuals[stage] = [
+                output if output is None or inputs[j % len(inputs)] is None
+                else output - inputs[j % len(inputs)]
+                for j, output in enumerate(outputs)
+            ]
+            self.accumulated_change[stage] = 0.0
+            self.reuse_steps[stage] = 0
+        return outputs
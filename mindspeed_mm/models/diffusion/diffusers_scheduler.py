@@ -19,7 +19,8 @@ from diffusers.schedulers import (
     KDPM2AncestralDiscreteScheduler,
     CogVideoXDPMScheduler,
     CogVideoXDDIMScheduler,
-    FlowMatchEulerDiscreteScheduler
+    FlowMatchEulerDiscreteScheduler,
+    UniPCMultistepScheduler
 )
 from diffusers.training_utils import compute_snr
 from megatron.core import mpu
@@ -37,10 +38,28 @@ DIFFUSERS_SCHEDULE_MAPPINGS = {
     "EulerAncestralDiscrete": EulerAncestralDiscreteScheduler,
     "DEISMultistep": DEISMultistepScheduler,
     "KDPM2AncestralDiscrete": KDPM2AncestralDiscreteScheduler,
+    "UniPCMultistep": UniPCMultistepScheduler,
     "cogvideox_5b": CogVideoXDPMScheduler,
     "cogvideox_2b": CogVideoXDDIMScheduler
 }
 
+# The defaults of the multistep solvers, overridden by the config. Second order solvers on trailing timesteps keep the
+# last step at the zero terminal SNR of the v-prediction schedule of OpenSoraPlan, and need 20 to 25 steps where the
+# ancestral samplers need 50 to 100.
+MULTISTEP_SOLVER_DEFAULTS = {
+    "DPMSolverMultistep": {
+        "num_inference_steps": 25,
+        "algorithm_type": "dpmsolver++",
+        "solver_order": 2,
+        "timestep_spacing": "trailing",
+    },
+    "UniPCMultistep": {
+        "num_inference_steps": 20,
+        "solver_order": 2,
+        "timestep_spacing": "trailing",
+    },
+}
+
 
 class DiffusersScheduler:
     """
@@ -53,16 +72,22 @@ class DiffusersScheduler:
             "beta_start":0.0001,
             "beta_end":0.02
             "beta_schedule":"linear"
+            "guidance_interval": [low, high], the timesteps of the classifier free guidance, the other steps
+                only run the conditional branch, all the steps if not set
             ...
         }
     """
 
     def __init__(self, config):
+        config = {**MULTISTEP_SOLVER_DEFAULTS.get(config["model_id"], {}), **config}
         # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
         # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
         # corresponds to doing no classifier free guidance.
         self.guidance_scale = config.pop("guidance_scale", 1.0)
         self.do_classifier_free_guidance = self.guidance_scale > 1.0
+        self.guidance_interval = config.pop("guidance_interval", None)
+        # the model evaluations per sample of the last call of sample, a guided step counts twice
+        self.nfe = 0
         self.num_train_steps = config.pop("num_train_steps", 1000)
         self.num_inference_steps = config.pop("num_inference_steps", None)
         self.prediction_type = config.get("prediction_type", "epsilon")
@@ -224,27 +249,38 @@ class DiffusersScheduler:
         guidance_scale = self.guidance_scale
 
         # for loop denoising to get latents
+        self.nfe = 0
+        conditional_kwargs = None
         with tqdm(total=self.num_inference_steps) as progress_bar:
             old_pred_original_sample = None
             for i, t in enumerate(self.timesteps):
                 # timestep = torch.tensor([i] * shape[0], device=self.device)
-                latent_model_input = torch.cat([latents] * 2) if self.do_classifier_free_guidance else latents
+                do_classifier_free_guidance = self.do_classifier_free_guidance and self.in_guidance_interval(t)
+                if self.do_classifier_free_guidance and not do_classifier_free_guidance:
+                    # outside the guidance interval only the conditional half of the batch is run
+                    if conditional_kwargs is None:
+                        conditional_kwargs = self.get_conditional_kwargs(model_kwargs, latents.shape[0])
+                    step_kwargs = conditional_kwargs
+                else:
+                    step_kwargs = model_kwargs
+                self.nfe += 2 if do_classifier_free_guidance else 1
+                latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
                 if not isinstance(self.diffusion, FlowMatchEulerDiscreteScheduler):
                     latent_model_input = self.diffusion.scale_model_input(latent_model_input, t)
                 if not isinstance(self.diffusion, FlowMatchEulerDiscreteScheduler):
                     current_timestep = t.expand(latent_model_input.shape[0])
                 if use_dynamic_cfg:
                     # b t c h w  -> b c t h w
-                    model_kwargs["latents"] = latent_model_input.permute(0, 2, 1, 3, 4)
+                    step_kwargs["latents"] = latent_model_input.permute(0, 2, 1, 3, 4)
                 else:
-                    model_kwargs["latents"] = latent_model_input
+                    step_kwargs["latents"] = latent_model_input
                     video_mask = torch.ones_like(latent_model_input)[:, 0]
-                    world_size = model_kwargs.get("world_size", 1)
+                    world_size = step_kwargs.get("world_size", 1)
                     video_mask = video_mask.repeat(1, world_size, 1, 1)
-                    model_kwargs["video_mask"] = video_mask
+                    step_kwargs["video_mask"] = video_mask
 
                 with torch.no_grad():
-                    noise_pred = model(timestep=current_timestep, **model_kwargs)
+                    noise_pred = model(timestep=current_timestep, **step_kwargs)
 
                 # perform guidance
                 if use_dynamic_cfg:
@@ -255,7 +291,7 @@ class DiffusersScheduler:
                     )
 
                 # perform guidance
-                if self.do_classifier_free_guidance:
+                if do_classifier_free_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
 
@@ -287,6 +323,20 @@ class DiffusersScheduler:
                         callback(step_idx, t, latents)
         return latents
 
+    def in_guidance_interval(self, t):
+        if self.guidance_interval is None:
+            return True
+        low, high = self.guidance_interval
+        return low <= float(t) <= high
+
+    @staticmethod
+    def get_conditional_kwargs(model_kwargs, batch_size):
+        """The model_kwargs of the conditional half of the [unconditional, conditional] batch of the guidance."""
+        return {
+            key: value.chunk(2)[1] if isinstance(value, Tensor) and value.shape[0] == 2 * batch_size else value
+            for key, value in model_kwargs.items()
+        }
+
     def broadcast_timesteps(self, input_: torch.Tensor):
         cp_src_rank = list(mpu.get_context_parallel_global_ranks())[0]
         if mpu.get_context_parallel_world_size() > 1:
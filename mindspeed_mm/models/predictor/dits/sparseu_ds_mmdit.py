@@ -245,17 +245,9 @@ class SparseUMMDiT(MultiModalModule):
         attention_mask_sparse_1d = torch.cat([attention_mask_sparse_1d, encoder_attention_mask_sparse], dim=-1)
         attention_mask_sparse_1d_group = torch.cat([attention_mask_sparse_1d_group, encoder_attention_mask_sparse], dim=-1)
 
-        def get_attention_mask(mask, repeat_num):
-            mask = mask.to(torch.bool)
-            mask = mask.repeat(1, 1, repeat_num, 1)
-            return mask
-
-        attention_mask_sparse_1d = get_attention_mask(
-            attention_mask_sparse_1d, attention_mask_sparse_1d.shape[-1]
-        )
-        attention_mask_sparse_1d_group = get_attention_mask(
-            attention_mask_sparse_1d_group, attention_mask_sparse_1d_group.shape[-1]
-        )
+        # keep the (k b) 1 1 l key padding form, the attention expands it for the kernel
+        attention_mask_sparse_1d = attention_mask_sparse_1d.to(torch.bool)
+        attention_mask_sparse_1d_group = attention_mask_sparse_1d_group.to(torch.bool)
 
         return {
             False: attention_mask_sparse_1d,
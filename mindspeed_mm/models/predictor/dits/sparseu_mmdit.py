@@ -17,6 +17,7 @@ from mindspeed_mm.models.common.ffn import FeedForward
 from mindspeed_mm.models.common.attention import MultiHeadSparseMMAttentionSBH
 from mindspeed_mm.models.common.normalize import normalize
 from mindspeed_mm.models.common.communications import split_forward_gather_backward, gather_forward_split_backward
+from mindspeed_mm.models.common.feature_cache import DenoisingFeatureCache
 
 from mindspeed_mm.models.predictor.dits.modules import CombinedTimestepTextProjEmbeddings, AdaNorm, OpenSoraNormZero
 
@@ -50,6 +51,9 @@ class SparseUMMDiT(MultiModalModule):
         norm_elementwise_affine: Whether to use learnable elementwise affine parameters for normalization.
         norm_eps: The eps of the normalization.
         interpolation_scale: The scale for interpolation.
+        feature_cache: The config of the DenoisingFeatureCache of inference, e.g. {"thresholds": {"enc": 0.05,
+            "mid": 0.1, "dec": 0.05}, "warmup_steps": 2, "max_reuse_steps": 3}, the stages are computed at every
+            denoising step if None.
     """
 
     def __init__(
@@ -81,6 +85,7 @@ class SparseUMMDiT(MultiModalModule):
         norm_cls: str = 'rms_norm', 
         skip_connection: bool = False,
         explicit_uniform_rope: bool = False, 
+        feature_cache: Optional[dict] = None,
         **kwargs
     ):
         super().__init__(config=None)
@@ -106,6 +111,7 @@ class SparseUMMDiT(MultiModalModule):
         self.patch_size_t = patch_size_t
         self.patch_size = patch_size
         self.skip_connection = skip_connection
+        self.feature_cache = DenoisingFeatureCache(**feature_cache) if feature_cache else None
 
         if norm_cls == 'rms_norm':
             self.norm_cls = RMSNorm
@@ -257,17 +263,9 @@ class SparseUMMDiT(MultiModalModule):
         attention_mask_sparse_1d = torch.cat([attention_mask_sparse_1d, encoder_attention_mask_sparse], dim=-1)
         attention_mask_sparse_1d_group = torch.cat([attention_mask_sparse_1d_group, encoder_attention_mask_sparse], dim=-1)
 
-        def get_attention_mask(mask, repeat_num):
-            mask = mask.to(torch.bool)
-            mask = mask.repeat(1, 1, repeat_num, 1)
-            return mask
-
-        attention_mask_sparse_1d = get_attention_mask(
-            attention_mask_sparse_1d, attention_mask_sparse_1d.shape[-1]
-        )
-        attention_mask_sparse_1d_group = get_attention_mask(
-            attention_mask_sparse_1d_group, attention_mask_sparse_1d_group.shape[-1]
-        )
+        # keep the (k b) 1 1 l key padding form, the attention expands it for the kernel
+        attention_mask_sparse_1d = attention_mask_sparse_1d.to(torch.bool)
+        attention_mask_sparse_1d_group = attention_mask_sparse_1d_group.to(torch.bool)
 
         return {
             False: attention_mask_sparse_1d,
@@ -339,17 +337,23 @@ class SparseUMMDiT(MultiModalModule):
             hidden_states = tensor_parallel.scatter_to_sequence_parallel_region(hidden_states)
             encoder_hidden_states = tensor_parallel.scatter_to_sequence_parallel_region(encoder_hidden_states)
 
-        hidden_states, encoder_hidden_states, skip_connections = self._operate_on_enc(
-            hidden_states, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
-        )
+        if self.feature_cache is not None and not self.training:
+            self.feature_cache.step(embedded_timestep, shape=(hidden_states.shape, encoder_hidden_states.shape))
+            hidden_states, encoder_hidden_states = self._operate_on_cached_stages(
+                hidden_states, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
+            )
+        else:
+            hidden_states, encoder_hidden_states, skip_connections = self._operate_on_enc(
+                hidden_states, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
+            )
 
-        hidden_states, encoder_hidden_states = self._operate_on_mid(
-            hidden_states, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
-        )
+            hidden_states, encoder_hidden_states = self._operate_on_mid(
+                hidden_states, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
+            )
 
-        hidden_states, encoder_hidden_states = self._operate_on_dec(
-            hidden_states, skip_connections, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
-        )
+            hidden_states, encoder_hidden_states = self._operate_on_dec(
+                hidden_states, skip_connections, encoder_hidden_states, embedded_timestep, frames, height, width, video_rotary_emb
+            )
 
         # 3. Output
         output = self._get_output_for_patched_inputs(
@@ -443,6 +447,36 @@ class SparseUMMDiT(MultiModalModule):
                 
         return hidden_states, encoder_hidden_states
 
+    def _operate_on_cached_stages(
+        self, hidden_states, encoder_hidden_states,
+        embedded_timestep, frames, height, width, video_rotary_emb
+    ):
+        """
+        The enc, mid and dec stages, the stages skipped by the feature cache at this step reuse their residuals,
+        the skip connections of the enc stage are cached as residuals of its inputs as well.
+        """
+        stage_args = (embedded_timestep, frames, height, width, video_rotary_emb)
+
+        def enc_stage(hidden_states, encoder_hidden_states):
+            hidden_states, encoder_hidden_states, skip_connections = self._operate_on_enc(
+                hidden_states, encoder_hidden_states, *stage_args
+            )
+            return [hidden_states, encoder_hidden_states] + [x for skip in skip_connections for x in skip]
+
+        hidden_states, encoder_hidden_states, *skip_states = self.feature_cache.run(
+            "enc", enc_stage, hidden_states, encoder_hidden_states
+        )
+        skip_connections = [list(skip) for skip in zip(skip_states[::2], skip_states[1::2])]
+
+        hidden_states, encoder_hidden_states = self.feature_cache.run(
+            "mid", lambda h, e: list(self._operate_on_mid(h, e, *stage_args)), hidden_states, encoder_hidden_states
+        )
+        hidden_states, encoder_hidden_states = self.feature_cache.run(
+            "dec", lambda h, e: list(self._operate_on_dec(h, skip_connections, e, *stage_args)),
+            hidden_states, encoder_hidden_states
+        )
+        return hidden_states, encoder_hidden_states
+
     def _operate_on_patched_inputs(self, hidden_states, encoder_hidden_states, timestep, pooled_projections):
 
         hidden_states = self.patch_embed(hidden_states.to(self.dtype))
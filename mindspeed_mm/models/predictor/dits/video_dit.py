@@ -216,12 +216,13 @@ class VideoDiT(MultiModalModule):
                 prompt_img_mask = prompt_vid_mask
                 prompt_vid_mask = None
 
+        # keep the b 1 1 l key padding form, the attention expands it for the kernel
         if vid_mask is not None:
-            vid_mask = vid_mask.bool().repeat(1, vid_mask.shape[-1], 1)
-            prompt_vid_mask = prompt_vid_mask.bool().repeat(1, vid_mask.shape[-2], 1)
+            vid_mask = vid_mask.bool().unsqueeze(1)
+            prompt_vid_mask = prompt_vid_mask.bool().unsqueeze(1)
         if img_mask is not None:
-            img_mask = img_mask.bool().repeat(1, img_mask.shape[-1], 1)
-            prompt_img_mask = prompt_img_mask.bool().repeat(1, img_mask.shape[-2], 1)
+            img_mask = img_mask.bool().unsqueeze(1)
+            prompt_img_mask = prompt_img_mask.bool().unsqueeze(1)
 
         # 1. Input
         frames = ((frames - 1) // self.patch_size_t + 1) if frames % 2 == 1 else frames // self.patch_size_t  # patchfy
@@ -25,6 +25,7 @@ from mindspeed_mm.models.predictor import PredictModel
 from mindspeed_mm.models.diffusion import DiffusionModel
 from mindspeed_mm.models.ae import AEModel
 from mindspeed_mm.models.text_encoder import TextEncoder
+from mindspeed_mm.models.common.distrib import DiagonalGaussianDistribution
 from mindspeed_mm.utils.utils import get_dtype
 
 logger = getLogger(__name__)
@@ -91,7 +92,8 @@ class SoRAModel(nn.Module):
         with torch.no_grad():
             # Visual Encode
             if self.load_video_features:
-                latents = video
+                # video holds the normalized posterior moments saved by extract_features_sora.py
+                latents = DiagonalGaussianDistribution(video).sample()
             else:
                 latents = self.ae.encode(video)
             # Text Encode
@@ -8,6 +8,7 @@ from mindspeed_mm.tasks.inference.pipeline.pipeline_base import MMPipeline
 from mindspeed_mm.tasks.inference.pipeline.pipeline_mixin.encode_mixin import MMEncoderMixin
 from mindspeed_mm.tasks.inference.pipeline.pipeline_mixin.inputs_checks_mixin import InputsCheckMixin
 from mindspeed_mm.tasks.inference.pipeline.patchs.sora_patchs import replace_with_fp32_forwards
+from mindspeed_mm.tasks.inference.pipeline.utils.embedding_cache import PromptEmbeddingCache, get_encoder_id
 
 
 class OpenSoraPlanPipeline(MMPipeline, InputsCheckMixin, MMEncoderMixin):
@@ -23,6 +24,15 @@ class OpenSoraPlanPipeline(MMPipeline, InputsCheckMixin, MMEncoderMixin):
         self.predict_model = predict_model
         text_encoder.use_attention_mask = config.use_attention_mask
         self.num_frames, self.height, self.width = config.input_size
+        # the latents are decoded by micro-batches of vae_micro_batch_size videos to bound the memory of the vae
+        self.vae_micro_batch_size = config.get("vae_micro_batch_size", None)
+        # the embeddings of the prompts, e.g. the negative prompt template, are encoded once by the text encoder
+        cache_size = config.get("prompt_embedding_cache_size", 16)
+        cache_dir = config.get("prompt_embedding_cache_dir", None)
+        self.prompt_embedding_cache = None
+        if cache_size > 0 or cache_dir is not None:
+            self.prompt_embedding_cache = PromptEmbeddingCache(get_encoder_id(tokenizer, text_encoder),
+                                                               max_size=cache_size, cache_dir=cache_dir)
         replace_with_fp32_forwards()
 
     @torch.no_grad()
@@ -63,18 +73,31 @@ class OpenSoraPlanPipeline(MMPipeline, InputsCheckMixin, MMEncoderMixin):
         do_classifier_free_guidance = guidance_scale > 1.0
 
         # 3. Encode input prompt
-        prompt_embeds, prompt_embeds_attention_mask, negative_prompt_embeds, negative_prompt_attention_mask = self.encode_texts(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            device=device,
-            do_classifier_free_guidance=do_classifier_free_guidance,
-            max_length=max_sequence_length,
-            clean_caption=clean_caption)
-
-        if do_classifier_free_guidance:
-            prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds], dim=0)
-            prompt_embeds_attention_mask = torch.cat([negative_prompt_attention_mask, prompt_embeds_attention_mask],
-                                                     dim=0)
+        if do_classifier_free_guidance and prompt_embeds is None and negative_prompt_embeds is None:
+            # the negative and the positive prompts of the batch are encoded by one call of the text encoder, in the
+            # [negative, positive] order of the classifier free guidance
+            if negative_prompt is None or isinstance(negative_prompt, str):
+                negative_prompt = [negative_prompt or ""] * batch_size
+            prompt = [prompt] if isinstance(prompt, str) else prompt
+            prompt_embeds, prompt_embeds_attention_mask, _, _ = self.encode_texts(
+                prompt=list(negative_prompt) + list(prompt),
+                device=device,
+                do_classifier_free_guidance=False,
+                max_length=max_sequence_length,
+                clean_caption=clean_caption)
+        else:
+            prompt_embeds, prompt_embeds_attention_mask, negative_prompt_embeds, negative_prompt_attention_mask = self.encode_texts(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                device=device,
+                do_classifier_free_guidance=do_classifier_free_guidance,
+                max_length=max_sequence_length,
+                clean_caption=clean_caption)
+
+            if do_classifier_free_guidance:
+                prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds], dim=0)
+                prompt_embeds_attention_mask = torch.cat([negative_prompt_attention_mask, prompt_embeds_attention_mask],
+                                                         dim=0)
 
         # 5. Prepare latents
         latent_channels = self.predict_model.in_channels
@@ -105,6 +128,9 @@ class OpenSoraPlanPipeline(MMPipeline, InputsCheckMixin, MMEncoderMixin):
                         "prompt_mask": prompt_embeds_attention_mask,
                         "return_dict": False}
 
+        # the features cached across the denoising steps belong to one sampling run
+        if getattr(self.predict_model, "feature_cache", None) is not None:
+            self.predict_model.feature_cache.reset()
         latents = self.scheduler.sample(model=self.predict_model, shape=shape, latents=latents, model_kwargs=model_kwargs,
                                         extra_step_kwargs=extra_step_kwargs)
         video = self.decode_latents(latents.to(self.vae.dtype))
@@ -112,6 +138,14 @@ class OpenSoraPlanPipeline(MMPipeline, InputsCheckMixin, MMEncoderMixin):
 
         return video
 
+    def decode_latents(self, latents, **kwargs):
+        if not self.vae_micro_batch_size or latents.shape[0] <= self.vae_micro_batch_size:
+            return super().decode_latents(latents, **kwargs)
+        return torch.cat([
+            super(OpenSoraPlanPipeline, self).decode_latents(micro_batch, **kwargs)
+            for micro_batch in latents.split(self.vae_micro_batch_size)
+        ])
+
     def prepare_extra_step_kwargs(self, generator, eta):
         # prepare extra kwargs for the scheduler step, since not all schedulers have the same signature
         # eta (η) is only used with the DDIMScheduler, it will be ignored for other schedulers.
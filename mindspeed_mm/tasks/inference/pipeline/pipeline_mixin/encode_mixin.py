@@ -40,52 +40,7 @@ class MMEncoderMixin:
             # textual inversion: process multi-vector tokens if necessary
             if isinstance(self, InputsCheckMixin):
                 prompt = self.preprocess_text(prompt, clean_caption, prompt_to_lower)
-
-            text_inputs = self.tokenizer(
-                prompt,
-                padding="max_length",
-                max_length=max_length,
-                truncation=True,
-                return_attention_mask=True,
-                add_special_tokens=True,
-                return_tensors="pt",
-            )
-            text_input_ids = text_inputs.input_ids
-            untruncated_ids = self.tokenizer(prompt, padding="longest", return_tensors="pt").input_ids
-
-            if untruncated_ids.shape[-1] >= text_input_ids.shape[-1] and not torch.equal(
-                    text_input_ids, untruncated_ids
-            ):
-                removed_text = self.tokenizer.batch_decode(
-                    untruncated_ids[:, max_length - 1: -1]
-                )
-                logger.warning(
-                    "The following part of your input was truncated because CLIP can only handle sequences up to"
-                    f" {max_length} tokens: {removed_text}"
-                )
-            if hasattr(self.text_encoder,
-                       "use_attention_mask") and self.text_encoder.use_attention_mask:
-                attention_mask = text_inputs.attention_mask.to(device)
-            else:
-                attention_mask = None
-            prompt_embeds_attention_mask = attention_mask
-            if clip_skip is None:
-                prompt_embeds = self.text_encoder(text_input_ids.to(device), attention_mask=attention_mask)
-                if isinstance(prompt_embeds, transformers.utils.ModelOutput):
-                    prompt_embeds = prompt_embeds[0]
-            else:
-                prompt_embeds = self.text_encoder(
-                    text_input_ids.to(device), attention_mask=attention_mask, output_hidden_states=True
-                )
-                # Access the `hidden_states` first, that contains a tuple of
-                # all the hidden states from the encoder layers. Then index into
-                # the tuple to access the hidden states from the desired layer.
-                prompt_embeds = prompt_embeds[-1][-(clip_skip + 1)]
-                # We also need to apply the final LayerNorm here to not mess with the
-                # representations. The `last_hidden_states` that we typically use for
-                # obtaining the final prompt representations passes through the LayerNorm
-                # layer.
-                prompt_embeds = self.text_encoder.text_model.final_layer_norm(prompt_embeds)
+            prompt_embeds, prompt_embeds_attention_mask = self.encode_prompt_texts(prompt, device, max_length, clip_skip)
         else:
             if hasattr(self.text_encoder, "use_attention_mask") and self.text_encoder.use_attention_mask:
                 prompt_embeds_attention_mask = torch.ones_like(prompt_embeds)
@@ -122,29 +77,8 @@ class MMEncoderMixin:
             if isinstance(self, InputsCheckMixin):
                 uncond_tokens = self.preprocess_text(uncond_tokens, clean_caption)
 
-            max_length = prompt_embeds.shape[1]
-            uncond_input = self.tokenizer(
-                uncond_tokens,
-                padding="max_length",
-                max_length=max_length,
-                truncation=True,
-                return_attention_mask=True,
-                add_special_tokens=True,
-                return_tensors="pt",
-            )
-            #  参数控制
-            if hasattr(self.text_encoder,
-                       "use_attention_mask") and self.text_encoder.use_attention_mask:
-                attention_mask = uncond_input.attention_mask.to(device)
-            else:
-                attention_mask = None
-            negative_prompt_attention_mask = attention_mask
-            negative_prompt_embeds = self.text_encoder(
-                uncond_input.input_ids.to(device),
-                attention_mask=attention_mask,
-            )
-            if isinstance(negative_prompt_embeds, transformers.utils.ModelOutput):
-                negative_prompt_embeds = negative_prompt_embeds[0]
+            negative_prompt_embeds, negative_prompt_attention_mask = self.encode_prompt_texts(
+                uncond_tokens, device, prompt_embeds.shape[1])
         else:
             if hasattr(self.text_encoder,
                        "use_attention_mask") and self.text_encoder.use_attention_mask and negative_prompt_embeds is not None:
@@ -161,6 +95,81 @@ class MMEncoderMixin:
 
         return prompt_embeds, prompt_embeds_attention_mask, negative_prompt_embeds, negative_prompt_attention_mask
 
+    def encode_prompt_texts(self, texts, device, max_length, clip_skip=None):
+        """
+        Encode the preprocessed texts, the texts found in self.prompt_embedding_cache are not encoded again and
+        the texts repeated in the batch, e.g. the negative prompts, are encoded once.
+        """
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        cache = getattr(self, "prompt_embedding_cache", None)
+        if cache is None:
+            return self.run_text_encoder(texts, device, max_length, clip_skip)
+
+        use_attention_mask = getattr(self.text_encoder, "use_attention_mask", False)
+        keys = [cache.get_key(text, max_length=max_length, clip_skip=clip_skip, use_attention_mask=use_attention_mask)
+                for text in texts]
+        entries = {}
+        for key in keys:
+            if key not in entries:
+                entries[key] = cache.get(key, device)
+        missing = {key: text for key, text in zip(keys, texts) if entries[key] is None}
+        if missing:
+            embeds, mask = self.run_text_encoder(list(missing.values()), device, max_length, clip_skip)
+            for i, key in enumerate(missing):
+                entries[key] = (embeds[i: i + 1].clone(), None if mask is None else mask[i: i + 1].clone())
+                cache.put(key, *entries[key])
+        prompt_embeds = torch.cat([entries[key][0] for key in keys])
+        attention_mask = None if entries[keys[0]][1] is None else torch.cat([entries[key][1] for key in keys])
+        return prompt_embeds, attention_mask
+
+    def run_text_encoder(self, texts, device, max_length, clip_skip=None):
+        text_inputs = self.tokenizer(
+            texts,
+            padding="max_length",
+            max_length=max_length,
+            truncation=True,
+            return_attention_mask=True,
+            add_special_tokens=True,
+            return_tensors="pt",
+        )
+        text_input_ids = text_inputs.input_ids
+        # only the texts filling max_length may have been truncated, they are tokenised again for the warning
+        full_texts = [text for text, length in zip(texts, text_inputs.attention_mask.sum(dim=1).tolist())
+                      if length >= max_length]
+        if full_texts:
+            untruncated_ids = self.tokenizer(full_texts, padding="longest", return_tensors="pt").input_ids
+            if untruncated_ids.shape[-1] > max_length:
+                removed_text = self.tokenizer.batch_decode(
+                    untruncated_ids[:, max_length - 1: -1]
+                )
+                logger.warning(
+                    "The following part of your input was truncated because CLIP can only handle sequences up to"
+                    f" {max_length} tokens: {removed_text}"
+                )
+        if hasattr(self.text_encoder,
+                   "use_attention_mask") and self.text_encoder.use_attention_mask:
+            attention_mask = text_inputs.attention_mask.to(device)
+        else:
+            attention_mask = None
+        if clip_skip is None:
+            prompt_embeds = self.text_encoder(text_input_ids.to(device), attention_mask=attention_mask)
+            if isinstance(prompt_embeds, transformers.utils.ModelOutput):
+                prompt_embeds = prompt_embeds[0]
+        else:
+            prompt_embeds = self.text_encoder(
+                text_input_ids.to(device), attention_mask=attention_mask, output_hidden_states=True
+            )
+            # Access the `hidden_states` first, that contains a tuple of
+            # all the hidden states from the encoder layers. Then index into
+            # the tuple to access the hidden states from the desired layer.
+            prompt_embeds = prompt_embeds[-1][-(clip_skip + 1)]
+            # We also need to apply the final LayerNorm here to not mess with the
+            # representations. The `last_hidden_states` that we typically use for
+            # obtaining the final prompt representations passes through the LayerNorm
+            # layer.
+            prompt_embeds = self.text_encoder.text_model.final_layer_norm(prompt_embeds)
+        return prompt_embeds, attention_mask
+
     @staticmethod
     def mask_text_embeddings(emb, mask):
         if emb.shape[0] == 1:
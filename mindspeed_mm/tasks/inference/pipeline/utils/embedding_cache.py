@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from collections import Counter, OrderedDict
+
+import torch
+
+
+def get_encoder_id(tokenizer, text_encoder):
+    """
+    The id of a tokenizer and text encoder pair, from their classes, checkpoints, vocabulary size, config and
+    dtype, and a few values of the first and the last weights, so a finetuned encoder saved at the same path does
+    not share the embeddings of the original one.
+    """
+    config = getattr(text_encoder, "config", None)
+    params = list(text_encoder.parameters())
+    fingerprint = [p.detach().flatten()[:64].float().cpu().tolist() for p in (params[:1] + params[-1:])]
+    fields = [
+        type(tokenizer).__name__,
+        getattr(tokenizer, "name_or_path", ""),
+        len(tokenizer),
+        type(text_encoder).__name__,
+        getattr(config, "name_or_path", ""),
+        config.to_json_string() if hasattr(config, "to_json_string") else "",
+        str(getattr(text_encoder, "dtype", "")),
+        fingerprint,
+    ]
+    return hashlib.md5(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+
+class PromptEmbeddingCache:
+    """
+    Cache of the text encoder outputs of single prompts: an in-memory LRU of max_size entries kept on the device,
+    and an optional on-disk store in cache_dir shared by the processes and the runs. The prompts are keyed by the
+    encoder id of get_encoder_id, the encoding arguments and the preprocessed text.
+
+    Args:
+        encoder_id(str): the id of the tokenizer and text encoder
+        max_size(int): the entries kept in memory, 0 to only use the disk
+        cache_dir(str): the directory of the on-disk store, only the memory is used if None
+    """
+
+    def __init__(self, encoder_id, max_size=16, cache_dir=None):
+        self.encoder_id = encoder_id
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.stats = Counter()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, text, **encode_kwargs):
+        fields = [self.encoder_id, sorted(encode_kwargs.items()), text]
+        return hashlib.sha256(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pt")
+
+    def get(self, key, device):
+        """(embeds, mask) of the key on device, None on a miss."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            embeds, mask = self.entries[key]
+            return embeds.to(device), None if mask is None else mask.to(device)
+        if self.cache_dir is not None and os.path.exists(self.get_path(key)):
+            try:
+                entry = torch.load(self.get_path(key), map_location="cpu")
+            except (OSError, RuntimeError, EOFError) as e:
+                print(f"Warning: failed to load the prompt embedding {self.get_path(key)}, {e}")
+            else:
+                self.stats["disk_hits"] += 1
+                embeds = entry["embeds"].to(device)
+                mask = None if entry["mask"] is None else entry["mask"].to(device)
+                self.put_memory(key, embeds, mask)
+                return embeds, mask
+        self.stats["misses"] += 1
+        return None
+
+    def put_memory(self, key, embeds, mask):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (embeds, mask)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def put(self, key, embeds, mask):
+        self.put_memory(key, embeds, mask)
+        if self.cache_dir is not None:
+            path = self.get_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written to a temporary file first, another rank may read the same key at the same time
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save({"embeds": embeds.cpu(), "mask": None if mask is None else mask.cpu()}, tmp_path)
+            os.replace(tmp_path, path)
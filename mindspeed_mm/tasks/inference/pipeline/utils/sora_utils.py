@@ -1,4 +1,5 @@
 import os
+import json
 
 import torch
 from torchvision.io import write_video
@@ -31,10 +32,51 @@ def _save_video(video, save_path, fps, value_range=(-1, 1), normalize=True):
     print(f"Saved video to {save_path}")
 
 
+def get_video_path(save_path, index):
+    return os.path.join(save_path, f"{index}.mp4")
+
+
+def save_one_video(video, save_path, fps, index, value_range=(-1, 1), normalize=True):
+    """Save the video of the prompt of index, written to a temporary file first so a video that exists is complete."""
+    os.makedirs(save_path, exist_ok=True)
+    tmp_path = os.path.join(save_path, f"{index}.tmp.mp4")
+    _save_video(video, tmp_path, fps, value_range, normalize)
+    os.replace(tmp_path, get_video_path(save_path, index))
+
+
 def load_prompts(prompt):
+    """
+    The prompts of a txt file, one per line, or of a jsonl file of {"prompt": str, "input_size": [t, h, w]} with
+    an optional input_size, or a single prompt.
+    """
     if os.path.exists(prompt):
         with open(prompt, "r") as f:
-            prompts = [line.strip() for line in f.readlines()]
+            if prompt.endswith(".jsonl"):
+                prompts = [json.loads(line) for line in f.readlines() if line.strip()]
+            else:
+                prompts = [line.strip() for line in f.readlines()]
         return prompts
     else:
-        return prompt
+        return [prompt]
+
+
+def load_conditional_pixel_values_path(conditional_pixel_values_path):
+    if os.path.exists(conditional_pixel_values_path):
+        with open(conditional_pixel_values_path, "r") as f:
+            return [line.strip() for line in f.readlines()]
+    else:
+        return [conditional_pixel_values_path]
+
+
+def shard_prompts(costs, num_shards, shard_rank):
+    """
+    The indices of the prompts of shard_rank, the prompts are assigned from the most expensive one to the shard
+    with the least cost so far, so the shards finish at about the same time. The indices are in increasing order.
+    """
+    loads = [0] * num_shards
+    shards = [[] for _ in range(num_shards)]
+    for index in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+        shard = min(range(num_shards), key=lambda i: (loads[i], i))
+        loads[shard] += costs[index]
+        shards[shard].append(index)
+    return sorted(shards[shard_rank])
@@ -0,0 +1,148 @@
+"""
+Benchmark the memory of the sparse attention masks of SparseUMMDiT: the dense (k b) 1 l l masks built once per
+forward against the (k b) 1 1 l key padding masks expanded by the attention for the kernel. A stack of attention
+layers cycles over the masks of every sparse_n and group as the model does, the peak memory of the forward (and
+the backward with --backward) is measured for both forms, each in its own process.
+
+    python mindspeed_mm/tools/attention_mask_benchmark.py --video-length 12800 --text-length 512 --backward
+
+npu_fusion_attention is used on NPU, scaled_dot_product_attention otherwise. The peak is the allocator peak on an
+accelerator and the peak RSS on CPU, where the attention scores are materialised, so use smaller lengths there.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+import torch
+import torch.nn.functional as F
+import mindspeed.megatron_adaptor
+
+from mindspeed_mm.models.common.attention import expand_key_padding_mask
+from mindspeed_mm.models.predictor.dits.sparseu_mmdit import SparseUMMDiT
+from mindspeed_mm.utils.utils import is_npu_available
+
+if is_npu_available():
+    import torch_npu
+
+
+def get_device():
+    if is_npu_available():
+        return torch.device("npu")
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    return torch.device("cpu")
+
+
+def get_memory_stats(device):
+    """Returns the functions resetting the peak and reading the current and peak memory in bytes."""
+    if device.type in ("npu", "cuda"):
+        module = getattr(torch, device.type)
+        return module.reset_peak_memory_stats, module.memory_allocated, module.max_memory_allocated
+    # ru_maxrss is in KB on Linux and can not be reset, every form is measured in its own process
+    max_rss = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return lambda: None, max_rss, max_rss
+
+
+def build_masks(batch_size, video_length, text_length, sparse_ns, device):
+    attention_mask = torch.zeros(batch_size, 1, video_length, device=device)
+    attention_mask[:, :, video_length * 3 // 4:] = -10000.0
+    encoder_attention_mask = torch.zeros(batch_size, 1, text_length, device=device)
+    encoder_attention_mask[:, :, text_length // 2:] = -10000.0
+    masks = []
+    for sparse_n in sparse_ns:
+        sparse_masks = SparseUMMDiT.prepare_sparse_mask(None, attention_mask, encoder_attention_mask, sparse_n)
+        masks.extend([sparse_masks[False], sparse_masks[True]])
+    return masks
+
+
+def attention(hidden_states, mask, num_heads):
+    seq_len, batch_size, hidden_size = hidden_states.shape
+    head_dim = hidden_size // num_heads
+    if is_npu_available():
+        return torch_npu.npu_fusion_attention(
+            hidden_states,
+            hidden_states,
+            hidden_states,
+            head_num=num_heads,
+            atten_mask=expand_key_padding_mask(mask, seq_len),
+            input_layout="SBH",
+            scale=1 / head_dim ** 0.5
+        )[0]
+    x = hidden_states.view(seq_len, batch_size, num_heads, head_dim).permute(1, 2, 0, 3)
+    # npu_fusion_attention masks out the True positions, scaled_dot_product_attention keeps them
+    out = F.scaled_dot_product_attention(x, x, x, attn_mask=~expand_key_padding_mask(mask, seq_len))
+    return out.permute(2, 0, 1, 3).reshape(seq_len, batch_size, hidden_size)
+
+
+def measure(args):
+    device = get_device()
+    dtype = torch.float32 if device.type == "cpu" else torch.bfloat16
+    reset_peak, memory_allocated, max_memory_allocated = get_memory_stats(device)
+    masks = build_masks(args.batch_size, args.video_length, args.text_length, args.sparse_n, device)
+    inputs = [
+        torch.randn(mask.shape[-1], mask.shape[0], args.hidden_size, device=device, dtype=dtype,
+                    requires_grad=args.backward)
+        for mask in masks
+    ]
+
+    reset_peak()
+    start = memory_allocated()
+    # the model builds its masks in every forward
+    if args.mask_form == "dense":
+        masks = [mask.expand(*mask.shape[:-2], mask.shape[-1], mask.shape[-1]).contiguous() for mask in masks]
+    mask_bytes = sum(mask.numel() * mask.element_size() for mask in masks)
+    with torch.set_grad_enabled(args.backward):
+        outputs = [
+            attention(inputs[layer % len(masks)], masks[layer % len(masks)], args.num_heads)
+            for layer in range(args.num_layers)
+        ]
+        if args.backward:
+            sum(out.float().sum() for out in outputs).backward()
+    return {
+        "mask_form": args.mask_form,
+        "device": device.type,
+        "mask_mb": mask_bytes / 2 ** 20,
+        "peak_mb": (max_memory_allocated() - start) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SparseUMMDiT attention mask memory benchmark")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--video-length", type=int, default=12800, help="the visual tokens, e.g. 32x20x20")
+    parser.add_argument("--text-length", type=int, default=512)
+    parser.add_argument("--sparse-n", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--num-layers", type=int, default=8)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--backward", action="store_true", help="measure the forward and the backward")
+    parser.add_argument("--mask-form", choices=["dense", "key_padding"], default=None,
+                        help="measure one form in this process, both in their own processes if not set")
+    parser.add_argument("--output-json", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mask_form is not None:
+        print(json.dumps(measure(args)))
+        return
+
+    results = []
+    for mask_form in ["dense", "key_padding"]:
+        output = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--mask-form", mask_form],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    for result in results:
+        print(f"{result['mask_form']:>12} masks: {result['mask_mb']:10.2f} MB, "
+              f"peak {'forward and backward' if args.backward else 'forward'} "
+              f"memory on {result['device']}: {result['peak_mb']:10.2f} MB")
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Benchmark the T2V data path without a model: T2VDataset, the configured sampler and Collate are built from a data
+json, on synthetic mp4/jpg fixtures and captions generated locally. Reports samples/s of the dataloader, the latency
+of every stage of a sample (read, decode, transform, tokenise, collate) and the memory of the dataloader workers.
+
+    python mindspeed_mm/tools/dataloader_benchmark.py --data-config examples/opensoraplan1.3/data.json \
+        --tokenizer /path/to/mt5-xxl --num-batches 50 --output-json dataloader_benchmark.json
+
+No distributed launcher is needed, a single process gloo group is initialised for the sampler.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from mindspeed_mm.data import build_mm_dataloader, build_mm_dataset
+from mindspeed_mm.data.data_utils.constants import VIDEO
+
+CAPTION_WORDS = [
+    "a", "the", "cat", "dog", "walks", "runs", "across", "green", "field", "city", "street", "at", "night",
+    "slowly", "camera", "pans", "over", "mountain", "river", "sunset", "close", "up", "of", "people", "dancing",
+]
+
+
+def make_caption(rng, num_words):
+    return " ".join(rng.choice(CAPTION_WORDS) for _ in range(num_words)).capitalize() + "."
+
+
+def make_frames(num_frames, height, width, seed):
+    # moving gradients with a little noise, cheap to encode like real footage, unlike pure noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    for t in range(num_frames):
+        frame = np.stack([(x + 3 * t) % 256, (y + 2 * t) % 256, (x + y + seed) % 256], axis=-1)
+        frame = frame + rng.integers(0, 16, size=frame.shape)
+        yield np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def make_fixtures(fixtures_dir, num_videos, num_images, num_frames, height, width, fps, seed=42):
+    """Write synthetic mp4 videos, jpg images and their annotation json, returns the data.txt of the combine mode."""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    rng = random.Random(seed)
+    samples = []
+    for i in range(num_videos):
+        path = f"video_{i}.mp4"
+        writer = cv2.VideoWriter(os.path.join(fixtures_dir, path), cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                                 (width, height))
+        for frame in make_frames(num_frames, height, width, seed + i):
+            writer.write(frame)
+        writer.release()
+        samples.append({
+            "path": path, "cap": [make_caption(rng, rng.randint(8, 60))], "fps": fps, "num_frames": num_frames,
+            "resolution": {"height": height, "width": width}, "cut": [0, num_frames], "aes": 5.0,
+        })
+    for i in range(num_images):
+        path = f"image_{i}.jpg"
+        image = next(make_frames(1, height, width, seed + num_videos + i))
+        Image.fromarray(image).save(os.path.join(fixtures_dir, path))
+        samples.append({
+            "path": path, "cap": [make_caption(rng, rng.randint(8, 60))],
+            "resolution": {"height": height, "width": width}, "aes": 5.0,
+        })
+    anno_path = os.path.join(fixtures_dir, "anno.json")
+    with open(anno_path, "w") as f:
+        json.dump(samples, f)
+    data_path = os.path.join(fixtures_dir, "data.txt")
+    with open(data_path, "w") as f:
+        f.write(f"{fixtures_dir},{anno_path}\n")
+    return data_path
+
+
+class StageTimer:
+    """
+    Time the methods of the data path by wrapping them on their instances. The stages are exclusive: the time of a
+    stage called inside another stage is only counted once, by the inner stage.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(list)
+        self.stack = []
+        self.wrapped = []
+
+    def wrap(self, obj, method_name, stage):
+        method = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                inner = self.stack.pop()
+                self.times[stage].append(elapsed - inner)
+                if self.stack:
+                    self.stack[-1] += elapsed
+
+        setattr(obj, method_name, timed)
+        self.wrapped.append((obj, method_name))
+
+    def restore(self):
+        # the methods are wrapped by instance attributes, deleting them restores the methods of the classes
+        for obj, method_name in self.wrapped:
+            delattr(obj, method_name)
+        self.wrapped = []
+
+    def summary(self):
+        return {
+            stage: {
+                "calls": len(times),
+                "mean_ms": 1e3 * float(np.mean(times)),
+                "p90_ms": 1e3 * float(np.percentile(times, 90)),
+            }
+            for stage, times in self.times.items()
+        }
+
+
+def profile_stages(dataset, collate_fn, indices, batch_size):
+    """The per-stage latency of the samples of indices, fetched and collated in this process."""
+    timer = StageTimer()
+    timer.wrap(dataset.video_reader, "acquire", "read")
+    timer.wrap(dataset.image_processer, "image_reader", "read")
+    timer.wrap(dataset.video_processer, "get_batched_data", "decode")
+    timer.wrap(dataset.video_processer, "combine_data_video_process", "transform")
+    timer.wrap(dataset.image_processer, "image_to_image", "transform")
+    if hasattr(dataset, "text_processer"):
+        timer.wrap(dataset, "get_text_processer", "tokenise")
+    timer.wrap(dataset, "getitem", "other")
+    batch = []
+    for index in indices:
+        batch.append(dataset.getitem(index))
+        if len(batch) == batch_size:
+            start = time.perf_counter()
+            collate_fn(batch)
+            timer.times["collate"].append(time.perf_counter() - start)
+            batch = []
+    timer.restore()
+    return timer.summary()
+
+
+def get_memory_mb(pid):
+    """(rss, peak rss) of a process in MB, read from /proc, None where it is not available."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def measure_throughput(dataloader, num_batches, warmup_batches):
+    """samples/s of the dataloader after warmup_batches, and the memory of its workers at the end."""
+    iterator = iter(dataloader)
+    for _ in range(warmup_batches):
+        next(iterator)
+    num_samples = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        batch = next(iterator)
+        num_samples += batch[VIDEO].shape[0]
+    elapsed = time.perf_counter() - start
+    workers = getattr(iterator, "_workers", [])
+    pids = [worker.pid for worker in workers] if workers else [os.getpid()]
+    memory = {pid: get_memory_mb(pid) for pid in pids}
+    del iterator
+    return num_samples / elapsed, elapsed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="T2V dataloader benchmark")
+    parser.add_argument("--data-config", type=str, required=True, help="the data json of the model config")
+    parser.add_argument("--tokenizer", type=str, default=None, help="override from_pretrained of tokenizer_config")
+    parser.add_argument("--fixtures-dir", type=str, default=None, help="a temporary directory if not set")
+    parser.add_argument("--num-videos", type=int, default=64)
+    parser.add_argument("--num-images", type=int, default=0)
+    parser.add_argument("--num-frames", type=int, default=None, help="the frames of a video, num_frames if not set")
+    parser.add_argument("--height", type=int, default=None, help="max_height of the data json if not set")
+    parser.add_argument("--width", type=int, default=None, help="max_width of the data json if not set")
+    parser.add_argument("--num-workers", type=int, default=None, help="override num_workers of dataloader_param")
+    parser.add_argument("--num-batches", type=int, default=20)
+    parser.add_argument("--warmup-batches", type=int, default=2)
+    parser.add_argument("--profile-samples", type=int, default=8, help="samples of the per-stage latency")
+    parser.add_argument("--output-json", type=str, default=None, help="save the results, e.g. for a CI check")
+    args = parser.parse_args()
+
+    with open(args.data_config, "r") as f:
+        data_config = json.load(f)
+    dataset_param, dataloader_param = data_config["dataset_param"], data_config["dataloader_param"]
+    preprocess_param = dataset_param["preprocess_parameters"]
+    num_frames = args.num_frames or preprocess_param.get("num_frames", 16)
+    height = args.height or preprocess_param.get("max_height", 480)
+    width = args.width or preprocess_param.get("max_width", 640)
+    fps = preprocess_param.get("train_fps", 24)
+
+    fixtures_dir = args.fixtures_dir or tempfile.mkdtemp(prefix="dataloader_benchmark_")
+    data_path = make_fixtures(fixtures_dir, args.num_videos, args.num_images, num_frames, height, width, fps)
+    dataset_param["basic_parameters"].update(data_path=data_path, data_folder="", data_storage_mode="combine")
+    dataset_param["use_feature_data"] = False
+    if args.tokenizer is not None:
+        dataset_param["tokenizer_config"]["from_pretrained"] = args.tokenizer
+    if args.num_workers is not None:
+        dataloader_param["num_workers"] = args.num_workers
+
+    if not torch.distributed.is_initialized():
+        torch.distributed.init_process_group(
+            "gloo", init_method=f"file://{os.path.join(fixtures_dir, 'dist_init')}", rank=0, world_size=1
+        )
+
+    start = time.perf_counter()
+    dataset = build_mm_dataset(dataset_param)
+    build_time = time.perf_counter() - start
+    print(f"Built the dataset of {len(dataset)} samples in {build_time:.2f}s, fixtures in {fixtures_dir}")
+    dataloader = build_mm_dataloader(dataset, dataloader_param)
+    batch_size = dataloader_param.get("batch_size", 1)
+    if args.warmup_batches + args.num_batches > len(dataloader):
+        raise ValueError(f"The dataloader has {len(dataloader)} batches, fewer than the warmup and the benchmark "
+                         f"batches, increase --num-videos.")
+
+    indices = list(range(min(args.profile_samples, len(dataset))))
+    stages = profile_stages(dataset, dataloader.collate_fn, indices, batch_size)
+    for stage, stats in stages.items():
+        print(f"{stage:>10}: {stats['calls']:4d} calls, mean {stats['mean_ms']:8.1f} ms, p90 {stats['p90_ms']:8.1f} ms")
+
+    samples_per_second, elapsed, memory = measure_throughput(dataloader, args.num_batches, args.warmup_batches)
+    print(f"{args.num_batches} batches in {elapsed:.2f}s, {samples_per_second:.2f} samples/s "
+          f"with {dataloader.num_workers} workers")
+    for pid, usage in memory.items():
+        if usage is not None:
+            print(f"process {pid}: rss {usage[0]:.0f} MB, peak rss {usage[1]:.0f} MB")
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as f:
+            json.dump({
+                "samples_per_second": samples_per_second,
+                "dataset_build_seconds": build_time,
+                "num_workers": dataloader.num_workers,
+                "stages": stages,
+                "worker_memory_mb": [usage for usage in memory.values() if usage is not None],
+            }, f, indent=4)
+    torch.distributed.destroy_process_group()
+
+
+if __name__ == "__main__":
+    main()
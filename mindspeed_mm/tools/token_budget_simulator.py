@@ -0,0 +1,101 @@
+"""
+Simulate the micro-batches of the TokenBudgetBatchSampler on the shapes of a dataset, and report the unused token
+budget and the per-step imbalance of the data parallel ranks against a fixed batch size.
+
+    python mindspeed_mm/tools/token_budget_simulator.py --data-config examples/opensoraplan1.2/data.json \
+        --token-budget 65536 --world-size 8 --batch-size 1
+"""
+
+import argparse
+import json
+from collections import Counter, defaultdict
+
+import numpy as np
+import torch
+
+from mindspeed_mm.data.dataloader.sampler import get_latent_tokens, pack_token_budget_batches
+
+
+def load_lengths(args):
+    if args.lengths_file is not None:
+        with open(args.lengths_file, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from mindspeed_mm.data import build_mm_dataset
+
+    with open(args.data_config, "r") as f:
+        dataset_param = json.load(f)["dataset_param"]
+    if args.data_path is not None:
+        dataset_param["basic_parameters"]["data_path"] = args.data_path
+    dataset_param["use_text_processer"] = False
+    dataset_param["use_feature_data"] = False
+    return build_mm_dataset(dataset_param).lengths
+
+
+def fixed_batch_size_steps(lengths, batch_size, world_size, token_fn, generator):
+    # the micro-batches of the LengthGroupedSampler: batch_size samples of one shape, in a random order
+    grouped_indices = defaultdict(list)
+    for idx, item in enumerate(lengths):
+        grouped_indices[item].append(idx)
+    micro_batch_tokens = []
+    for shape, indices in grouped_indices.items():
+        for i in range(0, len(indices), batch_size):
+            micro_batch_tokens.append(len(indices[i: i + batch_size]) * token_fn(shape))
+    micro_batch_tokens = [micro_batch_tokens[i] for i in torch.randperm(len(micro_batch_tokens),
+                                                                        generator=generator).tolist()]
+    return [micro_batch_tokens[i: i + world_size] for i in range(0, len(micro_batch_tokens), world_size)]
+
+
+def report(name, step_tokens, capacity):
+    tokens = np.array([t for step in step_tokens for t in step], dtype=np.float64)
+    imbalance = np.array([1 - np.mean(step) / np.max(step) for step in step_tokens])
+    print(f"{name}: {len(step_tokens)} steps, {len(tokens)} micro-batches, "
+          f"tokens per micro-batch mean {tokens.mean():.0f} / max {tokens.max():.0f}, "
+          f"unused capacity {1 - tokens.mean() / capacity:.1%}, "
+          f"rank imbalance per step mean {imbalance.mean():.1%} / max {imbalance.max():.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TokenBudgetBatchSampler simulator")
+    parser.add_argument("--data-config", type=str, default=None, help="the data json of the model config")
+    parser.add_argument("--data-path", type=str, default=None, help="override the data_path of the data json")
+    parser.add_argument("--lengths-file", type=str, default=None, help="a text file of TxHxW shapes, one per line")
+    parser.add_argument("--token-budget", type=int, required=True)
+    parser.add_argument("--max-batch-size", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=1, help="the fixed batch size to compare with")
+    parser.add_argument("--world-size", type=int, default=8, help="the data parallel size")
+    parser.add_argument("--ae-stride-t", type=int, default=4)
+    parser.add_argument("--ae-stride", type=int, default=8)
+    parser.add_argument("--patch-size-t", type=int, default=1)
+    parser.add_argument("--patch-size", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.data_config is None and args.lengths_file is None:
+        raise ValueError("One of --data-config and --lengths-file must be provided.")
+
+    lengths = load_lengths(args)
+    shape_tokens = {
+        shape: get_latent_tokens(shape, args.ae_stride_t, args.ae_stride, args.patch_size_t, args.patch_size)
+        for shape in set(lengths)
+    }
+    print(f"{len(lengths)} samples of {len(shape_tokens)} shapes, the most common: "
+          f"{Counter(lengths).most_common(5)}")
+    over_budget = [shape for shape, tokens in shape_tokens.items() if tokens > args.token_budget]
+    if over_budget:
+        print(f"Warning: {len(over_budget)} shapes are over the token budget and get a micro-batch of their own, "
+              f"e.g. {over_budget[:5]}")
+
+    generator = torch.Generator().manual_seed(args.seed)
+    fixed_steps = fixed_batch_size_steps(lengths, args.batch_size, args.world_size, shape_tokens.__getitem__,
+                                         generator)
+    report(f"batch_size={args.batch_size}", fixed_steps, max(t for step in fixed_steps for t in step))
+    _, budget_steps = pack_token_budget_batches(
+        lengths, args.token_budget, args.world_size, shape_tokens.__getitem__,
+        max_batch_size=args.max_batch_size, generator=generator,
+    )
+    report(f"token_budget={args.token_budget}", budget_steps,
+           max(args.token_budget, max(t for step in budget_steps for t in step)))
+
+
+if __name__ == "__main__":
+    main()
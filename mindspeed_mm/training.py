@@ -56,6 +56,7 @@ def pretrain(
     process_non_loss_data_func=None,
     extra_args_provider=None,
     args_defaults={},
+    data_stats_func=None,
 ):
     """
     Main training program.
@@ -85,6 +86,11 @@ def pretrain(
             to it. It is used for programs to add their own arguments.
         args_defaults: a dictionary from argument-name to argument-value. It
             to set already parse arguments.
+        data_stats_func: a function that logs the stats of the train data, e.g.
+            the fetch and collate counters of the dataloader. It takes the
+            `current iteration index` as argument, and is called on all ranks
+            every `log_interval` iterations next to the training log, so it
+            may run collective calls.
     """
 
     # Initalize and get arguments, timers, and Tensorboard writer.
@@ -190,6 +196,7 @@ def pretrain(
                 valid_data_iterator,
                 process_non_loss_data_func,
                 config,
+                data_stats_func,
             )
 
         print_datetime("after training is done")
@@ -245,6 +252,7 @@ def train(
     valid_data_iterator,
     process_non_loss_data_func,
     config,
+    data_stats_func=None,
 ):
     """Train the model function."""
     args = get_args()
@@ -429,6 +437,8 @@ def train(
             params_norm,
             num_zeros_in_grad,
         )
+        if data_stats_func is not None and iteration % args.log_interval == 0:
+            data_stats_func(iteration)
 
         # Autoresume
         if args.adlr_autoresume and (iteration % args.adlr_autoresume_interval == 0):
@@ -1,6 +1,8 @@
 # Copyright (c) 2023, NVIDIA CORPORATION.  All rights reserved.
 """Pretrain SoRA."""
 
+from functools import lru_cache
+
 import torch
 
 import mindspeed.megatron_adaptor
@@ -21,10 +23,12 @@ from mindspeed_mm.data.data_utils.constants import (
     PROMPT_IDS, 
     PROMPT_MASK, 
     VIDEO_MASK,
+    VIDEO_RESIZE,
     PROMPT_IDS_2, 
     PROMPT_MASK_2, 
 )
-from mindspeed_mm.data.data_utils.utils import build_iterations
+from mindspeed_mm.data.data_utils.transform_pipeline import DeferredResizeTransform, Uint8NormTransform
+from mindspeed_mm.data.data_utils.utils import build_iterations, log_data_stats
 from mindspeed_mm.models.sora_model import SoRAModel
 
 
@@ -64,12 +68,33 @@ def loss_func(output_tensor):
     return loss, {"loss": averaged_loss[0]}
 
 
+@lru_cache(maxsize=1)
+def get_deferred_resize_transform():
+    args = get_args()
+    train_pipeline = args.mm.data.dataset_param.preprocess_parameters.train_pipeline
+    return DeferredResizeTransform(train_pipeline.to_dict())
+
+
+@lru_cache(maxsize=1)
+def get_uint8_norm_transform():
+    args = get_args()
+    train_pipeline = args.mm.data.dataset_param.preprocess_parameters.train_pipeline
+    return Uint8NormTransform(train_pipeline.to_dict())
+
+
 def forward_step(data_iterator, model):
     """Forward step."""
     batch = get_batch(data_iterator)
     video = batch.pop(VIDEO, None)
-    prompt_ids = batch.pop(PROMPT_IDS, None)
+    video_resize = batch.pop(VIDEO_RESIZE, None)
     video_mask = batch.pop(VIDEO_MASK, None)
+    if video_resize is not None:
+        # the resize of the train_pipeline is deferred to the device
+        video = get_deferred_resize_transform()(video, video_resize)
+    elif video is not None and video.dtype == torch.uint8:
+        # the uint8_transport of the train_pipeline, the pixel value transforms run on the device
+        video = get_uint8_norm_transform()(video, video_mask)
+    prompt_ids = batch.pop(PROMPT_IDS, None)
     prompt_mask = batch.pop(PROMPT_MASK, None)
     prompt_ids_2 = batch.pop(PROMPT_IDS_2, None)
     prompt_mask_2 = batch.pop(PROMPT_MASK_2, None)
@@ -95,10 +120,22 @@ def train_valid_test_datasets_provider(train_val_test_num_samples):
         args.mm.data.dataloader_param,
         process_group=mpu.get_data_parallel_group(),
     )
-    data_iterator, _, _ = build_iterations(train_dl=train_dataloader)
+    data_iterator, _, _ = build_iterations(
+        train_dl=train_dataloader,
+        device_prefetch=args.mm.data.dataloader_param.get("device_prefetch", 0),
+    )
+    # kept for data_stats_provider, the data iterator does no communication
+    train_valid_test_datasets_provider.train_dataloader = train_dataloader
     return data_iterator, None, None
 
 
+def data_stats_provider(iteration):
+    """Log the stats of the train dataloader summed over the data parallel group."""
+    train_dataloader = getattr(train_valid_test_datasets_provider, "train_dataloader", None)
+    if train_dataloader is not None:
+        log_data_stats(train_dataloader, mpu.get_data_parallel_group())
+
+
 if __name__ == "__main__":
     train_valid_test_datasets_provider.is_distributed = True
     pretrain(
@@ -108,4 +145,5 @@ if __name__ == "__main__":
         forward_step,
         extra_args_provider=mm_extra_args_provider,
         args_defaults={"dataloader_type": "external", "vision_pretraining": False},
+        data_stats_func=data_stats_provider,
     )
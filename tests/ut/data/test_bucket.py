@@ -0,0 +1,39 @@
+import numpy as np
+
+from mindspeed_mm.data.data_utils.bucket import Bucket, default_rng_uniforms
+from tests.ut.utils import judge_expression
+
+
+BUCKET_CONFIG = {
+    "144p": {1: (1.0, 48), 51: (1.0, 12), 102: ((1.0, 0.33), 4), 204: ((1.0, 0.1), 2)},
+    "240p": {1: (0.3, 24), 51: (0.4, 4), 102: ((0.4, 0.33), 2)},
+    "360p": {1: (0.5, 8), 51: (0.2, 2), 102: ((0.3, 0.5), 1)},
+    "480p": {51: (0.4, 1)},
+}
+
+
+def make_samples(num_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    T = np.where(rng.random(num_samples) < 0.3, 1, rng.integers(2, 400, num_samples))
+    H = rng.choice([144, 240, 256, 360, 480, 720, 1080], num_samples)
+    W = rng.choice([256, 320, 426, 640, 854, 1280, 1920], num_samples)
+    return T, H, W, np.arange(num_samples)
+
+
+class TestBucket:
+
+    def test_default_rng_uniforms(self):
+        seeds = np.concatenate([np.arange(100), [2 ** 32 - 1, 2 ** 32, 2 ** 40 + 7]])
+        expected = [[rng.random(), rng.random()] for rng in map(np.random.default_rng, seeds.tolist())]
+        judge_expression(np.array_equal(default_rng_uniforms(seeds, 2), np.array(expected)))
+
+    def test_same_buckets_as_get_bucket_id(self):
+        bucket = Bucket(BUCKET_CONFIG)
+        T, H, W, ids = make_samples(3000)
+        seed = 42
+        for frame_interval in [1, 2]:
+            bucket_keys, bucket_index = bucket.get_bucket_ids(T, H, W, ids, frame_interval=frame_interval, seed=seed)
+            for i in range(len(T)):
+                expected = bucket.get_bucket_id(T[i], H[i], W[i], frame_interval, seed + ids[i] * bucket.num_bucket)
+                output = bucket_keys[bucket_index[i]] if bucket_index[i] >= 0 else None
+                judge_expression(output == expected)
@@ -0,0 +1,109 @@
+import torch
+import torch.nn.functional as F
+
+from mindspeed_mm.data.data_utils.constants import (
+    PROMPT_IDS, PROMPT_IDS_2, PROMPT_MASK, PROMPT_MASK_2, VIDEO, VIDEO_MASK
+)
+import pytest
+
+from mindspeed_mm.data.dataloader.collator import (
+    Collate, check_text_pad_multiple, pad_and_stack, pad_text_to_batch_max
+)
+from mindspeed_mm.data.data_utils.utils import get_data_stats
+from tests.ut.utils import judge_expression
+
+
+MODEL_MAX_LENGTH = 512
+
+
+def make_text_batch(valid_lengths, hidden_size=None):
+    input_ids, cond_mask = [], []
+    for length in valid_lengths:
+        mask = torch.zeros((1, MODEL_MAX_LENGTH), dtype=torch.long)
+        mask[0, :length] = 1
+        shape = (1, MODEL_MAX_LENGTH) if hidden_size is None else (1, MODEL_MAX_LENGTH, hidden_size)
+        input_ids.append(torch.randn(shape) * mask.unsqueeze(-1) if hidden_size else torch.randint(1, 100, shape) * mask)
+        cond_mask.append(mask)
+    return input_ids, cond_mask
+
+
+def joint_attention(visual, text, text_mask):
+    # the key padding mask of the joint visual and text attention, as in MultiHeadSparseMMAttentionSBH
+    x = torch.cat([visual, text], dim=2)
+    key_mask = torch.cat([torch.ones(visual.shape[:1] + visual.shape[2:3], dtype=torch.bool), text_mask.bool()], dim=1)
+    return F.scaled_dot_product_attention(x, x, x, attn_mask=key_mask[:, None, None, :])[:, :, :visual.shape[2]]
+
+
+def make_video_batch(shapes):
+    return [
+        {
+            VIDEO: torch.randn(3, *shape),
+            PROMPT_IDS: torch.ones((1, 16), dtype=torch.long),
+            PROMPT_MASK: torch.ones((1, 16), dtype=torch.long),
+            PROMPT_IDS_2: None,
+            PROMPT_MASK_2: None,
+        }
+        for shape in shapes
+    ]
+
+
+def reference_pad_and_stack(tensors, thw):
+    # the padding of the collator before the preallocated batch, its NaN check is not part of the padding
+    padded = [F.pad(x, (0, thw[2] - x.shape[3], 0, thw[1] - x.shape[2], 0, thw[0] - x.shape[1])) for x in tensors]
+    return torch.stack(padded)
+
+
+class TestCollate:
+
+    def test_pad_and_stack(self):
+        tensors = [torch.randn(3, 5, 24, 32), torch.randn(3, 9, 16, 40), torch.randn(3, 1, 32, 8)]
+        judge_expression(torch.equal(pad_and_stack(tensors, (9, 32, 40)), reference_pad_and_stack(tensors, (9, 32, 40))))
+
+        collate = Collate(batch_size=2, max_height=64, max_width=64, num_frames=9)
+        outputs = collate(make_video_batch([(9, 48, 64), (5, 64, 32)]))
+        expected_mask = torch.zeros(2, 3, 8, 8)
+        expected_mask[0, :3, :6, :8] = 1
+        expected_mask[1, :2, :8, :4] = 1
+        judge_expression(outputs[VIDEO].shape == (2, 3, 9, 64, 64))
+        judge_expression(torch.equal(outputs[VIDEO_MASK], expected_mask))
+
+    def test_duplicated_sample_stats(self):
+        collate = Collate(batch_size=3, group_data=True, max_height=64, max_width=64, num_frames=9)
+        batches = [make_video_batch([(9, 48, 64), (5, 64, 32), (9, 48, 64)]) for _ in range(4)]
+        dataloader = torch.utils.data.DataLoader(batches, batch_size=None, num_workers=2, collate_fn=collate)
+        for outputs in dataloader:
+            # the sample of the minority shape is replaced by a duplicate
+            judge_expression(outputs[VIDEO].shape == (3, 3, 9, 48, 64))
+        # the duplicates of both workers are counted
+        judge_expression(get_data_stats(dataloader) == {"collate/duplicated_samples": 4})
+
+    def test_pad_text_to_batch_max(self):
+        for hidden_size in [None, 8]:
+            input_ids, cond_mask = make_text_batch([37, 120, 5], hidden_size)
+            trimmed_ids, trimmed_mask = pad_text_to_batch_max(input_ids, cond_mask, 32)
+            for ids, mask, trimmed, trimmed_m in zip(input_ids, cond_mask, trimmed_ids, trimmed_mask):
+                judge_expression(trimmed.shape[1] == 128 and trimmed_m.shape[1] == 128)
+                judge_expression(torch.equal(trimmed, ids[:, :128]) and torch.equal(trimmed_m, mask[:, :128]))
+
+        # samples shorter than the batch length are padded
+        input_ids, cond_mask = pad_text_to_batch_max([torch.ones((1, 10), dtype=torch.long)],
+                                                     [torch.ones((1, 10), dtype=torch.long)], 16)
+        judge_expression(input_ids[0].shape[1] == 16 and int(cond_mask[0].sum()) == 10)
+
+    def test_check_text_pad_multiple(self):
+        check_text_pad_multiple(None, 8, 2)
+        check_text_pad_multiple(32, 4, 2)
+        for text_pad_multiple in [12, 0, 16.0]:
+            with pytest.raises(ValueError):
+                check_text_pad_multiple(text_pad_multiple, 8, 1)
+
+    def test_joint_attention_trimmed_text(self):
+        # the visual tokens attend to the same keys, the trimmed text tokens are padding
+        _, cond_mask = make_text_batch([37, 120])
+        visual = torch.randn(2, 4, 64, 32)
+        text = torch.randn(2, 4, MODEL_MAX_LENGTH, 32)
+        _, trimmed_mask = pad_text_to_batch_max(list(text.unbind(0)), cond_mask, 32)
+        trimmed_mask = torch.cat(trimmed_mask)
+        expected = joint_attention(visual, text, torch.cat(cond_mask))
+        output = joint_attention(visual, text[:, :, :trimmed_mask.shape[1]], trimmed_mask)
+        judge_expression(trimmed_mask.shape[1] == 128 and torch.allclose(output, expected, atol=1e-5))
@@ -0,0 +1,54 @@
+import json
+import os
+
+import pandas as pd
+
+from mindspeed_mm.data.data_utils.utils import DataFileReader
+from tests.ut.utils import judge_expression
+
+
+def make_samples(num_samples, offset=0):
+    return [
+        {
+            "path": f"video_{offset + i}.mp4",
+            "cap": [f"caption {offset + i}"],
+            "fps": 24.0,
+            "num_frames": 100 + i,
+            "resolution": {"height": 480, "width": 640},
+            "cut": [i, 100 + i],
+            "aes": 5.0,
+            "unused": "x" * 64,
+        }
+        for i in range(num_samples)
+    ]
+
+
+class TestDataFileReader:
+
+    def test_get_cap_list(self, tmp_path):
+        lines, expected = [], []
+        for shard, (ext, num_samples) in enumerate([(".json", 3), (".jsonl", 5), (".json", 0), (".jsonl", 2)]):
+            samples = make_samples(num_samples, offset=10 * shard)
+            anno = str(tmp_path / f"anno_{shard}{ext}")
+            with open(anno, "w") as f:
+                if ext == ".json":
+                    json.dump(samples, f)
+                else:
+                    f.writelines(json.dumps(sample) + "\n" for sample in samples)
+            folder = str(tmp_path / f"folder_{shard}")
+            lines.append(f"{folder},{anno}\n")
+            expected += [dict(sample, path=os.path.join(folder, sample["path"])) for sample in samples]
+        data_path = str(tmp_path / "data.txt")
+        with open(data_path, "w") as f:
+            f.writelines(lines)
+
+        reader = DataFileReader(data_storage_mode="combine", num_workers=4, chunk_size=2)
+        cap_list = reader(data_path)
+        judge_expression(isinstance(cap_list, pd.DataFrame))
+        judge_expression("unused" not in cap_list.columns)
+        records = cap_list.to_dict("records")
+        judge_expression(len(records) == len(expected))
+        for record, sample in zip(records, expected):
+            sample.pop("unused")
+            judge_expression(record == sample)
+        judge_expression([shard[2:] for shard in reader.anno_shards] == [(0, 3), (3, 8), (8, 8), (8, 10)])
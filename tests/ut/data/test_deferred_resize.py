@@ -0,0 +1,69 @@
+import pytest
+import torch
+
+from mindspeed_mm.data.data_utils.constants import (
+    PROMPT_IDS, PROMPT_IDS_2, PROMPT_MASK, PROMPT_MASK_2, VIDEO, VIDEO_MASK, VIDEO_RESIZE
+)
+from mindspeed_mm.data.data_utils.transform_pipeline import (
+    DeferredResizeTransform,
+    get_deferred_resize,
+    get_transforms,
+)
+from mindspeed_mm.data.dataloader.collator import Collate
+from tests.ut.utils import judge_expression
+
+
+def make_pipeline(resize, deferred, uint8=False):
+    resize = {"trans_type": resize[0], "param": dict(resize[1], deferred=deferred)}
+    if uint8:
+        return {"video": [resize]}
+    return {"video": [{"trans_type": "ToTensorVideo"}, resize, {"trans_type": "ae_norm"}]}
+
+
+def collate(clips, train_pipeline, max_height, max_width):
+    # the dataset part: the worker transforms and the resize info of T2VDataset.get_resize_info
+    transforms = get_transforms(train_pipeline=train_pipeline)
+    deferred_resize = get_deferred_resize(transforms)
+    batch = []
+    for clip in clips:
+        video = transforms(clip)
+        resize_info = None
+        if deferred_resize is not None:
+            target_h, target_w = deferred_resize.get_target_size(*video.shape[-2:])
+            resize_info = torch.tensor([*video.shape[-2:], target_h, target_w])
+        batch.append({VIDEO: video.permute(1, 0, 2, 3), VIDEO_RESIZE: resize_info,
+                      PROMPT_IDS: torch.ones((1, 8), dtype=torch.long), PROMPT_MASK: torch.ones((1, 8), dtype=torch.long),
+                      PROMPT_IDS_2: None, PROMPT_MASK_2: None})
+    outputs = Collate(batch_size=len(clips), max_height=max_height, max_width=max_width, num_frames=9)(batch)
+    if VIDEO_RESIZE in outputs:
+        outputs[VIDEO] = DeferredResizeTransform(train_pipeline)(outputs[VIDEO], outputs.pop(VIDEO_RESIZE))
+    return outputs
+
+
+class TestDeferredResize:
+
+    @pytest.mark.parametrize("resize", [
+        ("CenterCropResizeVideo", {"size": [64, 96]}),
+        ("MaxHWResizeVideo", {"max_hxw": 64 * 96}),
+        ("LongSideResizeVideo", {"size": [64, 96]}),
+    ])
+    @pytest.mark.parametrize("uint8", [False, True])
+    def test_same_batch_as_worker_resize(self, resize, uint8):
+        clips = [torch.randint(0, 256, (9, 3, 90, 120), dtype=torch.uint8),
+                 torch.randint(0, 256, (9, 3, 90, 120), dtype=torch.uint8),
+                 torch.randint(0, 256, (5, 3, 72, 128), dtype=torch.uint8)]
+        expected = collate(clips, make_pipeline(resize, False, uint8), 96, 128)
+        outputs = collate(clips, make_pipeline(resize, True, uint8), 96, 128)
+        judge_expression(outputs[VIDEO].dtype == expected[VIDEO].dtype)
+        judge_expression(outputs[VIDEO].shape == expected[VIDEO].shape)
+        judge_expression(torch.equal(outputs[VIDEO_MASK], expected[VIDEO_MASK]))
+        # the uint8 interpolate of the worker and the float interpolate may round a pixel differently
+        atol = 1 if uint8 else 1e-5
+        judge_expression(torch.allclose(outputs[VIDEO].float(), expected[VIDEO].float(), atol=atol))
+
+    def test_post_transforms(self):
+        with pytest.raises(ValueError):
+            get_transforms(train_pipeline={"video": [
+                {"trans_type": "CenterCropResizeVideo", "param": {"size": [64, 96], "deferred": True}},
+                {"trans_type": "SpatialStrideCropVideo", "param": {"stride": 32}},
+            ]})
@@ -0,0 +1,40 @@
+import pytest
+import torch
+
+from mindspeed_mm.data.data_utils.utils import DevicePrefetcher, build_iterations
+from tests.ut.utils import judge_expression
+
+
+def make_batches(num_batches):
+    return [
+        {"video": torch.full((2, 3, 4), i, dtype=torch.float32), "prompt_ids": [torch.tensor([i])], "name": f"batch_{i}"}
+        for i in range(num_batches)
+    ]
+
+
+class TestDevicePrefetcher:
+
+    @pytest.mark.parametrize("num_prefetch", [1, 3])
+    def test_cpu_fallback(self, num_prefetch):
+        batches = make_batches(5)
+        prefetcher = DevicePrefetcher(iter(batches), device="cpu", num_prefetch=num_prefetch)
+        outputs = list(prefetcher)
+        judge_expression(len(outputs) == len(batches))
+        for output, batch in zip(outputs, batches):
+            judge_expression(torch.equal(output["video"], batch["video"]))
+            judge_expression(torch.equal(output["prompt_ids"][0], batch["prompt_ids"][0]))
+            judge_expression(output["name"] == batch["name"])
+
+    def test_build_iterations(self):
+        train_iterator, _, _ = build_iterations(train_dl=make_batches(2), device_prefetch=2)
+        judge_expression(isinstance(train_iterator, DevicePrefetcher))
+        values = [int(next(train_iterator)["video"][0, 0, 0]) for _ in range(5)]
+        judge_expression(values == [0, 1, 0, 1, 0])
+
+    @pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a device")
+    def test_device_copy(self):
+        batches = make_batches(4)
+        prefetcher = DevicePrefetcher(iter(batches), device=torch.cuda.current_device(), num_prefetch=2)
+        for output, batch in zip(prefetcher, batches):
+            judge_expression(output["video"].is_cuda)
+            judge_expression(torch.equal(output["video"].cpu(), batch["video"]))
@@ -0,0 +1,198 @@
+import copy
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import torch
+
+from mindspeed_mm.data.data_utils.data_transform import get_params, maxhwresize
+from mindspeed_mm.data.data_utils.utils import VideoProcesser, filter_resolution
+from tests.ut.utils import judge_expression
+
+
+def reference_define_frame_index(processer, cap_list):
+    """The per-sample filter loop of define_frame_index before it was vectorised, without the logs."""
+    counts = dict.fromkeys([
+        "no_cap", "no_resolution", "too_long", "too_short", "cnt_img_res_mismatch_stride",
+        "cnt_vid_res_mismatch_stride", "cnt_img_res_too_small", "cnt_vid_res_too_small", "cnt_img_aspect_mismatch",
+        "cnt_vid_aspect_mismatch", "cnt_filter_minority", "cnt_vid", "cnt_vid_after_filter", "cnt_img",
+        "cnt_img_after_filter",
+    ], 0)
+    new_cap_list, sample_size = [], []
+    file_type = lambda path: "vid" if path.endswith(".mp4") else "img"
+    for i in copy.deepcopy(cap_list):
+        path = i["path"]
+        counts[f"cnt_{file_type(path)}"] += 1
+        if i.get("cap", None) is None:
+            counts["no_cap"] += 1
+            continue
+        resolution = i.get("resolution", None)
+        if resolution is None or resolution.get("height", None) is None or resolution.get("width", None) is None:
+            counts["no_resolution"] += 1
+            continue
+        height, width = resolution["height"], resolution["width"]
+        if not processer.force_resolution:
+            if height <= 0 or width <= 0:
+                counts["no_resolution"] += 1
+                continue
+            tr_h, tr_w = maxhwresize(height, width, processer.max_hxw, force_5_ratio=processer.force_5_ratio)
+            _, _, sample_h, sample_w = get_params(tr_h, tr_w, processer.hw_stride,
+                                                  force_5_ratio=processer.force_5_ratio)
+            if sample_h <= 0 or sample_w <= 0:
+                counts[f"cnt_{file_type(path)}_res_mismatch_stride"] += 1
+                continue
+            if sample_h * sample_w < processer.min_hxw:
+                counts[f"cnt_{file_type(path)}_res_too_small"] += 1
+                continue
+            height, width = sample_h, sample_w
+        else:
+            sample_h, sample_w = processer.max_height, processer.max_width
+        if not filter_resolution(height, width, max_h_div_w_ratio=processer.max_h_div_w_ratio,
+                                 min_h_div_w_ratio=processer.min_h_div_w_ratio):
+            counts[f"cnt_{file_type(path)}_aspect_mismatch"] += 1
+            continue
+
+        if path.endswith(".mp4"):
+            fps = i.get("fps", 24)
+            if i["num_frames"] > processer.too_long_factor * (
+                    processer.num_frames * fps / processer.train_fps * processer.speed_factor):
+                counts["too_long"] += 1
+                continue
+            frame_interval = 1.0 if abs(fps - processer.train_fps) < 0.1 else fps / processer.train_fps
+            start_frame_idx = i.get("cut", [0])[0]
+            i["start_frame_idx"] = start_frame_idx
+            frame_indices = np.arange(start_frame_idx, start_frame_idx + i["num_frames"], frame_interval).astype(int)
+            frame_indices = frame_indices[frame_indices < start_frame_idx + i["num_frames"]]
+            if (
+                len(frame_indices) < processer.num_frames
+                and torch.rand(1, generator=processer.generator).item() < processer.drop_short_ratio
+            ):
+                counts["too_short"] += 1
+                continue
+            if len(frame_indices) > processer.num_frames:
+                begin_index, end_index = processer.temporal_sample(len(frame_indices))
+                frame_indices = frame_indices[begin_index:end_index]
+            end_frame_idx = processer.find_closest_y(
+                len(frame_indices), vae_stride_t=processer.ae_stride_t, model_ds_t=processer.sp_size)
+            if end_frame_idx == -1:
+                counts["too_short"] += 1
+                continue
+            i["sample_num_frames"] = len(frame_indices[:end_frame_idx])
+            counts["cnt_vid_after_filter"] += 1
+        else:
+            i["start_frame_idx"] = 0
+            i["sample_num_frames"] = 1
+            counts["cnt_img_after_filter"] += 1
+        new_cap_list.append(i)
+        sample_size.append(f"{i['sample_num_frames']}x{sample_h}x{sample_w}")
+
+    filter_major_num = 4 * processer.batch_size * processer.gradient_accumulation_size
+    size_counts = pd.Series(sample_size).value_counts()
+    keep = [idx for idx, shape in enumerate(sample_size) if size_counts[shape] >= filter_major_num]
+    counts["cnt_filter_minority"] = len(sample_size) - len(keep)
+    new_cap_list = [new_cap_list[idx] for idx in keep]
+    sample_size = [sample_size[idx] for idx in keep]
+    shape_idx_dict = {}
+    for idx, shape in enumerate(sample_size):
+        shape_idx_dict.setdefault(shape, []).append(idx)
+    return new_cap_list, sample_size, shape_idx_dict, counts
+
+
+def make_annotations(num_samples, seed=0):
+    """Videos and images with missing captions, resolutions and fps, odd aspects and too long or short videos."""
+    rng = random.Random(seed)
+    resolutions = [(480, 640), (720, 1280), (1080, 1920), (640, 480), (256, 256), (100, 2000), (0, 640), (360, 640)]
+    samples = []
+    for idx in range(num_samples):
+        is_video = rng.random() < 0.7
+        sample = {"path": f"{'video' if is_video else 'image'}_{idx}.{'mp4' if is_video else 'jpg'}"}
+        if rng.random() > 0.05:
+            sample["cap"] = [f"caption {idx}"]
+        if rng.random() > 0.05:
+            height, width = rng.choice(resolutions)
+            sample["resolution"] = {"height": height, "width": width if rng.random() > 0.02 else None}
+        if is_video:
+            num_frames = rng.randint(10, 900)
+            sample["num_frames"] = num_frames
+            if rng.random() > 0.1:
+                sample["fps"] = rng.choice([24, 25, 29.97, 30, 50, 60, 120])
+            if rng.random() > 0.2:
+                start = rng.randint(0, 300)
+                sample["cut"] = [start, start + num_frames]
+        samples.append(sample)
+    return samples
+
+
+def build_processer(**kwargs):
+    return VideoProcesser(
+        num_frames=93, data_storage_mode="combine", drop_short_ratio=0.5, max_height=480, max_width=640,
+        batch_size=2, seed=1234, **kwargs,
+    )
+
+
+class TestFrameIndex:
+
+    def test_same_samples_as_per_sample_filter(self):
+        cap_list = make_annotations(3000)
+        for kwargs in [{}, {"force_resolution": False, "max_hxw": 480 * 640, "min_hxw": 480 * 640 // 4}]:
+            processer = build_processer(**kwargs)
+            samples, sample_size, shape_idx_dict = processer.define_frame_index(cap_list)
+            expected, expected_sample_size, expected_shape_idx_dict, expected_counts = reference_define_frame_index(
+                build_processer(**kwargs), cap_list)
+
+            judge_expression(len(expected) > 0 and expected_counts["cnt_filter_minority"] > 0)
+            judge_expression(samples["path"].tolist() == [sample["path"] for sample in expected])
+            judge_expression(samples["start_frame_idx"].tolist() == [sample["start_frame_idx"] for sample in expected])
+            judge_expression(samples["sample_num_frames"].tolist() ==
+                             [sample["sample_num_frames"] for sample in expected])
+            judge_expression(list(sample_size) == expected_sample_size)
+            judge_expression({shape: indices.tolist() for shape, indices in shape_idx_dict.items()} ==
+                             expected_shape_idx_dict)
+            judge_expression(processer.filter_counts == expected_counts)
+
+    def test_cache_invalidation(self, tmp_path):
+        anno = os.path.join(tmp_path, "anno.json")
+        with open(anno, "w") as f:
+            json.dump(make_annotations(200), f)
+        samples = pd.read_json(anno)
+        cache_dir = os.path.join(tmp_path, "index_cache")
+        processer = build_processer()
+        built = []
+        build_frame_index = processer.build_frame_index
+        processer.build_frame_index = lambda samples: built.append(len(samples)) or build_frame_index(samples)
+
+        def get_frame_index():
+            return processer.get_frame_index(samples, str(tmp_path), anno, cache_dir)
+
+        frame_index = get_frame_index()
+        cached = get_frame_index()
+        judge_expression(built == [200])
+        judge_expression(all(np.array_equal(frame_index[key], cached[key]) for key in frame_index))
+        judge_expression(not any(name.endswith(".tmp.npz") for name in os.listdir(cache_dir)))
+
+        # a filter parameter changes
+        processer.max_h_div_w_ratio = 1.0
+        get_frame_index()
+        judge_expression(len(built) == 2)
+        processer.max_h_div_w_ratio = 2.0
+        get_frame_index()
+        judge_expression(len(built) == 2)
+
+        # the annotation file is touched, then rewritten with more samples
+        stat = os.stat(anno)
+        os.utime(anno, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        get_frame_index()
+        judge_expression(len(built) == 3)
+        with open(anno, "w") as f:
+            json.dump(make_annotations(250), f)
+        samples = pd.read_json(anno)
+        judge_expression(len(get_frame_index()["reason"]) == 250 and built == [200, 200, 200, 250])
+
+    def test_center_temporal_crop(self):
+        # the features are extracted with the same window of a long clip every time
+        processer = build_processer(temporal_crop="center")
+        judge_expression(len({processer.temporal_sample(300) for _ in range(10)}) == 1)
+        judge_expression(processer.temporal_sample(300) == (103, 196))
+        judge_expression(processer.temporal_sample(50) == (0, 50))
@@ -0,0 +1,82 @@
+import itertools
+
+from mindspeed_mm.data.dataloader.sampler import FeistelPermutation, LengthGroupedSampler
+from tests.ut.utils import judge_expression
+
+
+LENGTHS = ["1x480x640"] * 45 + ["29x480x640"] * 30 + ["93x480x640"] * 21 + ["1x640x480"] * 8
+
+
+def get_steps(lengths, world_size, batch_size, group_data, initial_global_step=0):
+    # the batches of every rank at every step, as the dataloaders of the ranks batch them
+    samplers = [
+        LengthGroupedSampler(batch_size, world_size, num_replicas=world_size, rank=rank, lengths=lengths,
+                             group_data=group_data, initial_global_step=initial_global_step)
+        for rank in range(world_size)
+    ]
+    rank_batches = []
+    for sampler in samplers:
+        length = len(sampler)
+        indices = list(sampler)
+        judge_expression(len(indices) == length)
+        rank_batches.append([indices[i: i + batch_size] for i in range(0, len(indices), batch_size)])
+    return [list(itertools.chain(*step)) for step in zip(*rank_batches)], rank_batches
+
+
+class TestLengthGroupedSampler:
+
+    def test_feistel_permutation(self):
+        for n in [1, 2, 7, 100, 1025]:
+            perm = FeistelPermutation(n, seed=3)
+            judge_expression(sorted(perm[i] for i in range(n)) == list(range(n)))
+        judge_expression([FeistelPermutation(100, 0)[i] for i in range(100)] !=
+                         [FeistelPermutation(100, 1)[i] for i in range(100)])
+
+    def test_same_order_across_world_sizes(self):
+        reference, _ = get_steps(LENGTHS, 1, 8, group_data=False)
+        # every sample once, the last step is completed with samples of the first positions
+        judge_expression(set(itertools.chain(*reference)) == set(range(len(LENGTHS))))
+        for world_size, batch_size in [(2, 4), (4, 2), (8, 1)]:
+            steps, _ = get_steps(LENGTHS, world_size, batch_size, group_data=False)
+            judge_expression(steps == reference)
+
+    def test_shape_grouped_batches(self):
+        lengths = LENGTHS + ["29x352x640"] * 3
+        shape_idx_dict = {}
+        for idx, item in enumerate(lengths):
+            shape_idx_dict.setdefault(item, []).append(idx)
+        for batch_size in [1, 4, 5]:
+            _, rank_batches = get_steps(lengths, 4, batch_size, group_data=True)
+            for batches in rank_batches:
+                for batch in batches:
+                    judge_expression(len(set(lengths[i] for i in batch)) == 1)
+            indices = list(itertools.chain(*itertools.chain(*rank_batches)))
+            judge_expression(set(indices) == set(range(len(lengths))))
+
+            sampler = LengthGroupedSampler(batch_size, 4, num_replicas=4, rank=0, lengths=lengths, group_data=True,
+                                           shape_idx_dict=shape_idx_dict)
+            judge_expression(list(sampler) == list(itertools.chain(*rank_batches[0])))
+            padded = sum(-len(group) % batch_size for group in shape_idx_dict.values())
+            judge_expression(sampler.stats["padded_samples"] == padded)
+            judge_expression(len(indices) == len(lengths) + padded + sampler.stats["repeated_samples"])
+
+    def test_resume(self):
+        for group_data in [False, True]:
+            steps, _ = get_steps(LENGTHS, 4, 2, group_data)
+            resumed, _ = get_steps(LENGTHS, 4, 2, group_data, initial_global_step=5)
+            judge_expression(resumed == steps[5:])
+            # random access to any step of any rank
+            sampler = LengthGroupedSampler(2, 4, num_replicas=4, rank=0, lengths=LENGTHS, group_data=group_data)
+            judge_expression(sampler.get_batch(9, rank=3) == steps[9][6:])
+
+    def test_epoch_advances(self):
+        for group_data in [False, True]:
+            sampler = LengthGroupedSampler(2, 4, num_replicas=4, rank=0, lengths=LENGTHS, group_data=group_data)
+            first, second = list(sampler), list(sampler)
+            judge_expression(sampler.epoch == 2 and first != second and len(first) == len(second))
+            sampler.set_epoch(0)
+            judge_expression(list(sampler) == first)
+        # the first epoch of a resumed run advances too
+        resumed = LengthGroupedSampler(2, 4, num_replicas=4, rank=0, lengths=LENGTHS, initial_global_step=5)
+        list(resumed)
+        judge_expression(resumed.epoch == 1)
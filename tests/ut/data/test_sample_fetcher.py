@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+import torch
+
+from mindspeed_mm.data.data_utils.sample_fetcher import SampleFetcher
+from mindspeed_mm.data.data_utils.utils import get_data_stats
+from tests.ut.utils import judge_expression
+
+
+class FetcherDataset(torch.utils.data.Dataset):
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.sample_fetcher = SampleFetcher(lambda index: index, fallback_fn=lambda index: index + 1)
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        return self.sample_fetcher(index)
+
+
+class TestSampleFetcher:
+
+    def test_retry_and_blacklist(self, tmp_path):
+        bad_sample_file = str(tmp_path / "bad_samples.txt")
+        release = threading.Event()
+        transient_failures = [1]
+        calls = []
+
+        def fetch_fn(index):
+            calls.append(index)
+            if index == 1:
+                # a broken file, blacklisted at the first failure
+                raise IndexError("video has 10 frames, but need to sample 33 frames")
+            if index == 2:
+                release.wait()
+            if index == 4 and transient_failures:
+                transient_failures.pop()
+                raise OSError("storage timeout")
+            return index * 10
+
+        fetcher = SampleFetcher(fetch_fn, fallback_fn=lambda index: index + 1, num_threads=1, timeout=0.2,
+                                max_failures=2, bad_sample_file=bad_sample_file)
+        judge_expression(fetcher(0) == 0)
+        judge_expression(fetcher(1) == 30)
+        # the stalled thread is abandoned and the next fetches go to a new pool, the second timeout blacklists it
+        judge_expression(fetcher(2) == 30)
+        judge_expression(fetcher(3) == 30)
+        # a transient error replaces the sample, but does not blacklist it
+        judge_expression(fetcher(4) == 50)
+        judge_expression(fetcher(4) == 40)
+        release.set()
+        judge_expression(fetcher.stats["errors"] == 2 and fetcher.stats["timeouts"] == 2)
+        judge_expression(fetcher.stats["blacklisted"] == 2)
+
+        with open(bad_sample_file) as f:
+            judge_expression(f.read().split() == ["1", "2"])
+
+        # the bad samples are skipped by a new fetcher, e.g. in the next epoch
+        calls.clear()
+        new_fetcher = SampleFetcher(fetch_fn, fallback_fn=lambda index: index + 1, timeout=0.2,
+                                    bad_sample_file=bad_sample_file)
+        judge_expression(new_fetcher(1) == 30)
+        judge_expression(calls == [3] and new_fetcher.stats["skipped"] == 2)
+
+    def test_bounded_retries(self):
+        def fetch_fn(index):
+            raise ValueError("broken file")
+
+        fetcher = SampleFetcher(fetch_fn, fallback_fn=lambda index: index + 1, max_retries=3)
+        with pytest.raises(RuntimeError):
+            fetcher(0)
+        judge_expression(fetcher.stats["errors"] == 4 and fetcher.stats["retries"] == 3)
+        judge_expression(fetcher.stats["blacklisted"] == 0)
+
+    def test_worker_stats(self):
+        dataset = FetcherDataset(12)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=3, num_workers=2)
+        judge_expression(sorted(torch.cat(list(dataloader)).tolist()) == list(range(12)))
+        # the fetches of the workers are counted in the main process
+        judge_expression(dataset.sample_fetcher.stats["fetched"] == 12)
+        judge_expression(get_data_stats(dataloader)["fetch/fetched"] == 12)
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from mindspeed_mm.data.data_utils.sample_table import SampleTable
+from mindspeed_mm.data.datasets.t2v_dataset import T2VDataset
+from tests.ut.utils import judge_expression
+
+
+def make_samples(num_samples):
+    return pd.DataFrame({
+        "path": [f"video_{i}.mp4" for i in range(num_samples)],
+        "cap": [[f"caption {i}"] for i in range(num_samples)],
+        "start_frame_idx": [i for i in range(num_samples)],
+        "sample_num_frames": [29 if i % 3 else 93 for i in range(num_samples)],
+        "sample_height": [480] * num_samples,
+        "sample_width": [640 if i % 2 else 320 for i in range(num_samples)],
+        "fps": [24.0] * num_samples,
+    })
+
+
+def get_sample_sizes(sample_table):
+    sample_size, shape_idx_dict = sample_table.get_sample_sizes()
+    return list(sample_size), {shape: indices.tolist() for shape, indices in shape_idx_dict.items()}
+
+
+def build_shared_table(rank, world_size, init_file, sample_table_dir, scope, results):
+    os.environ["LOCAL_WORLD_SIZE"] = "2"
+    torch.distributed.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size)
+    table_dir, is_builder = T2VDataset.get_sample_table_dir(sample_table_dir, scope)
+    # only the builders have the samples
+    samples = make_samples(12) if is_builder else None
+    sample_table = T2VDataset.build_sample_table(samples, table_dir, is_builder)
+    results[rank] = (table_dir, is_builder, sample_table.checksum(), get_sample_sizes(sample_table))
+    torch.distributed.destroy_process_group()
+
+
+class TestSampleTable:
+
+    def test_sample_sizes(self):
+        sample_table = SampleTable.from_dataframe(make_samples(6))
+        sample_size, shape_idx_dict = get_sample_sizes(sample_table)
+        judge_expression(sample_size == ["93x480x320", "29x480x640", "29x480x320", "93x480x640", "29x480x320",
+                                         "29x480x640"])
+        judge_expression(shape_idx_dict == {"29x480x320": [2, 4], "29x480x640": [1, 5], "93x480x320": [0],
+                                            "93x480x640": [3]})
+        judge_expression(sample_table.checksum() == SampleTable.from_dataframe(make_samples(6)).checksum())
+        judge_expression(sample_table.checksum() != SampleTable.from_dataframe(make_samples(7)).checksum())
+
+    def test_save_load(self, tmp_path):
+        table_dir = str(tmp_path / "table")
+        samples = make_samples(6)
+        samples["crop"] = [[0, 0, 8, 8]] * 6
+        SampleTable.from_dataframe(samples).save(table_dir)
+        # the table is rebuilt without crop, the crop.npy of the old table is left in the directory
+        sample_table = SampleTable.from_dataframe(make_samples(5))
+        sample_table.save(table_dir)
+        loaded = SampleTable.load(table_dir)
+        judge_expression(os.path.exists(os.path.join(table_dir, "crop.npy")) and not loaded.has_crop)
+        judge_expression(len(loaded) == 5 and loaded.checksum() == sample_table.checksum())
+        # the memory-mapped columns are hashed in chunks
+        judge_expression(loaded.checksum(chunk_size=7) == sample_table.checksum())
+        judge_expression([loaded[i] for i in range(5)] == [sample_table[i] for i in range(5)])
+
+        # a column that does not match the manifest is not loaded
+        np.save(os.path.join(table_dir, "fps.npy"), np.zeros(4))
+        with pytest.raises(ValueError):
+            SampleTable.load(table_dir)
+
+    def test_shared_table(self, tmp_path):
+        world_size = 4
+        context = multiprocessing.get_context("fork")
+        for scope, num_tables in [("global", 1), ("node", 2)]:
+            results = context.Manager().dict()
+            processes = [
+                context.Process(target=build_shared_table, args=(
+                    rank, world_size, str(tmp_path / f"init_{scope}"), str(tmp_path / "tables"), scope, results))
+                for rank in range(world_size)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            judge_expression(all(process.exitcode == 0 for process in processes))
+            judge_expression(len(set(result[0] for result in results.values())) == num_tables)
+            judge_expression(sum(result[1] for result in results.values()) == num_tables)
+            judge_expression(len(set(result[2] for result in results.values())) == 1)
+            judge_expression(results[world_size - 1][3] == get_sample_sizes(SampleTable.from_dataframe(make_samples(12))))
@@ -0,0 +1,47 @@
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import PreTrainedTokenizerFast
+
+from mindspeed_mm.data.data_utils.token_store import TokenStore
+from mindspeed_mm.data.data_utils.utils import TextProcesser
+from tests.ut.utils import judge_expression
+
+
+CAPTIONS = [
+    "A <b>cat</b> sits on the sofa, photo from https://example.com/cat.jpg",
+    "the dog runs along the beach at sunset",
+    "@someone a red car drives down the street #car",
+    "the cat and the dog play in the garden " * 40,
+]
+
+
+def build_tokenizer(model_max_length):
+    words = sorted({word for caption in CAPTIONS for word in caption.lower().split()})
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2}
+    vocab.update({word: i + 3 for i, word in enumerate(words)})
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single="$A </s>", special_tokens=[("</s>", 1)])
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>", unk_token="<unk>",
+        model_max_length=model_max_length,
+    )
+
+
+class TestTokenStore:
+
+    def test_same_tokens_as_tokenizer(self, tmp_path):
+        text_processer = TextProcesser(model_max_length=64, tokenizer=build_tokenizer(64),
+                                       tokenizer_2=build_tokenizer(16), cfg=0.0)
+        TokenStore.build(CAPTIONS, text_processer).save(str(tmp_path))
+        stored_processer = TextProcesser(model_max_length=64, tokenizer=text_processer.tokenizer,
+                                         tokenizer_2=text_processer.tokenizer_2, cfg=0.0,
+                                         token_store=TokenStore.load(str(tmp_path)))
+        for caption in CAPTIONS + ["a caption not in the store"]:
+            for expected, output in zip(text_processer([caption]), stored_processer([caption])):
+                judge_expression(torch.equal(expected, output))
+
+        stored_processer.cfg = 1.0
+        text_processer.enable_text_preprocessing = False
+        for expected, output in zip(text_processer([""]), stored_processer([CAPTIONS[0]])):
+            judge_expression(torch.equal(expected, output))
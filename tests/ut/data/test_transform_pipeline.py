@@ -0,0 +1,30 @@
+import torch
+
+from mindspeed_mm.data.data_utils.transform_pipeline import get_cached_transforms, get_transforms
+from tests.ut.utils import judge_expression
+
+
+TRAIN_PIPELINE = {
+    "video": [
+        {"trans_type": "ToTensorVideo"},
+        {
+            "trans_type": "CenterCropResizeVideo",
+            "param": {"size": [64, 64], "top_crop": False}
+        },
+        {"trans_type": "ae_norm"}
+    ]
+}
+
+
+class TestTransformPipeline:
+
+    def test_cached_transforms_are_shared(self):
+        transforms = get_cached_transforms(is_video=True, train_pipeline=TRAIN_PIPELINE)
+        judge_expression(transforms is get_cached_transforms(is_video=True, train_pipeline=TRAIN_PIPELINE))
+        judge_expression(transforms is not get_cached_transforms(
+            is_video=True, train_pipeline=TRAIN_PIPELINE, image_size=(64, 64)))
+        judge_expression(get_cached_transforms(is_video=True, train_pipeline=None) is None)
+
+        video = torch.randint(0, 256, (4, 3, 72, 96), dtype=torch.uint8)
+        expected = get_transforms(is_video=True, train_pipeline=TRAIN_PIPELINE)(video)
+        judge_expression(torch.equal(transforms(video), expected))
@@ -0,0 +1,67 @@
+import pytest
+import torch
+
+from mindspeed_mm.data.data_utils.constants import (
+    PROMPT_IDS, PROMPT_IDS_2, PROMPT_MASK, PROMPT_MASK_2, VIDEO, VIDEO_MASK
+)
+from mindspeed_mm.data.data_utils.transform_pipeline import (
+    DeferredResizeTransform, Uint8NormTransform, get_transforms
+)
+from mindspeed_mm.data.dataloader.collator import Collate
+from tests.ut.utils import judge_expression
+
+
+RESIZE = {"trans_type": "CenterCropResizeVideo", "param": {"size": [64, 96]}}
+AE_NORM_PIPELINE = {"video": [{"trans_type": "ToTensorVideo"}, RESIZE, {"trans_type": "ae_norm"}]}
+NORM_FUN_PIPELINE = {"video": [
+    {"trans_type": "ToTensorVideo"}, RESIZE,
+    {"trans_type": "norm_fun", "param": {"mean": [0.485, 0.456, 0.406], "std": [0.229, 0.224, 0.225]}},
+]}
+
+
+def collate(clips):
+    batch = [
+        {VIDEO: clip.permute(1, 0, 2, 3), PROMPT_IDS: torch.ones((1, 8), dtype=torch.long),
+         PROMPT_MASK: torch.ones((1, 8), dtype=torch.long), PROMPT_IDS_2: None, PROMPT_MASK_2: None}
+        for clip in clips
+    ]
+    return Collate(batch_size=len(clips), max_height=64, max_width=96, num_frames=9)(batch)
+
+
+class TestUint8Transport:
+
+    def test_same_video_as_float_pipeline(self):
+        clips = [torch.randint(0, 256, (9, 3, 90, 120), dtype=torch.uint8),
+                 torch.randint(0, 256, (5, 3, 90, 120), dtype=torch.uint8)]
+        for float_pipeline, max_std in [(AE_NORM_PIPELINE, 0.5), (NORM_FUN_PIPELINE, 0.225)]:
+            uint8_pipeline = {**float_pipeline, "uint8_transport": True}
+            float_batch = collate([get_transforms(train_pipeline=float_pipeline)(clip) for clip in clips])
+            uint8_batch = collate([get_transforms(train_pipeline=uint8_pipeline)(clip) for clip in clips])
+
+            judge_expression(uint8_batch[VIDEO].dtype == torch.uint8)
+            judge_expression(uint8_batch[VIDEO].nbytes * 4 == float_batch[VIDEO].nbytes)
+            judge_expression(torch.equal(uint8_batch[VIDEO_MASK], float_batch[VIDEO_MASK]))
+            # the normalisation is the one of the pipeline, the uint8 resize rounds to the closest pixel value
+            video = Uint8NormTransform(uint8_pipeline)(uint8_batch[VIDEO], uint8_batch[VIDEO_MASK])
+            judge_expression(video.dtype == torch.float32)
+            judge_expression(torch.allclose(video, float_batch[VIDEO], atol=1.01 / 255 / max_std))
+            # the padded frames of the short clip are zero, as in the float pipeline
+            judge_expression(torch.equal(video[1, :, 5:], float_batch[VIDEO][1, :, 5:]))
+            judge_expression(not video[1, :, 5:].any())
+
+    def test_float_pipeline_is_unchanged(self):
+        clip = torch.randint(0, 256, (5, 3, 90, 120), dtype=torch.uint8)
+        judge_expression(get_transforms(train_pipeline=AE_NORM_PIPELINE)(clip).is_floating_point())
+        # the uint8 transport is an explicit option of the pipeline
+        with pytest.raises(ValueError):
+            Uint8NormTransform(AE_NORM_PIPELINE)
+
+    def test_deferred_resize(self):
+        resize = {"trans_type": "CenterCropResizeVideo", "param": {"size": [64, 96], "deferred": True}}
+        train_pipeline = {"video": [{"trans_type": "ToTensorVideo"}, resize, {"trans_type": "ae_norm"}],
+                          "uint8_transport": True}
+        # the workers only crop, the value transforms run after the deferred resize
+        transforms = get_transforms(train_pipeline=train_pipeline)
+        judge_expression([type(t).__name__ for t in transforms.transforms] == ["CenterCropResizeVideo"])
+        post_transforms = DeferredResizeTransform(train_pipeline).post_transforms
+        judge_expression([type(t).__name__ for t in post_transforms] == ["ToTensorVideo", "AENorm"])
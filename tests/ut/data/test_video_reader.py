@@ -0,0 +1,80 @@
+import os
+
+import av
+import numpy as np
+import pytest
+
+from mindspeed_mm.data.data_utils.utils import VideoReader
+from tests.ut.utils import judge_expression
+
+
+NUM_FRAMES = 240
+FPS = 24
+
+
+def write_synthetic_video(path, num_frames=NUM_FRAMES, fps=FPS, height=128, width=160, gop_size=48):
+    container = av.open(path, mode="w")
+    stream = container.add_stream("mpeg4", rate=fps)
+    stream.height, stream.width, stream.pix_fmt = height, width, "yuv420p"
+    stream.codec_context.gop_size = gop_size
+    for frame_idx in range(num_frames):
+        image = np.full((height, width, 3), frame_idx, dtype=np.uint8)
+        image[:, frame_idx % width] = 255
+        for packet in stream.encode(av.VideoFrame.from_ndarray(image, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+@pytest.fixture(scope="module")
+def video_paths(tmp_path_factory):
+    root = tmp_path_factory.mktemp("videos")
+    paths = [os.path.join(root, f"video_{i}.mp4") for i in range(2)]
+    for path in paths:
+        write_synthetic_video(path)
+    return paths
+
+
+def decode_all_frames(path):
+    with av.open(path) as container:
+        return np.stack([frame.to_ndarray(format="rgb24") for frame in container.decode(video=0)])
+
+
+class TestVideoReader:
+
+    @pytest.mark.parametrize("video_reader_type", ["torchvision", "decoder"])
+    def test_frame_range(self, video_paths, video_reader_type):
+        expected = decode_all_frames(video_paths[0]).astype(int)
+        video_reader = VideoReader(video_reader_type=video_reader_type)
+        vframes, info, _ = video_reader(video_paths[0])
+        judge_expression(vframes.get_num_frames() == NUM_FRAMES)
+        judge_expression(abs(info["video_fps"] - FPS) < 0.1)
+        judge_expression((vframes.get_height(), vframes.get_width()) == (128, 160))
+        for frame_indices in [np.arange(100, 133, 2), np.arange(0, 17), np.arange(200, 240)]:
+            video = vframes.get_batch(frame_indices)
+            judge_expression(tuple(video.shape) == (len(frame_indices), 128, 160, 3))
+            judge_expression(np.abs(video.numpy().astype(int) - expected[frame_indices]).max() <= 2)
+        judge_expression(vframes.get_batch([NUM_FRAMES + 10]) is None)
+
+    def test_decoder_cache(self, video_paths):
+        video_reader = VideoReader(video_reader_type="torchvision", decoder_cache_size=1)
+        vframes, _, _ = video_reader(video_paths[0])
+        video_reader.release(video_paths[0], vframes)
+        judge_expression(video_reader(video_paths[0])[0] is vframes)
+        # a handle taken out of the cache is not shared
+        judge_expression(video_reader(video_paths[0])[0] is not vframes)
+        video_reader.release(video_paths[0], vframes)
+        other, _, _ = video_reader(video_paths[1])
+        video_reader.release(video_paths[1], other)
+        judge_expression(list(video_reader.decoder_cache) == [video_paths[1]])
+
+    def test_release_closes_uncached_handles(self, video_paths):
+        closed = []
+        for decoder_cache_size in [0, 1]:
+            video_reader = VideoReader(video_reader_type="torchvision", decoder_cache_size=decoder_cache_size)
+            vframes, _, _ = video_reader(video_paths[0])
+            vframes.close = lambda vframes=vframes: closed.append(vframes)
+            video_reader.release(video_paths[0], vframes)
+            judge_expression((vframes in closed) == (decoder_cache_size == 0))
+            judge_expression(len(video_reader.decoder_cache) == decoder_cache_size)
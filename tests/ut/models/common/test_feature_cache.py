@@ -0,0 +1,153 @@
+import math
+import time
+
+import torch
+from torch import nn
+import mindspeed.megatron_adaptor
+
+from mindspeed_mm.models.common.feature_cache import DenoisingFeatureCache
+from mindspeed_mm.models.predictor.dits.sparseu_mmdit import SparseUMMDiT
+from tests.ut.utils import judge_expression
+
+
+def timestep_embedding(timestep, dim):
+    # the smooth embedding of a trained model, the frequencies are low enough that adjacent steps are close
+    freqs = torch.exp(math.log(10) * torch.arange(dim // 2) / (dim // 2))
+    args = timestep[:, None].float() / 1000 * freqs[None]
+    return torch.cat([torch.cos(args), torch.sin(args)], dim=-1)
+
+
+class ToyBlock(nn.Module):
+
+    def __init__(self, dim):
+        super().__init__()
+        self.modulation = nn.Linear(dim, 2 * dim)
+        self.ff = nn.Sequential(nn.Linear(dim, 4 * dim), nn.GELU(), nn.Linear(4 * dim, dim))
+        self.ff_enc = nn.Linear(dim, dim)
+
+    def forward(self, hidden_states, encoder_hidden_states, embedded_timestep):
+        scale, gate = self.modulation(embedded_timestep)[None].chunk(2, dim=-1)
+        context = encoder_hidden_states.mean(dim=0, keepdim=True)
+        hidden_states = hidden_states + torch.tanh(gate) * self.ff((hidden_states + context) * (1 + scale))
+        encoder_hidden_states = encoder_hidden_states + 0.1 * self.ff_enc(encoder_hidden_states)
+        return hidden_states, encoder_hidden_states
+
+
+class ToySparseUMMDiT(nn.Module):
+    """The enc, mid and dec stages of SparseUMMDiT with skip connections, small enough to sample on CPU."""
+
+    def __init__(self, dim=64, num_layers=(2, 4, 2), feature_cache=None):
+        super().__init__()
+        self.dim = dim
+        self.time_embed = nn.Sequential(nn.Linear(dim, dim), nn.SiLU(), nn.Linear(dim, dim))
+        self.blocks = nn.ModuleList([nn.ModuleList([ToyBlock(dim) for _ in range(n)]) for n in num_layers])
+        self.skip_linear = nn.Linear(2 * dim, dim)
+        self.proj_out = nn.Linear(dim, dim)
+        self.feature_cache = DenoisingFeatureCache(**feature_cache) if feature_cache else None
+        self.block_calls = 0
+
+    def run_blocks(self, blocks, hidden_states, encoder_hidden_states, embedded_timestep):
+        for block in blocks:
+            self.block_calls += 1
+            hidden_states, encoder_hidden_states = block(hidden_states, encoder_hidden_states, embedded_timestep)
+        return hidden_states, encoder_hidden_states
+
+    def _operate_on_enc(self, hidden_states, encoder_hidden_states, embedded_timestep, *args):
+        hidden_states, encoder_hidden_states = self.run_blocks(
+            self.blocks[0], hidden_states, encoder_hidden_states, embedded_timestep)
+        return hidden_states, encoder_hidden_states, [[hidden_states, encoder_hidden_states]]
+
+    def _operate_on_mid(self, hidden_states, encoder_hidden_states, embedded_timestep, *args):
+        return self.run_blocks(self.blocks[1], hidden_states, encoder_hidden_states, embedded_timestep)
+
+    def _operate_on_dec(self, hidden_states, skip_connections, encoder_hidden_states, embedded_timestep, *args):
+        skip_hidden_states, _ = skip_connections.pop()
+        hidden_states = self.skip_linear(torch.cat([hidden_states, skip_hidden_states], dim=-1))
+        return self.run_blocks(self.blocks[2], hidden_states, encoder_hidden_states, embedded_timestep)
+
+    def forward(self, latents, timestep, encoder_hidden_states):
+        embedded_timestep = self.time_embed(timestep_embedding(timestep, self.dim))
+        stage_args = (embedded_timestep, None, None, None, None)
+        if self.feature_cache is not None:
+            self.feature_cache.step(embedded_timestep, shape=(latents.shape, encoder_hidden_states.shape))
+            hidden_states, _ = SparseUMMDiT._operate_on_cached_stages(
+                self, latents, encoder_hidden_states, *stage_args)
+        else:
+            hidden_states, encoder_hidden_states, skip_connections = self._operate_on_enc(
+                latents, encoder_hidden_states, *stage_args)
+            hidden_states, encoder_hidden_states = self._operate_on_mid(
+                hidden_states, encoder_hidden_states, *stage_args)
+            hidden_states, _ = self._operate_on_dec(
+                hidden_states, skip_connections, encoder_hidden_states, *stage_args)
+        return self.proj_out(hidden_states)
+
+
+@torch.no_grad()
+def sample(model, prompt_embeds, seed, num_steps=50):
+    # euler steps of a flow from t=1000 to 0, the prompts are sampled as one batch
+    latents = torch.randn(128, prompt_embeds.shape[1], model.dim, generator=torch.Generator().manual_seed(seed))
+    timesteps = torch.linspace(1000, 0, num_steps + 1)
+    for t, t_next in zip(timesteps[:-1], timesteps[1:]):
+        velocity = model(latents, t.repeat(prompt_embeds.shape[1]), prompt_embeds)
+        latents = latents + (t_next - t) / 1000 * velocity
+    return latents
+
+
+class TestDenoisingFeatureCache:
+
+    def test_quality_vs_speed(self):
+        torch.manual_seed(1234)
+        reference_model = ToySparseUMMDiT()
+        # a fixed prompt set: 4 prompts of 16 tokens
+        prompt_embeds = torch.randn(16, 4, reference_model.dim, generator=torch.Generator().manual_seed(0))
+
+        start = time.perf_counter()
+        expected = sample(reference_model, prompt_embeds, seed=42)
+        reference_time = time.perf_counter() - start
+        reference_calls = reference_model.block_calls
+
+        errors = {}
+        for threshold in [0.0, 0.1, 0.2, 0.4]:
+            model = ToySparseUMMDiT(feature_cache={
+                "thresholds": {"enc": threshold, "mid": threshold, "dec": threshold}, "warmup_steps": 2,
+            })
+            model.load_state_dict(reference_model.state_dict())
+            start = time.perf_counter()
+            output = sample(model, prompt_embeds, seed=42)
+            elapsed = time.perf_counter() - start
+            errors[threshold] = ((output - expected).norm() / expected.norm()).item()
+            print(f"feature cache threshold {threshold}: block calls {model.block_calls}/{reference_calls}, "
+                  f"time {elapsed * 1e3:.0f}/{reference_time * 1e3:.0f} ms, relative error {errors[threshold]:.4f}, "
+                  f"stats {dict(model.feature_cache.stats)}")
+            if threshold == 0.0:
+                # nothing is reused, the cached path computes the same stages
+                judge_expression(model.block_calls == reference_calls)
+                judge_expression(torch.allclose(output, expected, atol=1e-5))
+            else:
+                judge_expression(model.block_calls < reference_calls)
+        judge_expression(errors[0.1] <= errors[0.4])
+        judge_expression(errors[0.1] < 0.05)
+
+    def test_reuse_bounds_and_reset(self):
+        cache = DenoisingFeatureCache({"mid": 1.0}, warmup_steps=1, max_reuse_steps=2)
+        computed = []
+
+        def stage_fn(hidden_states):
+            computed.append(len(computed))
+            return [hidden_states * 2]
+
+        embedding = torch.ones(1, 8)
+        for step in range(6):
+            cache.step(embedding * (1 + 0.01 * step), shape=(1, 8))
+            output = cache.run("mid", stage_fn, torch.full((1, 8), float(step)))
+            # a reused output is its input plus the residual of the last computed step
+            judge_expression(torch.equal(output[0], torch.full((1, 8), float(step) + float(3 * (step // 3)))))
+        # computed at the steps 0 and 3, reused at most 2 consecutive steps
+        judge_expression(len(computed) == 2 and cache.stats["mid_reused"] == 4)
+        # the stages not in thresholds are always computed
+        cache.run("enc", stage_fn, torch.zeros(1, 8))
+        judge_expression(len(computed) == 3 and "enc" not in cache.residuals)
+
+        # a new shape starts a new sampling run
+        cache.step(embedding, shape=(2, 8))
+        judge_expression(cache.residuals == {} and cache.num_steps == 1)
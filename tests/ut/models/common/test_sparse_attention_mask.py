@@ -0,0 +1,62 @@
+import torch
+import torch.nn.functional as F
+from einops import rearrange
+import mindspeed.megatron_adaptor
+
+from mindspeed_mm.models.common.attention import expand_key_padding_mask
+from mindspeed_mm.models.predictor.dits.sparseu_mmdit import SparseUMMDiT
+from tests.ut.utils import judge_expression
+
+
+def dense_sparse_mask(attention_mask, encoder_attention_mask, sparse_n):
+    """The dense (k b) 1 l l masks built with repeat."""
+    attention_mask = attention_mask.unsqueeze(1)
+    encoder_attention_mask = encoder_attention_mask.unsqueeze(1)
+    pad_len = (sparse_n * sparse_n - attention_mask.shape[-1] % (sparse_n * sparse_n)) % (sparse_n * sparse_n)
+    attention_mask = F.pad(attention_mask, (0, pad_len, 0, 0), value=-10000.0)
+    mask_1d = rearrange(attention_mask, 'b 1 1 (g k) -> (k b) 1 1 g', k=sparse_n)
+    mask_group = rearrange(attention_mask, 'b 1 1 (n m k) -> (m b) 1 1 (n k)', m=sparse_n, k=sparse_n)
+    encoder_attention_mask = encoder_attention_mask.repeat(sparse_n, 1, 1, 1)
+    masks = {}
+    for group, mask in [(False, mask_1d), (True, mask_group)]:
+        mask = torch.cat([mask, encoder_attention_mask], dim=-1).to(torch.bool)
+        masks[group] = mask.repeat(1, 1, mask.shape[-1], 1)
+    return masks
+
+
+def build_masks(batch_size, video_length, text_length):
+    attention_mask = torch.zeros(batch_size, 1, video_length)
+    attention_mask[:, :, video_length * 3 // 4:] = -10000.0
+    encoder_attention_mask = torch.zeros(batch_size, 1, text_length)
+    encoder_attention_mask[:, :, text_length // 2:] = -10000.0
+    return attention_mask, encoder_attention_mask
+
+
+class TestSparseAttentionMask:
+
+    def test_key_padding_mask_matches_repeat(self):
+        attention_mask, encoder_attention_mask = build_masks(2, 250, 32)
+        for sparse_n in [2, 4]:
+            masks = SparseUMMDiT.prepare_sparse_mask(None, attention_mask, encoder_attention_mask, sparse_n)
+            expected = dense_sparse_mask(attention_mask, encoder_attention_mask, sparse_n)
+            for group in [False, True]:
+                query_length = expected[group].shape[-2]
+                judge_expression(masks[group].shape[-2] == 1)
+                dense = expand_key_padding_mask(masks[group], query_length)
+                judge_expression(dense.is_contiguous() and torch.equal(dense, expected[group]))
+                # dense masks are passed through unchanged
+                judge_expression(expand_key_padding_mask(dense, query_length) is dense)
+
+    def test_dense_mask_per_key_padding_mask(self):
+        attention_mask, encoder_attention_mask = build_masks(1, 250, 32)
+        masks = SparseUMMDiT.prepare_sparse_mask(None, attention_mask, encoder_attention_mask, 2)
+        query_length = masks[False].shape[-1]
+        # the kernel saves the dense mask for the backward, the layers given the same mask share one copy
+        dense = expand_key_padding_mask(masks[False], query_length)
+        judge_expression(expand_key_padding_mask(masks[False], query_length) is dense)
+        judge_expression(expand_key_padding_mask(masks[True], query_length) is not dense)
+        judge_expression(expand_key_padding_mask(masks[False].clone(), query_length) is not dense)
+        # without grad nothing is kept after the kernel call
+        with torch.no_grad():
+            judge_expression(expand_key_padding_mask(masks[True], query_length) is not
+                             expand_key_padding_mask(masks[True], query_length))
@@ -0,0 +1,100 @@
+import torch
+from torch import nn
+import mindspeed.megatron_adaptor
+
+from mindspeed_mm.models.diffusion.diffusers_scheduler import DiffusersScheduler
+from tests.ut.utils import judge_expression
+
+
+SHAPE = (2, 4, 3, 8, 8)
+DATA_STD = 0.5
+
+
+class GaussianVelocityModel(nn.Module):
+    """
+    The exact v-prediction of the data N(prompt, DATA_STD^2) of every sample, the probability flow ODE from the
+    noise x_T at the zero terminal SNR ends at prompt + DATA_STD * x_T, the error of a solver is its distance to it.
+    """
+
+    in_channels = 4
+    out_channels = 4
+
+    def __init__(self, alphas_cumprod):
+        super().__init__()
+        self.alphas_cumprod = alphas_cumprod.double()
+        self.batch_sizes = []
+
+    def forward(self, timestep, latents, prompt, **kwargs):
+        self.batch_sizes.append(latents.shape[0])
+        alpha = self.alphas_cumprod[timestep.long()].view(-1, 1, 1, 1, 1)
+        latents, prompt = latents.double(), prompt.double()
+        pred_original_sample = prompt + DATA_STD ** 2 * alpha.sqrt() / (alpha * DATA_STD ** 2 + 1 - alpha) * (
+            latents - alpha.sqrt() * prompt)
+        noise = (latents - alpha.sqrt() * pred_original_sample) / (1 - alpha).sqrt()
+        return (alpha.sqrt() * noise - (1 - alpha).sqrt() * pred_original_sample).float()
+
+
+def build_scheduler(model_id, **config):
+    if model_id == "DDIM":
+        config.setdefault("clip_sample", False)
+    return DiffusersScheduler({
+        "model_id": model_id,
+        "prediction_type": "v_prediction",
+        "rescale_betas_zero_snr": True,
+        "device": "cpu",
+        **config,
+    })
+
+
+def run_sample(scheduler, guidance_scale=1.0):
+    generator = torch.Generator().manual_seed(0)
+    latents = torch.randn(SHAPE, generator=generator)
+    prompt = torch.randn(SHAPE, generator=generator)
+    model = GaussianVelocityModel(scheduler.diffusion.alphas_cumprod)
+    model_kwargs = {"prompt": prompt}
+    expected = prompt + DATA_STD * latents
+    if guidance_scale > 1.0:
+        negative_prompt = torch.zeros(SHAPE)
+        model_kwargs["prompt"] = torch.cat([negative_prompt, prompt])
+        expected = negative_prompt + guidance_scale * (prompt - negative_prompt) + DATA_STD * latents
+    output = scheduler.sample(model=model, shape=SHAPE, latents=latents, model_kwargs=model_kwargs,
+                              extra_step_kwargs={})
+    return output, expected, model.batch_sizes
+
+
+class TestDiffusersScheduler:
+
+    def test_guidance_interval(self):
+        guided, expected, batch_sizes = run_sample(
+            build_scheduler("DDIM", num_inference_steps=20, guidance_scale=4.5, timestep_spacing="trailing"), 4.5)
+        judge_expression(batch_sizes == [2 * SHAPE[0]] * 20)
+        judge_expression((guided - expected).norm() / expected.norm() < 0.05)
+
+        scheduler = build_scheduler("DDIM", num_inference_steps=20, guidance_scale=4.5, timestep_spacing="trailing",
+                                    guidance_interval=[200, 700])
+        output, _, batch_sizes = run_sample(scheduler, 4.5)
+        num_guided = sum(200 <= int(t) <= 700 for t in scheduler.timesteps)
+        # the unconditional half of the batch is only run in the interval
+        judge_expression(batch_sizes == [2 * SHAPE[0] if 200 <= int(t) <= 700 else SHAPE[0]
+                                         for t in scheduler.timesteps])
+        judge_expression(scheduler.nfe == 20 + num_guided)
+        judge_expression(output.shape == guided.shape and not torch.allclose(output, guided))
+
+    def test_multistep_solvers(self):
+        configs = [
+            ("DDIM", {"num_inference_steps": 100, "timestep_spacing": "trailing"}),
+            ("DDIM", {"num_inference_steps": 25, "timestep_spacing": "trailing"}),
+            ("DPMSolverMultistep", {}),
+            ("UniPCMultistep", {}),
+        ]
+        errors = {}
+        for model_id, config in configs:
+            scheduler = build_scheduler(model_id, guidance_scale=4.5, **config)
+            output, expected, _ = run_sample(scheduler, 4.5)
+            error = ((output - expected).norm() / expected.norm()).item()
+            errors[(model_id, scheduler.num_inference_steps)] = error
+
+        # the default step counts of the multistep solvers are as accurate as DDIM with 100 steps
+        judge_expression(errors[("DPMSolverMultistep", 25)] < errors[("DDIM", 25)])
+        judge_expression(errors[("UniPCMultistep", 20)] < errors[("DDIM", 25)])
+        judge_expression(errors[("DPMSolverMultistep", 25)] < 2 * errors[("DDIM", 100)])
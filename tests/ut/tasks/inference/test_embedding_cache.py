@@ -0,0 +1,103 @@
+import torch
+from transformers import BatchEncoding
+
+from mindspeed_mm.tasks.inference.pipeline.pipeline_mixin.encode_mixin import MMEncoderMixin
+from mindspeed_mm.tasks.inference.pipeline.utils.embedding_cache import PromptEmbeddingCache, get_encoder_id
+from tests.ut.utils import judge_expression
+
+
+class WordTokenizer:
+    name_or_path = "word-tokenizer"
+
+    def __init__(self):
+        self.vocab = {"<pad>": 0, "</s>": 1}
+        self.calls = 0
+
+    def __len__(self):
+        return 1000
+
+    def __call__(self, texts, padding="longest", max_length=None, truncation=False, return_tensors="pt", **kwargs):
+        self.calls += 1
+        ids = [[self.vocab.setdefault(word, len(self.vocab)) for word in text.split()] + [1] for text in texts]
+        if truncation:
+            ids = [x[:max_length - 1] + [1] if len(x) > max_length else x for x in ids]
+        length = max_length if padding == "max_length" else max(len(x) for x in ids)
+        return BatchEncoding({
+            "input_ids": torch.tensor([x + [0] * (length - len(x)) for x in ids]),
+            "attention_mask": torch.tensor([[1] * len(x) + [0] * (length - len(x)) for x in ids]),
+        })
+
+    def batch_decode(self, ids):
+        return [str(x.tolist()) for x in ids]
+
+
+class CountingEncoder(torch.nn.Module):
+    use_attention_mask = True
+
+    def __init__(self):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(1000, 8)
+        self.encoded = []
+
+    @property
+    def dtype(self):
+        return self.embedding.weight.dtype
+
+    def forward(self, input_ids, attention_mask=None):
+        self.encoded.append(input_ids.shape[0])
+        return self.embedding(input_ids).cumsum(dim=1)
+
+
+class Encoder(MMEncoderMixin):
+
+    def __init__(self, cache=None):
+        self.tokenizer = WordTokenizer()
+        self.text_encoder = CountingEncoder()
+        self.prompt_embedding_cache = cache
+
+
+class TestPromptEmbeddingCache:
+
+    def test_encode_texts(self, tmp_path):
+        prompts = ["a cat walks across the street", "a dog runs", "a cat walks across the street"]
+        reference = Encoder()
+        cached = Encoder()
+        cached.text_encoder.load_state_dict(reference.text_encoder.state_dict())
+        cached.prompt_embedding_cache = PromptEmbeddingCache(
+            get_encoder_id(cached.tokenizer, cached.text_encoder), max_size=2, cache_dir=str(tmp_path))
+
+        for _ in range(2):
+            expected = reference.encode_texts(prompts, "cpu", do_classifier_free_guidance=True, max_length=16)
+            outputs = cached.encode_texts(prompts, "cpu", do_classifier_free_guidance=True, max_length=16)
+            for output, expected_output in zip(outputs, expected):
+                judge_expression(torch.equal(output, expected_output))
+        # the two distinct prompts and the negative prompt are encoded once, in one call for the prompts
+        judge_expression(cached.text_encoder.encoded == [2, 1])
+        judge_expression(cached.prompt_embedding_cache.stats["misses"] == 3)
+
+        # a new process reads the embeddings from the disk
+        restarted = Encoder()
+        restarted.text_encoder.load_state_dict(reference.text_encoder.state_dict())
+        restarted.prompt_embedding_cache = PromptEmbeddingCache(
+            get_encoder_id(restarted.tokenizer, restarted.text_encoder), max_size=2, cache_dir=str(tmp_path))
+        restarted.tokenizer.vocab = cached.tokenizer.vocab
+        outputs = restarted.encode_texts(prompts, "cpu", do_classifier_free_guidance=True, max_length=16)
+        judge_expression(torch.equal(outputs[0], expected[0]) and restarted.text_encoder.encoded == [])
+        judge_expression(restarted.prompt_embedding_cache.stats["disk_hits"] == 3)
+
+    def test_lru_and_encoder_id(self):
+        cache = PromptEmbeddingCache("encoder", max_size=2)
+        for text in ["a", "b", "a", "c"]:
+            key = cache.get_key(text, max_length=16)
+            if cache.get(key, "cpu") is None:
+                cache.put(key, torch.randn(1, 16, 8), None)
+        # b is the least recently used entry
+        judge_expression(cache.get(cache.get_key("b", max_length=16), "cpu") is None)
+        judge_expression(cache.get(cache.get_key("a", max_length=16), "cpu") is not None)
+        judge_expression(cache.get_key("a", max_length=16) != cache.get_key("a", max_length=32))
+
+        tokenizer, encoder = WordTokenizer(), CountingEncoder()
+        encoder_id = get_encoder_id(tokenizer, encoder)
+        with torch.no_grad():
+            encoder.embedding.weight[0, 0] += 1
+        judge_expression(get_encoder_id(tokenizer, encoder) != encoder_id)
@@ -0,0 +1,24 @@
+import pytest
+
+from mindspeed_mm.tasks.inference.pipeline.utils.sora_utils import load_prompts, shard_prompts
+from tests.ut.utils import judge_expression
+
+
+class TestShardPrompts:
+
+    @pytest.mark.parametrize("num_shards", [1, 3, 8])
+    def test_shards_cover_prompts(self, num_shards):
+        costs = [93 * 352 * 640 if i % 4 == 0 else 29 * 352 * 640 for i in range(50)]
+        shards = [shard_prompts(costs, num_shards, rank) for rank in range(num_shards)]
+        judge_expression(sorted(i for shard in shards for i in shard) == list(range(len(costs))))
+        loads = [sum(costs[i] for i in shard) for shard in shards]
+        # the greedy assignment is at most one prompt away from the even split
+        judge_expression(max(loads) - min(loads) <= max(costs))
+
+    def test_load_prompts(self, tmp_path):
+        prompt_file = tmp_path / "prompts.jsonl"
+        prompt_file.write_text('{"prompt": "a cat", "input_size": [29, 352, 640]}\n{"prompt": "a dog"}\n')
+        judge_expression(load_prompts(str(prompt_file)) == [
+            {"prompt": "a cat", "input_size": [29, 352, 640]}, {"prompt": "a dog"}
+        ])
+        judge_expression(load_prompts("a single prompt") == ["a single prompt"])
@@ -0,0 +1,44 @@
+"""Clean and tokenise the captions of SoRA training data into a token store."""
+
+import torch.distributed as dist
+import mindspeed.megatron_adaptor
+from megatron.training.initialize import initialize_megatron
+from megatron.training import get_args, print_rank_0
+
+from mindspeed_mm.configs.config import merge_mm_args, mm_extra_args_provider
+from mindspeed_mm.data import build_mm_dataset
+from mindspeed_mm.data.data_utils.token_store import TokenStore
+
+
+def main():
+    initialize_megatron(extra_args_provider=mm_extra_args_provider, args_defaults={})
+    args = get_args()
+    merge_mm_args(args)
+    rank = dist.get_rank() if dist.is_initialized() else 0
+
+    dataset_param = args.mm.data.dataset_param.to_dict()
+    token_store_path = dataset_param.get("token_store_path", None)
+    if not token_store_path:
+        raise AssertionError("token_store_path must be set in dataset_param.")
+    dataset_param["token_store_path"] = None
+    dataset_param["use_feature_data"] = False
+    dataset = build_mm_dataset(dataset_param)
+
+    if rank == 0:
+        texts = set()
+        for index in range(len(dataset)):
+            texts.update(dataset.get_text_variants(dataset.data_samples[index]))
+        print(f"Tokenising {len(texts)} captions...")
+        token_store = TokenStore.build(
+            list(texts),
+            dataset.text_processer,
+            num_workers=dataset_param.get("tokenize_num_workers", 8),
+        )
+        token_store.save(token_store_path)
+    if dist.is_initialized():
+        dist.barrier()
+    print_rank_0(f"Caption tokenisation finished, tokens are saved to {token_store_path}")
+
+
+if __name__ == "__main__":
+    main()